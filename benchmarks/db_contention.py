@@ -0,0 +1,81 @@
+"""Measure leaderboard read throughput while redemptions are being written.
+
+Usage: python -m benchmarks.db_contention [--readers N] [--seconds N] [--redemptions N]
+
+N reader threads (simulating Flask workers) repeatedly read a channel
+leaderboard while one writer thread (simulating EventSub) inserts redemptions.
+This is run twice: once with the read-only connection pool (see
+NOTE[DbBase-readers]), and once with every read going through the writer
+connection.
+"""
+import argparse
+import datetime
+import pathlib
+import tempfile
+import threading
+import time
+from first.pointsdb import PointsDb, Redemption
+
+def benchmark(name: str, reader_count: int, seconds: float, redemption_count: int, use_read_pool: bool) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        points_db = PointsDb(str(pathlib.Path(temp_dir) / "points.db"))
+        redeemed_at = datetime.datetime.now(datetime.timezone.utc)
+        points_db.import_redemptions(
+            Redemption(
+                broadcaster_id="streamer",
+                redemption_id=f"existing_{i}",
+                user_id=f"user_{i % 1000}",
+                redeemed_at=redeemed_at,
+                points=5,
+                level=1,
+            )
+            for i in range(redemption_count)
+        )
+        if not use_read_pool:
+            points_db._reader_uri = None
+
+        stop = threading.Event()
+        read_counts = [0] * reader_count
+        write_count = 0
+
+        def read(reader_index: int) -> None:
+            while not stop.is_set():
+                points_db.get_lifetime_channel_points("streamer", limit=100)
+                read_counts[reader_index] += 1
+
+        def write() -> None:
+            nonlocal write_count
+            while not stop.is_set():
+                points_db.insert_new_redemption(
+                    broadcaster_id="streamer",
+                    redemption_id=f"new_{write_count}",
+                    user_id=f"user_{write_count % 1000}",
+                    redeemed_at=redeemed_at,
+                    points=5,
+                    level=1,
+                )
+                write_count += 1
+
+        threads = [threading.Thread(target=read, args=(reader_index,)) for reader_index in range(reader_count)]
+        threads.append(threading.Thread(target=write))
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    reads = sum(read_counts)
+    print(f"{name}: {reads / seconds:.0f} reads/sec, {write_count / seconds:.0f} writes/sec")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--redemptions", type=int, default=100000, help="number of redemptions in the database before the benchmark starts")
+    args = parser.parse_args()
+
+    benchmark("writer connection only", args.readers, args.seconds, args.redemptions, use_read_pool=False)
+    benchmark("read-only connection pool", args.readers, args.seconds, args.redemptions, use_read_pool=True)
+
+if __name__ == "__main__":
+    main()
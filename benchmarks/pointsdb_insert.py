@@ -0,0 +1,59 @@
+"""Compare PointsDb insert throughput with and without group commit.
+
+Usage: python -m benchmarks.pointsdb_insert [--threads N] [--redemptions-per-thread N]
+
+Each thread simulates an EventSub connection inserting redemptions as fast as
+it can. The database is a real file so that commits pay for fsync.
+"""
+import argparse
+import datetime
+import pathlib
+import tempfile
+import threading
+import time
+import typing
+from first.pointsdb import PointsDb
+
+def run_inserts(points_db: PointsDb, thread_count: int, redemptions_per_thread: int) -> float:
+    """Returns the number of seconds it took to insert every redemption."""
+    redeemed_at = datetime.datetime.now(datetime.timezone.utc)
+    def insert_redemptions(thread_index: int) -> None:
+        for i in range(redemptions_per_thread):
+            points_db.insert_new_redemption(
+                broadcaster_id=f"streamer_{thread_index}",
+                redemption_id=f"redemption_{thread_index}_{i}",
+                user_id=f"user_{i % 100}",
+                redeemed_at=redeemed_at,
+                points=5,
+                level=1,
+            )
+    threads = [threading.Thread(target=insert_redemptions, args=(thread_index,)) for thread_index in range(thread_count)]
+    start_time = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.monotonic() - start_time
+
+def benchmark(name: str, thread_count: int, redemptions_per_thread: int, set_up: typing.Callable[[PointsDb], None]) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        points_db = PointsDb(str(pathlib.Path(temp_dir) / "points.db"))
+        set_up(points_db)
+        try:
+            seconds = run_inserts(points_db, thread_count=thread_count, redemptions_per_thread=redemptions_per_thread)
+        finally:
+            points_db.stop_group_commit()
+    total = thread_count * redemptions_per_thread
+    print(f"{name}: {total} inserts in {seconds:.2f} s ({total / seconds:.0f} inserts/sec)")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--redemptions-per-thread", type=int, default=200)
+    args = parser.parse_args()
+
+    benchmark("per-row commit", args.threads, args.redemptions_per_thread, set_up=lambda points_db: None)
+    benchmark("group commit", args.threads, args.redemptions_per_thread, set_up=lambda points_db: points_db.start_group_commit())
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from first.config import cfg
-from first.db import DbBase, Timestamp
+from first.db import DbBase, SchemaMigration, Timestamp
 from first.errors import FirstAccountNotFoundError
 from first.twitch import TwitchUserId
 import sqlite3
@@ -20,7 +20,11 @@ class FirstAccountDb(DbBase):
     def __init__(self, db=accounts_config["db"]):
         super().__init__()
         self._create_sqlite3_database(db)
-        cur = self.db.cursor()
+        self._migrate([
+            SchemaMigration(version=1, description="create account", apply=self._create_account_table),
+        ])
+
+    def _create_account_table(self, cur: sqlite3.Cursor) -> None:
         cur.execute(
             (
                 "CREATE TABLE IF NOT EXISTS "
@@ -32,13 +36,13 @@ class FirstAccountDb(DbBase):
                 ")"
             )
         )
-        self._create_updated_at_trigger(table_name="account")
+        cur.execute(self._updated_at_trigger_sql(table_name="account"))
 
     def get_account_id_by_twitch_user_id(self, twitch_user_id: TwitchUserId) -> FirstAccountId:
         """Throws FirstAccountNotFoundError if no matching account was found.
         """
-        with self._lock:
-            cur = self.db.cursor()
+        with self._read_connection() as db:
+            cur = db.cursor()
             data = {
                 "twitch_user_id": twitch_user_id,
             }
@@ -76,8 +80,8 @@ class FirstAccountDb(DbBase):
         return result_fetched[0]
 
     def get_account_twitch_user_id(self, account_id: FirstAccountId) -> TwitchUserId:
-        with self._lock:
-            cur = self.db.cursor()
+        with self._read_connection() as db:
+            cur = db.cursor()
             data = {
                 "account_id": account_id,
             }
@@ -89,8 +93,8 @@ class FirstAccountDb(DbBase):
         return str(account_id)
 
     def get_account_reward_id(self, account_id: FirstAccountId) -> RewardId:
-        with self._lock:
-            cur = self.db.cursor()
+        with self._read_connection() as db:
+            cur = db.cursor()
             data = {
                 "account_id": account_id,
             }
@@ -117,8 +121,8 @@ class FirstAccountDb(DbBase):
 
     def get_all_twitch_user_ids_with_any_reward_id(self) -> typing.List[TwitchUserId]:
         twitch_user_ids = []
-        with self._lock:
-            cur = self.db.cursor()
+        with self._read_connection() as db:
+            cur = db.cursor()
             result = cur.execute("SELECT twitch_user_id FROM account WHERE reward_id IS NOT NULL")
             while True:
                 rows = result.fetchmany()
@@ -137,8 +141,8 @@ class FirstAccountDb(DbBase):
 
     def get_all_accounts_for_testing(self) -> typing.List[AccountForTesting]:
         accounts = []
-        with self._lock:
-            cur = self.db.cursor()
+        with self._read_connection() as db:
+            cur = db.cursor()
             result = cur.execute("SELECT account_id, twitch_user_id, reward_id, created_at, updated_at FROM account")
             while True:
                 rows = result.fetchmany()
@@ -1,17 +1,23 @@
 """TwitchAuthDb"""
+import logging
+import math
 import sqlite3
 import threading
+import time
 from datetime import datetime
 import typing
 from first.twitch import Twitch, TwitchUserId
 from first.config import cfg
-from first.db import DbBase, Timestamp
+from first.cache import LruCache
+from first.db import DbBase, SchemaMigration, Timestamp
 from first.errors import UserNotFoundError
 
 Token = str
 
 authdb_config = cfg["authdb"]
 
+logger = logging.getLogger(__name__)
+
 class TokenProvider(typing.Protocol):
     def get_access_token(self) -> Token: ...
     def refresh_access_token(self) -> Token: ...
@@ -35,6 +41,7 @@ class TwitchAuthDbUserTokenProvider(TokenProvider):
             user_id=self._user_id,
             access_token=refresh_result.new_access_token,
             refresh_token=refresh_result.new_refresh_token,
+            access_token_expires_in_seconds=refresh_result.new_access_token_expires_in_seconds,
         )
         return refresh_result.new_access_token
 
@@ -42,26 +49,185 @@ class TwitchAuthDbUserTokenProvider(TokenProvider):
     def user_id(self) -> TwitchUserId:
         return self._user_id
 
+class AppTokenCache:
+    """Caches Twitch's app access token.
+
+    This object is thread-safe.
+    """
+
+    # NOTE[app-token-cache]: Fetching an app access token costs a round trip
+    # to id.twitch.tv, and the token is valid for every app API request, so
+    # one token is shared by the whole process (see app_token_cache).
+    #
+    # Shortly before the token expires, the next caller fetches a new token
+    # while other callers keep using the old one. Only once the token has
+    # actually expired do callers wait, and then only one of them fetches.
+    _refresh_margin_fraction = 0.1
+    _max_refresh_margin_seconds = 60 * 60
+    # If Twitch rejects a token fetched this recently, assume another thread
+    # already replaced the rejected token.
+    _min_refresh_interval_seconds = 10
+
+    _clock: typing.Callable[[], float]
+    # Serializes fetches from Twitch.
+    _fetch_lock: threading.Lock
+
+    _lock: threading.Lock
+    # Protected by _lock:
+    _token: typing.Optional[Token] = None
+    _fetched_at: float = 0.0
+    _refresh_at: float = math.inf
+    _expires_at: float = math.inf
+
+    def __init__(self, clock: typing.Callable[[], float] = time.monotonic) -> None:
+        self._clock = clock
+        self._fetch_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def get_access_token(self) -> Token:
+        with self._lock:
+            token = self._token
+            refresh_at = self._refresh_at
+            expires_at = self._expires_at
+        now = self._clock()
+        if token is not None and now < expires_at:
+            if now >= refresh_at and self._fetch_lock.acquire(blocking=False):
+                try:
+                    token = self._fetch()
+                except Exception:
+                    logger.warning("failed to refresh app access token; using the old token", exc_info=True)
+                finally:
+                    self._fetch_lock.release()
+            return token
+        with self._fetch_lock:
+            with self._lock:
+                if self._token is not None and self._clock() < self._expires_at:
+                    # Another thread fetched a token while we waited.
+                    return self._token
+            return self._fetch()
+
+    def refresh_access_token(self) -> Token:
+        """Replace the cached token, e.g. because Twitch rejected it."""
+        with self._fetch_lock:
+            with self._lock:
+                if self._token is not None and self._clock() - self._fetched_at < self._min_refresh_interval_seconds:
+                    return self._token
+            return self._fetch()
+
+    def clear_for_testing(self) -> None:
+        with self._lock:
+            self._token = None
+            self._refresh_at = math.inf
+            self._expires_at = math.inf
+
+    def _fetch(self) -> Token:
+        """Precondition: self._fetch_lock is held."""
+        fetched_at = self._clock()
+        result = Twitch().get_app_access_token()
+        with self._lock:
+            self._token = result.access_token
+            self._fetched_at = fetched_at
+            if result.expires_in_seconds is None:
+                self._refresh_at = math.inf
+                self._expires_at = math.inf
+            else:
+                self._expires_at = fetched_at + result.expires_in_seconds
+                self._refresh_at = self._expires_at - min(result.expires_in_seconds * self._refresh_margin_fraction, self._max_refresh_margin_seconds)
+        return result.access_token
+
+# Shared by every TwitchAppTokenProvider. See NOTE[app-token-cache].
+app_token_cache = AppTokenCache()
+
 class TwitchAppTokenProvider(TokenProvider):
 
     def __init__(self) -> None: ...
 
     def get_access_token(self) -> Token:
-        twitch = Twitch()
-        return twitch.get_authenticated_app_access_token()
+        return app_token_cache.get_access_token()
 
     def refresh_access_token(self) -> Token:
-        return self.get_access_token()
+        return app_token_cache.refresh_access_token()
 
     @property
     def user_id(self) -> TwitchUserId:
         return ""
 
+class UserAccessTokenCache:
+    """Caches users' Twitch access tokens, keyed by user ID.
+
+    This object is thread-safe.
+    """
+
+    # NOTE[user-token-cache]: Every authenticated Twitch API call needs the
+    # user's access token, so access tokens are cached in memory instead of
+    # read from TwitchAuthDb per call. Like app_token_cache, one cache is
+    # shared by the whole process (see user_access_token_cache), so
+    # short-lived TwitchAuthDb objects and providers benefit too.
+    #
+    # A token put by TwitchAuthDb.update_or_create_user expires from the cache
+    # shortly before Twitch says the token expires. A token read from the
+    # database has an unknown expiry, so it is cached for
+    # _database_token_ttl_seconds. (If Twitch rejects it sooner,
+    # AuthenticatedTwitch refreshes the token, which replaces the cached
+    # token.)
+    _max_size = 10000
+    _database_token_ttl_seconds = 10 * 60
+    _expiry_margin_seconds = 60
+
+    _lock: threading.Lock
+    # Protected by _lock:
+    _tokens: LruCache[TwitchUserId, Token]
+    # Incremented by replace. Used to avoid caching a token read from the
+    # database after it was replaced.
+    _generation: int = 0
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._tokens = LruCache(max_size=self._max_size)
+
+    def get(self, user_id: TwitchUserId) -> typing.Optional[Token]:
+        with self._lock:
+            tokens = self._tokens
+        return tokens.get(user_id)
+
+    def get_generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def put_from_database(self, user_id: TwitchUserId, access_token: Token, generation: int) -> None:
+        """Cache a token read from the database, unless the token was replaced
+        since generation was retrieved with get_generation.
+        """
+        with self._lock:
+            if generation == self._generation:
+                self._tokens.put(user_id, access_token, ttl_seconds=self._database_token_ttl_seconds)
+
+    def replace(self, user_id: TwitchUserId, access_token: Token, expires_in_seconds: typing.Optional[float]) -> None:
+        with self._lock:
+            self._generation += 1
+            ttl_seconds = None if expires_in_seconds is None else expires_in_seconds - self._expiry_margin_seconds
+            if ttl_seconds is not None and ttl_seconds > 0:
+                self._tokens.put(user_id, access_token, ttl_seconds=ttl_seconds)
+            else:
+                self._tokens.discard(user_id)
+
+    def clear_for_testing(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._tokens = LruCache(max_size=self._max_size)
+
+# Shared by every TwitchAuthDb. See NOTE[user-token-cache].
+user_access_token_cache = UserAccessTokenCache()
+
 class TwitchAuthDb(DbBase):
     def __init__(self, db=authdb_config["db"]):
         super().__init__()
         self._create_sqlite3_database(db)
-        cur = self.db.cursor()
+        self._migrate([
+            SchemaMigration(version=1, description="create twitch_tokens", apply=self._create_twitch_tokens_table),
+        ])
+
+    def _create_twitch_tokens_table(self, cur: sqlite3.Cursor) -> None:
         cur.execute(
             (
                 "CREATE TABLE IF NOT EXISTS "
@@ -73,13 +239,15 @@ class TwitchAuthDb(DbBase):
                 ")"
             )
         )
-        self._create_updated_at_trigger(table_name="twitch_tokens")
+        cur.execute(self._updated_at_trigger_sql(table_name="twitch_tokens"))
 
 
-    def update_or_create_user(self, user_id: TwitchUserId, access_token: Token, refresh_token: Token):
+    def update_or_create_user(self, user_id: TwitchUserId, access_token: Token, refresh_token: Token, access_token_expires_in_seconds: typing.Optional[float] = None):
         """
         If user does not exist it creates a new one.
         If it exists, it just updates the tokens.
+
+        See NOTE[user-token-cache].
         """
         with self._lock:
             cur = self.db.cursor()
@@ -96,10 +264,21 @@ class TwitchAuthDb(DbBase):
                 ), data)
 
             self.db.commit()
+            user_access_token_cache.replace(user_id, access_token, expires_in_seconds=access_token_expires_in_seconds)
 
     def get_access_token(self, user_id: TwitchUserId) -> Token:
-        with self._lock:
-            cur = self.db.cursor()
+        """See NOTE[user-token-cache]."""
+        access_token = user_access_token_cache.get(user_id)
+        if access_token is not None:
+            return access_token
+        generation = user_access_token_cache.get_generation()
+        access_token = self._get_access_token_from_database(user_id)
+        user_access_token_cache.put_from_database(user_id, access_token, generation=generation)
+        return access_token
+
+    def _get_access_token_from_database(self, user_id: TwitchUserId) -> Token:
+        with self._read_connection() as db:
+            cur = db.cursor()
             data = {
                 "user_id": user_id,
             }
@@ -111,8 +290,8 @@ class TwitchAuthDb(DbBase):
         return access_token
 
     def get_refresh_token(self, user_id: TwitchUserId) -> Token:
-        with self._lock:
-            cur = self.db.cursor()
+        with self._read_connection() as db:
+            cur = db.cursor()
             data = {
                 "user_id": user_id,
             }
@@ -125,8 +304,8 @@ class TwitchAuthDb(DbBase):
 
     def get_all_user_ids_slow(self) -> typing.List[TwitchUserId]:
         user_ids = []
-        with self._lock:
-            cur = self.db.cursor()
+        with self._read_connection() as db:
+            cur = db.cursor()
             result = cur.execute("SELECT user_id FROM twitch_tokens")
             while True:
                 rows = result.fetchmany()
@@ -0,0 +1,177 @@
+"""Scheduled database backups"""
+import datetime
+import logging
+import os
+import pathlib
+import re
+import threading
+import time
+import typing
+from first.db import DbBase
+
+logger = logging.getLogger(__name__)
+
+class BackupStatus(typing.NamedTuple):
+    # Key of the database given to BackupScheduler, e.g. "points".
+    name: str
+    in_progress: bool = False
+    pages_copied: int = 0
+    pages_total: int = 0
+    last_started_at: typing.Optional[datetime.datetime] = None
+    last_finished_at: typing.Optional[datetime.datetime] = None
+    last_duration_seconds: typing.Optional[float] = None
+    # None if the last backup succeeded.
+    last_error: typing.Optional[str] = None
+    # Paths of the kept backups, newest first.
+    backups: typing.List[str] = []
+
+class BackupScheduler:
+    """Backs up databases into a directory, keeping the newest keep backups
+    of each database.
+
+    Backups are online (see NOTE[DbBase-backups]), so the app keeps working
+    while they run. Backups run on a background thread, either periodically
+    (see start) or on demand (see back_up_all_in_background). Only one round
+    of backups runs at a time.
+
+    This object is thread-safe.
+    """
+
+    _databases: typing.Dict[str, DbBase]
+    _directory: pathlib.Path
+    _keep: int
+    _pages_per_step: int
+    _pause_seconds: float
+    _stop_requested: threading.Event
+
+    _lock: threading.Lock
+    # Protected by _lock:
+    _statuses: typing.Dict[str, BackupStatus]
+    _is_backing_up: bool = False
+    _thread: typing.Optional[threading.Thread] = None
+
+    def __init__(self, databases: typing.Dict[str, DbBase], directory: str, keep: int = 7, pages_per_step: int = 100, pause_seconds: float = 0.005) -> None:
+        assert keep >= 1
+        self._databases = databases
+        self._directory = pathlib.Path(directory)
+        self._keep = keep
+        self._pages_per_step = pages_per_step
+        self._pause_seconds = pause_seconds
+        self._stop_requested = threading.Event()
+        self._lock = threading.Lock()
+        self._statuses = {
+            name: BackupStatus(name=name, backups=self._find_backups(name))
+            for name in databases
+        }
+
+    @property
+    def directory(self) -> str:
+        return str(self._directory)
+
+    def get_statuses(self) -> typing.List[BackupStatus]:
+        with self._lock:
+            return list(self._statuses.values())
+
+    def back_up_all(self) -> bool:
+        """Back up every database now, on the calling thread.
+
+        If a failure happens, it is recorded in the database's status and the
+        remaining databases are still backed up.
+
+        Returns False (and does nothing) if backups are already running.
+        """
+        with self._lock:
+            if self._is_backing_up:
+                return False
+            self._is_backing_up = True
+        try:
+            for (name, db) in self._databases.items():
+                self._back_up(name, db)
+        finally:
+            with self._lock:
+                self._is_backing_up = False
+        return True
+
+    def back_up_all_in_background(self) -> None:
+        """Like back_up_all, but return immediately."""
+        threading.Thread(target=self.back_up_all, name="BackupScheduler manual backup", daemon=True).start()
+
+    def start(self, interval_seconds: float) -> None:
+        """Back up every database every interval_seconds on a background
+        thread. The first backup happens after interval_seconds.
+
+        Precondition: The thread is not already running.
+        """
+        thread = threading.Thread(target=lambda: self._run_thread(interval_seconds), name="BackupScheduler", daemon=True)
+        with self._lock:
+            assert self._thread is None, "backup scheduler is already running"
+            self._stop_requested.clear()
+            thread.start()
+            self._thread = thread
+
+    def stop(self) -> None:
+        """Stop the background thread, waiting for a running backup to finish.
+
+        If the thread is not running, this function does nothing.
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None:
+            return
+        self._stop_requested.set()
+        thread.join()
+
+    def _run_thread(self, interval_seconds: float) -> None:
+        while not self._stop_requested.wait(timeout=interval_seconds):
+            if not self.back_up_all():
+                logger.info("skipping scheduled backup because a backup is already running")
+
+    def _back_up(self, name: str, db: DbBase) -> None:
+        started_at = datetime.datetime.now(datetime.timezone.utc)
+        start = time.monotonic()
+        self._update_status(name, in_progress=True, pages_copied=0, pages_total=0, last_started_at=started_at)
+        path = self._directory / f"{name}-{started_at:%Y%m%dT%H%M%S%f}Z.db"
+        try:
+            self._directory.mkdir(parents=True, exist_ok=True)
+            db.back_up_to(
+                str(path),
+                pages_per_step=self._pages_per_step,
+                pause_seconds=self._pause_seconds,
+                progress=lambda copied, total: self._update_status(name, pages_copied=copied, pages_total=total),
+            )
+            self._delete_old_backups(name)
+        except Exception as e:
+            logger.error("failed to back up %s to %s", name, path, exc_info=True)
+            self._update_status(name, in_progress=False, last_error=str(e), last_duration_seconds=time.monotonic() - start, backups=self._find_backups(name))
+            return
+        duration = time.monotonic() - start
+        logger.info("backed up %s to %s in %.1f s", name, path, duration)
+        self._update_status(
+            name,
+            in_progress=False,
+            last_finished_at=datetime.datetime.now(datetime.timezone.utc),
+            last_duration_seconds=duration,
+            last_error=None,
+            backups=self._find_backups(name),
+        )
+
+    def _update_status(self, name: str, **changes: typing.Any) -> None:
+        with self._lock:
+            self._statuses[name] = self._statuses[name]._replace(**changes)
+
+    def _delete_old_backups(self, name: str) -> None:
+        for path in self._find_backups(name)[self._keep:]:
+            logger.info("deleting old backup %s", path)
+            os.remove(path)
+
+    def _find_backups(self, name: str) -> typing.List[str]:
+        """Return the paths of name's backups, newest first."""
+        if not self._directory.is_dir():
+            return []
+        pattern = re.compile(re.escape(name) + r"-\d{8}T\d{12}Z\.db")
+        # The timestamps in the file names sort chronologically.
+        return sorted(
+            (str(path) for path in self._directory.iterdir() if pattern.fullmatch(path.name)),
+            reverse=True,
+        )
@@ -0,0 +1,89 @@
+"""Caching helpers"""
+import collections
+import threading
+import time
+import typing
+
+K = typing.TypeVar("K")
+V = typing.TypeVar("V")
+
+class LruCache(typing.Generic[K, V]):
+    """A bounded in-memory cache.
+
+    Each entry expires ttl_seconds after it is put. When the cache is full,
+    putting an entry evicts the least recently used entry.
+
+    This object is thread-safe.
+    """
+
+    class Stats(typing.NamedTuple):
+        hits: int
+        misses: int
+        size: int
+
+        @property
+        def hit_rate(self) -> float:
+            lookups = self.hits + self.misses
+            return self.hits / lookups if lookups else 0.0
+
+    class _Entry(typing.NamedTuple):
+        value: typing.Any
+        expires_at: float
+
+    _max_size: int
+    _clock: typing.Callable[[], float]
+    _lock: threading.Lock
+
+    # Protected by _lock:
+    # Least recently used first.
+    _entries: "collections.OrderedDict[typing.Any, _Entry]"
+    _hits: int = 0
+    _misses: int = 0
+
+    def __init__(self, max_size: int, clock: typing.Callable[[], float] = time.monotonic) -> None:
+        assert max_size >= 1
+        self._max_size = max_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def get(self, key: K) -> typing.Optional[V]:
+        """Return the cached value, or None if key is missing or expired."""
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return typing.cast(V, entry.value)
+
+    def peek(self, key: K) -> typing.Optional[V]:
+        """Like get, but do not count a hit or miss or mark the entry as
+        recently used.
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= now:
+                return None
+            return typing.cast(V, entry.value)
+
+    def put(self, key: K, value: V, ttl_seconds: float) -> None:
+        expires_at = self._clock() + ttl_seconds
+        with self._lock:
+            self._entries[key] = self._Entry(value=value, expires_at=expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: K) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_stats(self) -> Stats:
+        with self._lock:
+            return self.Stats(hits=self._hits, misses=self._misses, size=len(self._entries))
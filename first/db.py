@@ -1,18 +1,224 @@
+import contextlib
 import datetime
+import logging
+import os
+import pathlib
+import queue
 import sqlite3
+import sys
 import threading
+import time
 import typing
+from first.metrics import QueryName, query_metrics
 
 SQLCode = str
 SQLTableName = str
 
 Timestamp = datetime.datetime
 
+logger = logging.getLogger(__name__)
+
+# NOTE[DbBase-metrics]: Every DbBase records how long its queries spend
+# waiting for _lock, executing, fetching results, and committing, in
+# first.metrics.query_metrics. Queries are named after the repository method
+# which ran them (e.g. "PointsDb.get_lifetime_channel_points").
+#
+# The name is found by walking up the call stack when the method acquires
+# _lock or borrows a read connection, and is remembered (per thread) until it
+# releases them. Cursor and commit calls use the remembered name, so
+# recording a sample costs two clock reads and a dict lookup, which is small
+# next to the cost of a SQLite call. See also NOTE[QueryMetrics-shards].
+
+class _QueryNameLocal(threading.local):
+    # The name of the repository method which holds _lock or a read
+    # connection on this thread, if any.
+    name: typing.Optional[QueryName] = None
+
+_query_name_local = _QueryNameLocal()
+
+def _current_query_name() -> QueryName:
+    name = _query_name_local.name
+    if name is None:
+        name = _calling_query_name()
+    return name
+
+def _calling_query_name() -> QueryName:
+    """Return the qualified name of the innermost calling function outside
+    this module and contextlib.
+    """
+    frame = sys._getframe(1)
+    while frame.f_back is not None and os.path.basename(frame.f_code.co_filename) in ("db.py", "contextlib.py"):
+        frame = frame.f_back
+    return frame.f_code.co_qualname
+
+class _InstrumentedLock:
+    """A threading.Lock which records time spent waiting to acquire it.
+
+    See NOTE[DbBase-metrics].
+    """
+
+    _lock: threading.Lock
+    # Protected by _lock:
+    # The query name of this thread before it acquired _lock.
+    _outer_query_name: typing.Optional[QueryName] = None
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> None:
+        query_name = _calling_query_name()
+        start = time.perf_counter()
+        self._lock.acquire()
+        query_metrics.record(query_name, "lock_wait", time.perf_counter() - start)
+        self._outer_query_name = _query_name_local.name
+        _query_name_local.name = query_name
+
+    def __exit__(self, *exc_info) -> None:
+        _query_name_local.name = self._outer_query_name
+        self._lock.release()
+
+class _InstrumentedCursor(sqlite3.Cursor):
+    """See NOTE[DbBase-metrics]."""
+
+    def execute(self, sql, parameters=(), /):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            query_metrics.record(_current_query_name(), "execute", time.perf_counter() - start)
+
+    def executemany(self, sql, parameters, /):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            query_metrics.record(_current_query_name(), "execute", time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            query_metrics.record(_current_query_name(), "fetch", time.perf_counter() - start)
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            query_metrics.record(_current_query_name(), "fetch", time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            query_metrics.record(_current_query_name(), "fetch", time.perf_counter() - start)
+
+class _InstrumentedConnection(sqlite3.Connection):
+    """A sqlite3.Connection whose cursors record metrics.
+
+    See NOTE[DbBase-metrics].
+    """
+
+    def cursor(self, factory=_InstrumentedCursor):  # type: ignore[override]
+        return super().cursor(factory)
+
+    def commit(self) -> None:
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            query_metrics.record(_current_query_name(), "commit", time.perf_counter() - start)
+
+# NOTE[DbBase-migrations]: Each repository describes its schema as a list of
+# migrations with increasing version numbers, and calls _migrate in its
+# constructor. Applied versions are recorded in the schema_migrations table,
+# so each migration runs once per database.
+#
+# There are four kinds of migration:
+#
+# * SchemaMigration: a quick change (e.g. CREATE TABLE or ALTER TABLE ADD
+#   COLUMN), applied by _migrate in one transaction.
+# * BackfillMigration: an UPDATE of every row of a table. It is applied in
+#   chunks of rows, each in its own short transaction, releasing _lock
+#   between chunks. Progress is saved after each chunk, so an interrupted
+#   backfill resumes where it stopped.
+# * InsertBackfillMigration: an INSERT ... SELECT which copies every row of a
+#   table into another table (e.g. a rollup). It is applied in chunks of
+#   rows like a BackfillMigration, but only covers rows up to the rowid
+#   recorded by _record_insert_backfill_end (usually by the SchemaMigration
+#   which created a trigger to copy new rows), so no row is copied twice.
+# * IndexMigration: a CREATE INDEX. SQLite cannot build an index
+#   incrementally, so each index is built in its own transaction. An
+#   interrupted build is rolled back and restarts from scratch, but indexes
+#   which were already built are kept.
+#
+# Backfills and index builds on big tables are slow, so _migrate defers them
+# (unless the table is empty, which makes them instant).
+# run_online_migrations applies deferred migrations; call it before serving
+# requests. Code must keep working (perhaps slowly) while online migrations
+# are pending.
+
+class SchemaMigration(typing.NamedTuple):
+    version: int
+    description: str
+    # Called in a transaction with _lock held. Must be idempotent, because
+    # databases created before migrations existed might already have the
+    # change.
+    apply: typing.Callable[[sqlite3.Cursor], None]
+
+class BackfillMigration(typing.NamedTuple):
+    version: int
+    description: str
+    table_name: SQLTableName
+    # Assignments for UPDATE ... SET, e.g. "month = strftime('%Y-%m', t)".
+    set_sql: SQLCode
+    # Rows which need the backfill, e.g. "month IS NULL".
+    where_sql: SQLCode
+
+class InsertBackfillMigration(typing.NamedTuple):
+    version: int
+    description: str
+    # Table whose rows are copied.
+    table_name: SQLTableName
+    # An INSERT which copies the rows of table_name with
+    # :start_rowid < rowid <= :end_rowid.
+    insert_sql: SQLCode
+
+class IndexMigration(typing.NamedTuple):
+    version: int
+    description: str
+    table_name: SQLTableName
+    # Should use CREATE INDEX IF NOT EXISTS.
+    create_index_sql: SQLCode
+
+Migration = typing.Union[SchemaMigration, BackfillMigration, InsertBackfillMigration, IndexMigration]
+
+class MaintenanceResult(typing.NamedTuple):
+    seconds: float
+    # Size of the database file plus the WAL file.
+    bytes_before: int
+    bytes_after: int
+    # Free pages left because the database does not use incremental vacuum.
+    # See NOTE[DbBase-maintenance].
+    unreclaimable_free_pages: int
+
+    @property
+    def bytes_reclaimed(self) -> int:
+        return self.bytes_before - self.bytes_after
+
 class DbBase:
     """Base class for SQLite3 repository classes with useful helpers.
 
     Implemented helpers:
     * locking for thread safety (opt-in)
+    * read-only connections for concurrent reads (opt-in)
+    * attaching other databases (opt-in)
+    * query latency metrics (see NOTE[DbBase-metrics])
+    * versioned schema migrations (see NOTE[DbBase-migrations])
+    * online backups (see NOTE[DbBase-backups])
+    * maintenance (see NOTE[DbBase-maintenance])
     * created-at and updated-at columns (opt-in)
     """
 
@@ -22,12 +228,42 @@ class DbBase:
     # sqlite3 can serialize calls automatically (sqlite3.threadsafety == 3), but
     # this is a build-time setting for CPython this not guaranteed to be
     # enabled. Therefore, we must serialize/lock ourselves.
-    _lock: threading.Lock
+    _lock: _InstrumentedLock
 
+    # The writer connection. See NOTE[DbBase-lock].
     db: sqlite3.Connection
 
+    # NOTE[DbBase-readers]: File databases are opened in WAL mode. In WAL
+    # mode, readers do not block the writer and the writer does not block
+    # readers. self.db is the only connection which writes; SELECT-only
+    # methods should use _read_connection instead, which checks out a
+    # read-only connection from a pool and does not take _lock.
+    #
+    # Read-only connections see every transaction committed by self.db, but
+    # not uncommitted changes. Methods which must be atomic with writes (e.g.
+    # read-modify-write) should use self.db with _lock held instead.
+    #
+    # In-memory databases cannot be shared between connections, so
+    # _read_connection falls back to self.db with _lock held.
+    _max_idle_readers: int = 8
+    # None for in-memory databases.
+    _reader_uri: typing.Optional[str] = None
+    # None for in-memory databases.
+    _path: typing.Optional[str] = None
+    _idle_readers: "queue.LifoQueue[sqlite3.Connection]"
+    # Schema name -> path. See _attach_database.
+    _attached_databases: typing.Dict[str, str]
+
+    # See NOTE[DbBase-migrations].
+    _migrations: typing.List[Migration]
+    # Written with _lock held. Versions are only ever added, so this may be
+    # read without _lock.
+    _applied_migration_versions: typing.Set[int]
+
     def __init__(self) -> None:
-        self._lock = threading.Lock()
+        self._lock = _InstrumentedLock()
+        self._migrations = []
+        self._applied_migration_versions = set()
 
     def _create_sqlite3_database(self, path: str) -> None:
         """Create a new database file or open an existing database file.
@@ -41,7 +277,371 @@ class DbBase:
             path,
             # See NOTE[DbBase-lock].
             check_same_thread=False,
+            factory=_InstrumentedConnection,
         )
+        self._idle_readers = queue.LifoQueue(maxsize=self._max_idle_readers)
+        self._attached_databases = {}
+        # See NOTE[DbBase-maintenance]. This only affects new databases.
+        self.db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        if not self._is_in_memory_path(path):
+            # See NOTE[DbBase-readers].
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self._reader_uri = self._read_only_uri(path)
+            self._path = path
+
+    @staticmethod
+    def _is_in_memory_path(path: str) -> bool:
+        return path in (":memory:", "")
+
+    @staticmethod
+    def _read_only_uri(path: str) -> str:
+        return pathlib.Path(path).absolute().as_uri() + "?mode=ro"
+
+    def _attach_database(self, path: str, schema_name: str) -> None:
+        """Make the tables of another database file available to queries as
+        schema_name.table_name, e.g. to JOIN across databases.
+
+        The database is attached read-only to the read-only connections (see
+        NOTE[DbBase-readers]), so only _read_connection can query it. It is
+        not attached to self.db: transactions on self.db would lock the
+        attached database too, blocking the object which owns and writes to
+        it.
+
+        Precondition: neither this database nor path is an in-memory database.
+        (In-memory databases cannot be shared between connections.)
+        """
+        assert not self._is_in_memory_path(path), "in-memory databases cannot be attached"
+        assert self._reader_uri is not None, "in-memory databases cannot attach other databases"
+        assert schema_name.isidentifier()
+        with self._lock:
+            self._attached_databases[schema_name] = path
+        # Idle read-only connections were opened without the attachment.
+        # Forget them.
+        while True:
+            try:
+                self._idle_readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+    @contextlib.contextmanager
+    def _read_connection(self) -> typing.Iterator[sqlite3.Connection]:
+        """Borrow a connection for SELECT statements.
+
+        See NOTE[DbBase-readers].
+        """
+        if self._reader_uri is None:
+            with self._lock:
+                yield self.db
+            return
+
+        outer_query_name = _query_name_local.name
+        _query_name_local.name = _calling_query_name()
+        try:
+            try:
+                db = self._idle_readers.get_nowait()
+            except queue.Empty:
+                db = sqlite3.connect(
+                    self._reader_uri,
+                    uri=True,
+                    # The connection is used by one thread at a time, but not
+                    # always the same thread.
+                    check_same_thread=False,
+                    factory=_InstrumentedConnection,
+                )
+                for (schema_name, attached_path) in list(self._attached_databases.items()):
+                    db.execute(f"ATTACH DATABASE :uri AS {schema_name}", {"uri": self._read_only_uri(attached_path)})
+            try:
+                yield db
+            finally:
+                try:
+                    self._idle_readers.put_nowait(db)
+                except queue.Full:
+                    db.close()
+        finally:
+            _query_name_local.name = outer_query_name
+
+    def _migrate(self, migrations: typing.Sequence[Migration]) -> None:
+        """Apply pending schema migrations, and pending online migrations of
+        empty tables.
+
+        See NOTE[DbBase-migrations].
+        """
+        versions = [migration.version for migration in migrations]
+        assert versions == sorted(set(versions)), "migration versions must be unique and increasing"
+        self._migrations = list(migrations)
+        with self._lock:
+            cur = self.db.cursor()
+            cur.execute(
+                (
+                    "CREATE TABLE IF NOT EXISTS "
+                    "schema_migrations("
+                        "version INTEGER PRIMARY KEY NOT NULL, "
+                        "description, "
+                        "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"
+                    ")"
+                )
+            )
+            cur.execute(
+                (
+                    "CREATE TABLE IF NOT EXISTS "
+                    "migration_progress("
+                        "name PRIMARY KEY NOT NULL, "
+                        "last_rowid INTEGER NOT NULL DEFAULT 0"
+                    ")"
+                )
+            )
+            self.db.commit()
+            self._applied_migration_versions = {version for (version,) in cur.execute("SELECT version FROM schema_migrations").fetchall()}
+
+        for migration in self._migrations:
+            if migration.version in self._applied_migration_versions:
+                continue
+            if isinstance(migration, SchemaMigration):
+                self._apply_migration_in_transaction(migration, migration.apply)
+            elif self._is_table_empty(migration.table_name):
+                self._apply_online_migration(migration, chunk_size=None, pause_seconds=0)
+
+    def run_online_migrations(self, chunk_size: int = 10000, pause_seconds: float = 0.01) -> None:
+        """Apply every pending backfill and index migration.
+
+        Backfills are applied chunk_size rows at a time. _lock is released for
+        pause_seconds between chunks so other readers and writers can make
+        progress.
+
+        If this function is interrupted, calling it again resumes where it
+        stopped. See NOTE[DbBase-migrations].
+        """
+        for migration in self._migrations:
+            if migration.version in self._applied_migration_versions:
+                continue
+            assert not isinstance(migration, SchemaMigration), "_migrate should have applied schema migrations"
+            started_at = time.monotonic()
+            self._apply_online_migration(migration, chunk_size=chunk_size, pause_seconds=pause_seconds)
+            logger.info("applied migration %d (%s) in %.1f s", migration.version, migration.description, time.monotonic() - started_at)
+
+    def _is_migration_applied(self, version: int) -> bool:
+        return version in self._applied_migration_versions
+
+    def _is_table_empty(self, table_name: SQLTableName) -> bool:
+        with self._lock:
+            cur = self.db.cursor()
+            return cur.execute(f"SELECT 1 FROM {table_name} LIMIT 1").fetchone() is None
+
+    def _apply_online_migration(self, migration: typing.Union[BackfillMigration, InsertBackfillMigration, IndexMigration], chunk_size: typing.Optional[int], pause_seconds: float) -> None:
+        """If chunk_size is None, a backfill is applied in one transaction."""
+        if isinstance(migration, IndexMigration):
+            self._apply_migration_in_transaction(migration, lambda cur: cur.execute(migration.create_index_sql))
+            return
+
+        progress_name = f"v{migration.version}"
+        while True:
+            with self._lock:
+                cur = self.db.cursor()
+                cur.execute("BEGIN IMMEDIATE")
+                try:
+                    result = cur.execute("SELECT last_rowid FROM migration_progress WHERE name = :name", {"name": progress_name})
+                    result_fetched = result.fetchone()
+                    last_rowid = 0 if result_fetched is None else result_fetched[0]
+                    if isinstance(migration, InsertBackfillMigration):
+                        result = cur.execute("SELECT last_rowid FROM migration_progress WHERE name = :name", {"name": f"{progress_name}-end"})
+                        result_fetched = result.fetchone()
+                        # If no end was recorded, there is nothing to copy.
+                        max_rowid = 0 if result_fetched is None else result_fetched[0]
+                    else:
+                        max_rowid, = cur.execute(f"SELECT IFNULL(MAX(rowid), 0) FROM {migration.table_name}").fetchone()
+                    end_rowid = max_rowid if chunk_size is None else min(last_rowid + chunk_size, max_rowid)
+                    data = {
+                        "name": progress_name,
+                        "start_rowid": last_rowid,
+                        "end_rowid": end_rowid,
+                    }
+                    if isinstance(migration, InsertBackfillMigration):
+                        cur.execute(migration.insert_sql, {"start_rowid": last_rowid, "end_rowid": end_rowid})
+                    else:
+                        cur.execute(
+                            (
+                                f"UPDATE {migration.table_name} SET {migration.set_sql} "
+                                "WHERE rowid > :start_rowid AND rowid <= :end_rowid "
+                                f"AND ({migration.where_sql})"
+                            ),
+                            data
+                        )
+                    cur.execute(
+                        (
+                            "INSERT INTO migration_progress (name, last_rowid) VALUES (:name, :end_rowid) "
+                            "ON CONFLICT (name) DO UPDATE SET last_rowid = excluded.last_rowid"
+                        ),
+                        data
+                    )
+                    is_done = end_rowid >= max_rowid
+                    if is_done:
+                        self._record_migration(cur, migration)
+                except BaseException:
+                    self.db.rollback()
+                    raise
+                self.db.commit()
+                if is_done:
+                    self._applied_migration_versions.add(migration.version)
+                    return
+            time.sleep(pause_seconds)
+
+    def _apply_migration_in_transaction(self, migration: Migration, apply: typing.Callable[[sqlite3.Cursor], typing.Any]) -> None:
+        with self._lock:
+            cur = self.db.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                apply(cur)
+                self._record_migration(cur, migration)
+            except BaseException:
+                self.db.rollback()
+                raise
+            self.db.commit()
+            self._applied_migration_versions.add(migration.version)
+
+    def _record_insert_backfill_end(self, cur: sqlite3.Cursor, version: int, table_name: SQLTableName) -> None:
+        """Make the InsertBackfillMigration with the given version copy the
+        rows of table_name which exist now.
+
+        Call this in the same transaction which starts copying new rows some
+        other way (e.g. by creating a trigger). See NOTE[DbBase-migrations].
+        """
+        cur.execute(
+            (
+                "INSERT INTO migration_progress (name, last_rowid) "
+                f"SELECT :name, IFNULL(MAX(rowid), 0) FROM {table_name} WHERE true "
+                "ON CONFLICT (name) DO UPDATE SET last_rowid = excluded.last_rowid"
+            ),
+            {"name": f"v{version}-end"},
+        )
+
+    def _record_migration(self, cur: sqlite3.Cursor, migration: Migration) -> None:
+        cur.execute(
+            "INSERT INTO schema_migrations (version, description) VALUES (:version, :description)",
+            {"version": migration.version, "description": migration.description},
+        )
+
+    # NOTE[DbBase-backups]: back_up_to copies the database with SQLite's
+    # online backup API, pages_per_step pages at a time, sleeping between
+    # steps. The pages are read through a separate read-only connection which
+    # stays in one read transaction, so the copy is a consistent snapshot and
+    # (thanks to WAL; see NOTE[DbBase-readers]) writers are not blocked.
+    #
+    # While a backup runs, checkpoints cannot move the snapshot's pages out of
+    # the WAL, so the WAL might grow.
+
+    def back_up_to(self, destination_path: str, pages_per_step: int = 100, pause_seconds: float = 0.005, progress: typing.Optional[typing.Callable[[int, int], None]] = None) -> None:
+        """Copy the database to destination_path without stopping writers.
+
+        The copy is written to a temporary file which is renamed once the copy
+        is complete, so destination_path is never a partial copy.
+
+        progress (if given) is called after each step with the number of pages
+        copied so far and the total number of pages.
+
+        See NOTE[DbBase-backups].
+        """
+        temporary_path = destination_path + ".tmp"
+        destination = sqlite3.connect(temporary_path)
+        try:
+            def report_progress(_status: int, remaining: int, total: int) -> None:
+                if progress is not None:
+                    progress(total - remaining, total)
+                if remaining > 0:
+                    time.sleep(pause_seconds)
+
+            if self._reader_uri is None:
+                # In-memory databases have no other connections to read from,
+                # so copy everything at once with _lock held.
+                with self._lock:
+                    self.db.backup(destination, progress=report_progress)
+            else:
+                source = sqlite3.connect(self._reader_uri, uri=True)
+                try:
+                    # Start a read transaction so that every step copies the
+                    # same snapshot.
+                    source.execute("BEGIN")
+                    source.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+                    source.backup(destination, pages=pages_per_step, progress=report_progress)
+                finally:
+                    source.close()
+        except BaseException:
+            destination.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temporary_path)
+            raise
+        destination.close()
+        os.replace(temporary_path, destination_path)
+
+    # NOTE[DbBase-maintenance]: run_maintenance keeps a database fast and
+    # small:
+    #
+    # * PRAGMA optimize updates the query planner's statistics for tables
+    #   which changed a lot (with a limit so it stays quick on big tables).
+    # * PRAGMA incremental_vacuum returns free pages (e.g. left by DELETE) to
+    #   the file system, a few pages per transaction.
+    # * PRAGMA wal_checkpoint(TRUNCATE) copies the WAL into the database file
+    #   and empties the WAL.
+    #
+    # Incremental vacuum requires auto_vacuum=INCREMENTAL, which SQLite only
+    # honors for new databases. Older databases need a one-off VACUUM (which
+    # blocks writers, so it is not done automatically); until then, their
+    # free pages are reused but never returned to the file system.
+    #
+    # The PRAGMAs name the 'main' schema. Without it, some PRAGMAs (e.g.
+    # optimize and wal_checkpoint) also act on attached databases, which are
+    # maintained by their own DbBase.
+    #
+    # Each step holds _lock, so run_maintenance should run when traffic is
+    # low. See first.maintenance.
+
+    def run_maintenance(self, vacuum_pages_per_step: int = 1000, pause_seconds: float = 0.01) -> MaintenanceResult:
+        """See NOTE[DbBase-maintenance]."""
+        start = time.monotonic()
+        bytes_before = self._get_size_in_bytes()
+        with self._lock:
+            cur = self.db.cursor()
+            cur.execute("PRAGMA analysis_limit=1000")
+            cur.execute("PRAGMA main.optimize")
+            (auto_vacuum,) = cur.execute("PRAGMA main.auto_vacuum").fetchone()
+        unreclaimable_free_pages = 0
+        while True:
+            with self._lock:
+                cur = self.db.cursor()
+                (free_pages,) = cur.execute("PRAGMA main.freelist_count").fetchone()
+                if free_pages == 0:
+                    break
+                # 2 means INCREMENTAL.
+                if auto_vacuum != 2:
+                    unreclaimable_free_pages = free_pages
+                    break
+                cur.execute(f"PRAGMA main.incremental_vacuum({int(vacuum_pages_per_step)})").fetchall()
+            time.sleep(pause_seconds)
+        if self._reader_uri is not None:
+            with self._lock:
+                cur = self.db.cursor()
+                (busy, _wal_frames, _checkpointed_frames) = cur.execute("PRAGMA main.wal_checkpoint(TRUNCATE)").fetchone()
+            if busy:
+                logger.info("WAL checkpoint of %s was incomplete because of concurrent readers", self._path)
+        return MaintenanceResult(
+            seconds=time.monotonic() - start,
+            bytes_before=bytes_before,
+            bytes_after=self._get_size_in_bytes(),
+            unreclaimable_free_pages=unreclaimable_free_pages,
+        )
+
+    def _get_size_in_bytes(self) -> int:
+        """Return the size of the database file plus the WAL file."""
+        if self._path is None:
+            with self._lock:
+                cur = self.db.cursor()
+                (page_count,) = cur.execute("PRAGMA main.page_count").fetchone()
+                (page_size,) = cur.execute("PRAGMA main.page_size").fetchone()
+            return page_count * page_size
+        size = 0
+        for path in (self._path, self._path + "-wal"):
+            with contextlib.suppress(FileNotFoundError):
+                size += os.path.getsize(path)
+        return size
 
     def _created_at_and_updated_at_column_definitions_sql(self) -> SQLCode:
         """SQL syntax in CREATE TABLE to make two columns: 'created_at' and
@@ -60,20 +660,24 @@ class DbBase:
         """
         with self._lock:
             cur = self.db.cursor()
-            cur.execute(
-                (
-                    f"CREATE TRIGGER IF NOT EXISTS [{table_name}_update_dt]"
-                    f"  AFTER UPDATE ON {table_name} FOR EACH ROW"
-                    "  WHEN OLD.updated_at = NEW.updated_at OR OLD.updated_at IS NULL"
-                    " BEGIN"
-                    f"   UPDATE {table_name} SET updated_at=CURRENT_TIMESTAMP WHERE rowid=NEW.rowid;"
-                    " END;"
-                )
-            )
+            cur.execute(self._updated_at_trigger_sql(table_name))
+
+    def _updated_at_trigger_sql(self, table_name: SQLTableName) -> SQLCode:
+        """Like _create_updated_at_trigger, but return the SQL instead of
+        running it. Useful in migrations.
+        """
+        return (
+            f"CREATE TRIGGER IF NOT EXISTS [{table_name}_update_dt]"
+            f"  AFTER UPDATE ON {table_name} FOR EACH ROW"
+            "  WHEN OLD.updated_at = NEW.updated_at OR OLD.updated_at IS NULL"
+            " BEGIN"
+            f"   UPDATE {table_name} SET updated_at=CURRENT_TIMESTAMP WHERE rowid=NEW.rowid;"
+            " END;"
+        )
 
     def _get_created_at_and_updated_at(self, table_name: SQLTableName, where_clause: SQLCode, parameters: typing.Dict) -> typing.Tuple[Timestamp, Timestamp]:
-        with self._lock:
-            cur = self.db.cursor()
+        with self._read_connection() as db:
+            cur = db.cursor()
             result = cur.execute(f"SELECT created_at, updated_at FROM {table_name} {where_clause}", parameters)
             created_at, updated_at = result.fetchone()
         created_at = datetime.datetime.fromisoformat(created_at + "Z")
@@ -0,0 +1,378 @@
+"""Append-only journals"""
+import json
+import logging
+import os
+import threading
+import typing
+
+logger = logging.getLogger(__name__)
+
+# Byte offset into a journal file.
+JournalOffset = int
+
+class JournalEntry(typing.NamedTuple):
+    data: typing.Dict[str, typing.Any]
+    # Offset just past this entry. Reading from end_offset returns the entries
+    # after this one.
+    end_offset: JournalOffset
+
+class CorruptJournalEntryError(ValueError):
+    """A journal entry is not valid JSON."""
+
+    line: bytes
+    # Offset just past the corrupt entry.
+    end_offset: JournalOffset
+
+    def __init__(self, line: bytes, end_offset: JournalOffset) -> None:
+        super().__init__(f"corrupt journal entry ending at offset {end_offset}")
+        self.line = line
+        self.end_offset = end_offset
+
+class Journal:
+    """An append-only file of JSON entries, one entry per line.
+
+    append returns once the entry is durable. See NOTE[Journal-group-fsync].
+
+    If the process crashed while appending, the incomplete entry at the end of
+    the file is discarded when the journal is opened. Such an entry was never
+    reported as durable.
+
+    This object is thread-safe.
+    """
+
+    # NOTE[Journal-group-fsync]: fsync is slow, but one fsync makes every
+    # write before it durable. When an appender finds no fsync in progress, it
+    # fsyncs everything written so far. Appenders which arrive during that
+    # fsync wait for it to finish, then one of them fsyncs their entries
+    # together. Under a burst of appends, each fsync covers many entries.
+
+    # If no complete entry fits in this many bytes, read_entries reads more.
+    _read_size = 1 << 20
+
+    _path: str
+    _lock: threading.Lock
+    # Uses _lock. Notified when an fsync finishes.
+    _changed: threading.Condition
+
+    # Protected by _lock:
+    _file: typing.BinaryIO
+    _size: JournalOffset
+    # Entries before this offset are durable.
+    _synced_size: JournalOffset
+    _sync_in_progress: bool = False
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._file = open(path, "a+b")
+        size = self._file.seek(0, os.SEEK_END)
+        complete_size = self._find_end_of_last_entry(size)
+        if complete_size != size:
+            logger.warning("discarding %d bytes of an incomplete entry at the end of %s", size - complete_size, path)
+            self._file.truncate(complete_size)
+            os.fsync(self._file.fileno())
+        self._size = complete_size
+        self._synced_size = complete_size
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def size(self) -> JournalOffset:
+        """The offset just past the last durable entry."""
+        with self._lock:
+            return self._synced_size
+
+    def append(self, data: typing.Dict[str, typing.Any]) -> None:
+        """Append an entry and wait for it to be durable.
+
+        data must be serializable with json.dumps.
+        """
+        line = json.dumps(data, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._changed:
+            self._file.write(line)
+            self._file.flush()
+            self._size += len(line)
+            self._wait_for_sync(self._size)
+
+    def _wait_for_sync(self, offset: JournalOffset) -> None:
+        """Precondition: self._lock is held."""
+        while self._synced_size < offset:
+            if self._sync_in_progress:
+                self._changed.wait()
+                continue
+            self._sync_in_progress = True
+            sync_size = self._size
+            fd = self._file.fileno()
+            self._lock.release()
+            try:
+                os.fsync(fd)
+            finally:
+                self._lock.acquire()
+                self._sync_in_progress = False
+                self._changed.notify_all()
+            self._synced_size = max(self._synced_size, sync_size)
+
+    def read_entries(self, offset: JournalOffset, max_count: int) -> typing.List[JournalEntry]:
+        """Return up to max_count durable entries starting at offset.
+
+        offset must be 0 or the end_offset of an entry.
+
+        Entries stop before the first entry which is not valid JSON. If that
+        is the entry at offset, CorruptJournalEntryError is raised instead.
+        """
+        with self._lock:
+            end = self._synced_size
+            fd = self._file.fileno()
+        if offset >= end:
+            return []
+        data = os.pread(fd, min(end - offset, self._read_size), offset)
+        if b"\n" not in data:
+            # The next entry is huge.
+            data = os.pread(fd, end - offset, offset)
+        entries: typing.List[JournalEntry] = []
+        start = 0
+        while len(entries) < max_count:
+            newline = data.find(b"\n", start)
+            if newline == -1:
+                break
+            line = data[start:newline]
+            try:
+                entry_data = json.loads(line)
+            except ValueError as error:
+                if entries:
+                    break
+                raise CorruptJournalEntryError(line=line, end_offset=offset + newline + 1) from error
+            entries.append(JournalEntry(data=entry_data, end_offset=offset + newline + 1))
+            start = newline + 1
+        return entries
+
+    def wait_for_entries(self, offset: JournalOffset, timeout: float) -> None:
+        """Wait until there are durable entries at or after offset, until
+        wake_readers is called, or until timeout seconds pass.
+        """
+        with self._changed:
+            if self._synced_size <= offset:
+                self._changed.wait(timeout)
+
+    def wake_readers(self) -> None:
+        """Make wait_for_entries return early."""
+        with self._changed:
+            self._changed.notify_all()
+
+    def reset(self, offset: JournalOffset, before_reset: typing.Callable[[], None]) -> bool:
+        """If offset is the end of the journal, call before_reset, then delete
+        every entry.
+
+        Use this to keep the journal small once its entries are no longer
+        needed. Appends wait while before_reset runs.
+
+        Returns False (and does nothing) if entries were appended after offset.
+        """
+        with self._changed:
+            while self._sync_in_progress:
+                self._changed.wait()
+            if offset != self._size or offset != self._synced_size:
+                return False
+            before_reset()
+            self._file.truncate(0)
+            os.fsync(self._file.fileno())
+            self._size = 0
+            self._synced_size = 0
+            return True
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    def _find_end_of_last_entry(self, size: JournalOffset) -> JournalOffset:
+        """Return the offset just past the last newline in the file.
+
+        Precondition: self._lock is held or this object is being constructed.
+        """
+        fd = self._file.fileno()
+        end = size
+        while end > 0:
+            start = max(0, end - 4096)
+            index = os.pread(fd, end - start, start).rfind(b"\n")
+            if index != -1:
+                return start + index + 1
+            end = start
+        return 0
+
+class JournalProjector:
+    """Replays a Journal into another store (such as a PointsDb), optionally on
+    a background thread.
+
+    project is called with batches of entries in journal order. It must
+    durably record the end_offset of the last entry, together with the
+    effects of the batch, so that load_offset returns it after a restart.
+
+    If the process crashes after project stores the batch's effects but
+    before the offset is recorded, the batch is projected again after a
+    restart, so project must be idempotent.
+
+    Once everything has been projected and the journal has grown past
+    reset_after_bytes, the journal is emptied. reset_offset is called first,
+    and must durably record an offset of 0.
+
+    If projecting a batch fails max_attempts times in a row, the batch's
+    entries are projected one at a time, and entries which still fail are
+    logged and skipped. See NOTE[JournalProjector-dead-letters].
+
+    This object is thread-safe.
+    """
+
+    _journal: Journal
+    _load_offset: typing.Callable[[], JournalOffset]
+    _project: typing.Callable[[typing.List[JournalEntry]], None]
+    _reset_offset: typing.Callable[[], None]
+    _batch_size: int
+    _reset_after_bytes: int
+
+    # NOTE[JournalProjector-dead-letters]: One bad entry (e.g. an event which
+    # project cannot handle) must not stop every later entry from being
+    # projected. After max_attempts failures, the projector isolates the bad
+    # entries and skips them, logging each one (with its data) as a dead
+    # letter. Entries which are not valid JSON are skipped the same way,
+    # without being given to project. A skipped entry's offset is recorded by
+    # the next successful project call. If the process restarts before then, the skipped entry
+    # is retried, and skipped again if it still fails.
+    _max_attempts: int
+
+    # Serializes calls to project.
+    _project_lock: threading.Lock
+    # Protected by _project_lock:
+    _offset: typing.Optional[JournalOffset] = None
+    # Number of times projecting the batch at _offset failed in a row.
+    _failed_attempts: int = 0
+
+    _stop_requested: threading.Event
+    _thread_lock: threading.Lock
+    # Protected by _thread_lock:
+    _thread: typing.Optional[threading.Thread] = None
+
+    def __init__(
+        self,
+        journal: Journal,
+        load_offset: typing.Callable[[], JournalOffset],
+        project: typing.Callable[[typing.List[JournalEntry]], None],
+        reset_offset: typing.Callable[[], None],
+        batch_size: int = 500,
+        reset_after_bytes: int = 1 << 20,
+        max_attempts: int = 3,
+    ) -> None:
+        self._journal = journal
+        self._load_offset = load_offset
+        self._project = project
+        self._reset_offset = reset_offset
+        self._batch_size = batch_size
+        self._reset_after_bytes = reset_after_bytes
+        self._max_attempts = max_attempts
+        self._project_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._stop_requested = threading.Event()
+
+    def project_pending(self) -> int:
+        """Project every durable entry which has not been projected yet.
+
+        Returns the number of entries projected.
+        """
+        with self._project_lock:
+            if self._offset is None:
+                offset = self._load_offset()
+                if offset > self._journal.size:
+                    logger.error("journal %s is shorter than its projected offset %d; projecting it from the start", self._journal.path, offset)
+                    offset = 0
+                self._offset = offset
+            projected = 0
+            while True:
+                try:
+                    entries = self._journal.read_entries(self._offset, max_count=self._batch_size)
+                except CorruptJournalEntryError as error:
+                    logger.error("skipping corrupt dead letter at offset %d of %s: %r", self._offset, self._journal.path, error.line)
+                    self._offset = error.end_offset
+                    continue
+                if not entries:
+                    break
+                try:
+                    self._project(entries)
+                except Exception:
+                    self._failed_attempts += 1
+                    if self._failed_attempts < self._max_attempts:
+                        raise
+                    logger.error("projecting entries from %s failed %d times; projecting them one at a time", self._journal.path, self._failed_attempts, exc_info=True)
+                    self._failed_attempts = 0
+                    projected += self._project_one_at_a_time(entries)
+                    continue
+                self._failed_attempts = 0
+                self._offset = entries[-1].end_offset
+                projected += len(entries)
+            if self._offset >= self._reset_after_bytes:
+                if self._journal.reset(self._offset, before_reset=self._reset_offset):
+                    self._offset = 0
+            return projected
+
+    def _project_one_at_a_time(self, entries: typing.List[JournalEntry]) -> int:
+        """Returns the number of entries projected (not skipped).
+
+        Precondition: self._project_lock is held.
+        """
+        projected = 0
+        for entry in entries:
+            try:
+                self._project([entry])
+            except Exception:
+                logger.error("skipping dead letter at offset %d of %s: %r", self._offset, self._journal.path, entry.data, exc_info=True)
+            else:
+                projected += 1
+            self._offset = entry.end_offset
+        return projected
+
+    def start(self) -> None:
+        """Start projecting entries on a background thread as they are
+        appended.
+
+        Precondition: The thread is not already running.
+        """
+        thread = threading.Thread(target=self._run_thread, name="JournalProjector", daemon=True)
+        with self._thread_lock:
+            assert self._thread is None, "projector is already running"
+            self._stop_requested.clear()
+            thread.start()
+            self._thread = thread
+
+    def stop(self) -> None:
+        """Project every durable entry then stop the background thread.
+
+        If the thread is not running, this function does nothing.
+        """
+        with self._thread_lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._stop_requested.set()
+            self._thread = None
+        self._journal.wake_readers()
+        thread.join()
+
+    def _run_thread(self) -> None:
+        while True:
+            # Check before projecting so that entries appended before stop was
+            # called are projected.
+            should_stop = self._stop_requested.is_set()
+            try:
+                self.project_pending()
+            except Exception:
+                logger.error("failed to project entries from %s", self._journal.path, exc_info=True)
+                if should_stop or self._stop_requested.wait(timeout=5.0):
+                    return
+                continue
+            if should_stop:
+                return
+            with self._project_lock:
+                offset = self._offset
+            assert offset is not None
+            self._journal.wait_for_entries(offset, timeout=1.0)
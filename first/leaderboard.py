@@ -0,0 +1,303 @@
+"""In-memory leaderboards"""
+import bisect
+import threading
+import typing
+from first.errors import RowNotFoundError
+from first.pointsdb import LeaderboardScope, Month, PointsDb, PointsSnapshot, Redemption, StreamerId, current_month, month_of
+from first.twitch import TwitchUserId
+
+LeaderboardId = str
+# (-score, id). See Leaderboard.
+_LeaderboardKey = typing.Tuple[int, LeaderboardId]
+
+class Leaderboard:
+    """A ranking of IDs by score.
+
+    Higher scores rank first. Ties are ranked by ID, lowest first.
+
+    add_points and get_rank cost O(log n) (amortized; see
+    NOTE[Leaderboard-blocks]). Reading N entries costs O(log n + N).
+
+    This object is not thread-safe.
+    """
+
+    # NOTE[Leaderboard-blocks]: The ranking is a list of sorted blocks, each
+    # holding at most 2*_block_size entries, so inserting or removing an entry
+    # moves at most 2*_block_size list items instead of up to n.
+    #
+    # _block_index is a Fenwick tree over the blocks' lengths. It maps an entry
+    # to its rank and a rank to its block in O(log n). Splitting or deleting a
+    # block rebuilds _block_index in O(n/_block_size), which happens at most
+    # once per _block_size updates.
+    _block_size = 512
+
+    _scores: typing.Dict[LeaderboardId, int]
+    # Keys are (-score, id), so that higher scores sort first. Every block is
+    # sorted and non-empty, and every key in a block sorts before every key in
+    # the next block.
+    _blocks: typing.List[typing.List[_LeaderboardKey]]
+    # _block_maxes[i] == _blocks[i][-1]
+    _block_maxes: typing.List[_LeaderboardKey]
+    # 1-based Fenwick tree. See NOTE[Leaderboard-blocks].
+    _block_index: typing.List[int]
+
+    def __init__(self) -> None:
+        self._scores = {}
+        self._blocks = []
+        self._block_maxes = []
+        self._block_index = [0]
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def add_points(self, id: LeaderboardId, points: int) -> None:
+        old_score = self._scores.get(id)
+        if old_score is not None:
+            self._remove_key((-old_score, id))
+            new_score = old_score + points
+        else:
+            new_score = points
+        self._scores[id] = new_score
+        self._insert_key((-new_score, id))
+
+    def get_score(self, id: LeaderboardId) -> typing.Optional[int]:
+        return self._scores.get(id)
+
+    def get_rank(self, id: LeaderboardId) -> typing.Optional[int]:
+        """Return the 1-based position of id in the ranking, or None if id has
+        no score.
+        """
+        score = self._scores.get(id)
+        if score is None:
+            return None
+        key = (-score, id)
+        block_index = bisect.bisect_left(self._block_maxes, key)
+        return self._count_before_block(block_index) + bisect.bisect_left(self._blocks[block_index], key) + 1
+
+    def get_slice(self, start: int, stop: typing.Optional[int]) -> typing.List[typing.Tuple[LeaderboardId, int]]:
+        """Return (id, score) pairs ranked [start, stop), highest score first.
+        """
+        if stop is None or stop > len(self):
+            stop = len(self)
+        result: typing.List[typing.Tuple[LeaderboardId, int]] = []
+        if start >= stop:
+            return result
+        block_index, offset = self._find_position(start)
+        while len(result) < stop - start:
+            block = self._blocks[block_index]
+            for (negated_score, id) in block[offset:offset + (stop - start - len(result))]:
+                result.append((id, -negated_score))
+            block_index += 1
+            offset = 0
+        return result
+
+    def get_top(self, limit: typing.Optional[int] = None) -> typing.List[typing.Tuple[LeaderboardId, int]]:
+        return self.get_slice(0, limit)
+
+    def _insert_key(self, key: _LeaderboardKey) -> None:
+        if not self._blocks:
+            self._blocks.append([key])
+            self._block_maxes.append(key)
+            self._rebuild_block_index()
+            return
+        block_index = bisect.bisect_left(self._block_maxes, key)
+        if block_index == len(self._blocks):
+            block_index -= 1
+            self._blocks[block_index].append(key)
+            self._block_maxes[block_index] = key
+        else:
+            bisect.insort(self._blocks[block_index], key)
+        block = self._blocks[block_index]
+        if len(block) > 2 * self._block_size:
+            self._blocks.insert(block_index + 1, block[self._block_size:])
+            del block[self._block_size:]
+            self._block_maxes.insert(block_index, block[-1])
+            self._rebuild_block_index()
+        else:
+            self._update_block_index(block_index, 1)
+
+    def _remove_key(self, key: _LeaderboardKey) -> None:
+        block_index = bisect.bisect_left(self._block_maxes, key)
+        block = self._blocks[block_index]
+        index = bisect.bisect_left(block, key)
+        assert block[index] == key
+        del block[index]
+        if block:
+            self._block_maxes[block_index] = block[-1]
+            self._update_block_index(block_index, -1)
+        else:
+            del self._blocks[block_index]
+            del self._block_maxes[block_index]
+            self._rebuild_block_index()
+
+    def _rebuild_block_index(self) -> None:
+        index = [0] + [len(block) for block in self._blocks]
+        for i in range(1, len(index)):
+            parent = i + (i & -i)
+            if parent < len(index):
+                index[parent] += index[i]
+        self._block_index = index
+
+    def _update_block_index(self, block_index: int, delta: int) -> None:
+        i = block_index + 1
+        while i < len(self._block_index):
+            self._block_index[i] += delta
+            i += i & -i
+
+    def _count_before_block(self, block_index: int) -> int:
+        count = 0
+        i = block_index
+        while i > 0:
+            count += self._block_index[i]
+            i -= i & -i
+        return count
+
+    def _find_position(self, position: int) -> typing.Tuple[int, int]:
+        """Return (block index, offset within block) of the entry ranked
+        position (0-based).
+
+        Precondition: 0 <= position < len(self)
+        """
+        i = 0
+        step = 1
+        while step * 2 < len(self._block_index):
+            step *= 2
+        while step > 0:
+            if i + step < len(self._block_index) and self._block_index[i + step] <= position:
+                i += step
+                position -= self._block_index[i]
+            step //= 2
+        return (i, position)
+
+class PointsLeaderboards:
+    """Channel and streamer leaderboards kept in memory and in sync with a
+    PointsDb.
+
+    The leaderboards are loaded from the PointsDb when this object is created,
+    then updated whenever a redemption is inserted into the PointsDb. After
+    PointsDb.import_redemptions, the leaderboards are reloaded from the
+    PointsDb.
+
+    This object is thread-safe.
+    """
+
+    _lock: threading.Lock
+
+    # Protected by _lock:
+    _month: Month
+    _lifetime_channel_points: typing.Dict[StreamerId, Leaderboard]
+    _monthly_channel_points: typing.Dict[StreamerId, Leaderboard]
+    _streamers_lifetime_firsts: Leaderboard
+    _streamers_monthly_firsts: Leaderboard
+
+    def __init__(self, points_db: PointsDb) -> None:
+        self._lock = threading.Lock()
+        self._month = current_month()
+        self._lifetime_channel_points = {}
+        self._monthly_channel_points = {}
+        self._streamers_lifetime_firsts = Leaderboard()
+        self._streamers_monthly_firsts = Leaderboard()
+
+        # NOTE[PointsLeaderboards-subscribe]: _on_redemption might be called
+        # before we apply the snapshot. This is okay because points are only ever added.
+        #
+        # Do not hold self._lock while subscribing. _on_redemption is called
+        # with the PointsDb lock held then acquires self._lock, so holding
+        # self._lock here could deadlock.
+        snapshot = points_db.subscribe_to_redemptions(self._on_redemption, snapshot_listener=self._on_snapshot)
+        with self._lock:
+            self._add_snapshot(snapshot)
+
+    # NOTE[PointsLeaderboards-pagination]: Leaderboards are ordered by points
+    # (highest first) then by ID (lowest first). The returned rows are ranked
+    # [offset, offset+limit). If limit is None, all remaining rows are
+    # returned.
+
+    def get_lifetime_channel_points(self, broadcaster_id: StreamerId, limit: typing.Optional[int] = None, offset: int = 0) -> typing.List[typing.Tuple[TwitchUserId, int]]:
+        """See NOTE[PointsLeaderboards-pagination]."""
+        with self._lock:
+            leaderboard = self._lifetime_channel_points.get(broadcaster_id)
+            return [] if leaderboard is None else leaderboard.get_slice(offset, self._slice_stop(limit, offset))
+
+    def get_monthly_channel_points(self, broadcaster_id: StreamerId, limit: typing.Optional[int] = None, offset: int = 0) -> typing.List[typing.Tuple[TwitchUserId, int]]:
+        """See NOTE[PointsLeaderboards-pagination]."""
+        with self._lock:
+            self._roll_over_month_if_needed(current_month())
+            leaderboard = self._monthly_channel_points.get(broadcaster_id)
+            return [] if leaderboard is None else leaderboard.get_slice(offset, self._slice_stop(limit, offset))
+
+    def get_streamers_lifetime_leaderboard(self, limit: typing.Optional[int] = None, offset: int = 0) -> typing.List[typing.Tuple[StreamerId, int]]:
+        """See NOTE[PointsLeaderboards-pagination]."""
+        with self._lock:
+            return self._streamers_lifetime_firsts.get_slice(offset, self._slice_stop(limit, offset))
+
+    def get_streamers_monthly_leaderboard(self, limit: typing.Optional[int] = None, offset: int = 0) -> typing.List[typing.Tuple[StreamerId, int]]:
+        """See NOTE[PointsLeaderboards-pagination]."""
+        with self._lock:
+            self._roll_over_month_if_needed(current_month())
+            return self._streamers_monthly_firsts.get_slice(offset, self._slice_stop(limit, offset))
+
+    def get_user_rank(self, broadcaster_id: StreamerId, user_id: TwitchUserId, scope: LeaderboardScope) -> int:
+        """Like PointsDb.get_user_rank.
+
+        Throws RowNotFoundError if the user has no points in the leaderboard.
+        """
+        with self._lock:
+            if scope == "monthly":
+                self._roll_over_month_if_needed(current_month())
+                leaderboard = self._monthly_channel_points.get(broadcaster_id)
+            elif scope == "lifetime":
+                leaderboard = self._lifetime_channel_points.get(broadcaster_id)
+            else:
+                raise ValueError(f"unknown leaderboard scope: {scope!r}")
+            rank = None if leaderboard is None else leaderboard.get_rank(user_id)
+        if rank is None:
+            raise RowNotFoundError
+        return rank
+
+    @staticmethod
+    def _slice_stop(limit: typing.Optional[int], offset: int) -> typing.Optional[int]:
+        return None if limit is None else offset + limit
+
+    def _on_redemption(self, redemption: Redemption) -> None:
+        month = month_of(redemption.redeemed_at)
+        with self._lock:
+            self._roll_over_month_if_needed(current_month())
+            self._add_channel_points(redemption.broadcaster_id, redemption.user_id, month, redemption.points)
+            if redemption.level == 1:
+                self._add_streamer_firsts(redemption.broadcaster_id, month, 1)
+
+    def _on_snapshot(self, snapshot: PointsSnapshot) -> None:
+        with self._lock:
+            self._month = current_month()
+            self._lifetime_channel_points = {}
+            self._monthly_channel_points = {}
+            self._streamers_lifetime_firsts = Leaderboard()
+            self._streamers_monthly_firsts = Leaderboard()
+            self._add_snapshot(snapshot)
+
+    def _add_snapshot(self, snapshot: PointsSnapshot) -> None:
+        """Precondition: self._lock is held."""
+        for (broadcaster_id, user_id, month, points) in snapshot.channel_points:
+            self._add_channel_points(broadcaster_id, user_id, month, points)
+        for (broadcaster_id, month, firsts) in snapshot.streamer_firsts:
+            self._add_streamer_firsts(broadcaster_id, month, firsts)
+
+    def _add_channel_points(self, broadcaster_id: StreamerId, user_id: TwitchUserId, month: Month, points: int) -> None:
+        """Precondition: self._lock is held."""
+        self._lifetime_channel_points.setdefault(broadcaster_id, Leaderboard()).add_points(user_id, points)
+        if month == self._month:
+            self._monthly_channel_points.setdefault(broadcaster_id, Leaderboard()).add_points(user_id, points)
+
+    def _add_streamer_firsts(self, broadcaster_id: StreamerId, month: Month, firsts: int) -> None:
+        """Precondition: self._lock is held."""
+        self._streamers_lifetime_firsts.add_points(broadcaster_id, firsts)
+        if month == self._month:
+            self._streamers_monthly_firsts.add_points(broadcaster_id, firsts)
+
+    def _roll_over_month_if_needed(self, month: Month) -> None:
+        """Precondition: self._lock is held."""
+        if month != self._month:
+            self._month = month
+            self._monthly_channel_points = {}
+            self._streamers_monthly_firsts = Leaderboard()
@@ -0,0 +1,102 @@
+"""Scheduled database maintenance"""
+import datetime
+import logging
+import threading
+import typing
+from first.db import DbBase, MaintenanceResult
+
+logger = logging.getLogger(__name__)
+
+def seconds_until_hour(now: datetime.datetime, hour: int) -> float:
+    """Return the number of seconds from now until the next time the clock
+    reads hour:00 in now's time zone.
+
+    If now is exactly hour:00, returns 0.
+    """
+    assert 0 <= hour < 24
+    next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if next_run < now:
+        next_run += datetime.timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+class MaintenanceScheduler:
+    """Runs DbBase.run_maintenance on databases once a day at a quiet hour.
+
+    See NOTE[DbBase-maintenance].
+
+    This object is thread-safe.
+    """
+
+    _databases: typing.Dict[str, DbBase]
+    _stop_requested: threading.Event
+    # Serializes run_all.
+    _run_lock: threading.Lock
+
+    _lock: threading.Lock
+    # Protected by _lock:
+    _thread: typing.Optional[threading.Thread] = None
+
+    def __init__(self, databases: typing.Dict[str, DbBase]) -> None:
+        self._databases = databases
+        self._stop_requested = threading.Event()
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+
+    def run_all(self) -> typing.Dict[str, MaintenanceResult]:
+        """Maintain every database now, on the calling thread.
+
+        If maintenance of a database fails, the failure is logged and the
+        remaining databases are still maintained. Returns the results of the
+        databases which succeeded.
+        """
+        results = {}
+        with self._run_lock:
+            for (name, db) in self._databases.items():
+                try:
+                    result = db.run_maintenance()
+                except Exception:
+                    logger.error("failed to maintain %s database", name, exc_info=True)
+                    continue
+                logger.info("maintained %s database in %.2f s, reclaiming %d bytes (%d -> %d)", name, result.seconds, result.bytes_reclaimed, result.bytes_before, result.bytes_after)
+                if result.unreclaimable_free_pages:
+                    logger.info("%s database has %d free pages which can only be reclaimed with VACUUM", name, result.unreclaimable_free_pages)
+                results[name] = result
+        return results
+
+    def start(self, hour_utc: int) -> None:
+        """Maintain every database daily at hour_utc:00 UTC on a background
+        thread.
+
+        Precondition: The thread is not already running.
+        """
+        thread = threading.Thread(target=lambda: self._run_thread(hour_utc), name="MaintenanceScheduler", daemon=True)
+        with self._lock:
+            assert self._thread is None, "maintenance scheduler is already running"
+            self._stop_requested.clear()
+            thread.start()
+            self._thread = thread
+
+    def stop(self) -> None:
+        """Stop the background thread, waiting for running maintenance to
+        finish.
+
+        If the thread is not running, this function does nothing.
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None:
+            return
+        self._stop_requested.set()
+        thread.join()
+
+    def _run_thread(self, hour_utc: int) -> None:
+        while True:
+            delay = seconds_until_hour(datetime.datetime.now(datetime.timezone.utc), hour_utc)
+            # If maintenance finished just before hour_utc:00 (because the
+            # timer fired early), don't run twice.
+            if delay < 60:
+                delay += 24 * 60 * 60
+            if self._stop_requested.wait(timeout=delay):
+                return
+            self.run_all()
@@ -0,0 +1,217 @@
+"""Lightweight latency metrics"""
+import collections
+import threading
+import time
+import typing
+
+QueryName = str
+# "lock_wait", "execute", "fetch", or "commit".
+QueryPhase = str
+
+class RollingHistogram:
+    """Latency histogram covering roughly the last window_seconds *
+    window_count seconds.
+
+    Samples are counted in power-of-two microsecond buckets, so percentiles
+    are approximate (within a factor of two). Windows start at multiples of
+    window_seconds, so histograms with the same window_seconds can be merged.
+
+    This object is not thread-safe.
+    """
+
+    class Summary(typing.NamedTuple):
+        sample_count: int
+        mean_seconds: float
+        p50_seconds: float
+        p99_seconds: float
+        max_seconds: float
+
+    # Bucket i counts samples in [2**(i-1), 2**i) microseconds. The last
+    # bucket also counts every slower sample.
+    _bucket_count = 32
+
+    class _Window:
+        start: float
+        counts: typing.List[int]
+        total_seconds: float = 0.0
+        max_seconds: float = 0.0
+
+        def __init__(self, start: float, bucket_count: int) -> None:
+            self.start = start
+            self.counts = [0] * bucket_count
+
+    _window_seconds: float
+    _windows: "collections.deque[_Window]"
+
+    def __init__(self, window_seconds: float = 60, window_count: int = 10) -> None:
+        self._window_seconds = window_seconds
+        self._windows = collections.deque(maxlen=window_count)
+
+    def record(self, seconds: float, now: float) -> None:
+        start = now - now % self._window_seconds
+        if not self._windows or self._windows[-1].start != start:
+            self._windows.append(self._Window(start=start, bucket_count=self._bucket_count))
+        window = self._windows[-1]
+        bucket = min(int(seconds * 1_000_000).bit_length(), self._bucket_count - 1)
+        window.counts[bucket] += 1
+        window.total_seconds += seconds
+        if seconds > window.max_seconds:
+            window.max_seconds = seconds
+
+    def merge(self, other: "RollingHistogram") -> None:
+        """Add other's samples to this histogram.
+
+        Precondition: other has the same window_seconds as this histogram.
+        """
+        windows = {window.start: window for window in self._windows}
+        for other_window in other._windows:
+            window = windows.get(other_window.start)
+            if window is None:
+                window = self._Window(start=other_window.start, bucket_count=self._bucket_count)
+                windows[other_window.start] = window
+            for (bucket, count) in enumerate(other_window.counts):
+                window.counts[bucket] += count
+            window.total_seconds += other_window.total_seconds
+            window.max_seconds = max(window.max_seconds, other_window.max_seconds)
+        self._windows = collections.deque(sorted(windows.values(), key=lambda window: window.start), maxlen=self._windows.maxlen)
+
+    def summarize(self, now: float) -> "RollingHistogram.Summary":
+        max_age = self._window_seconds * typing.cast(int, self._windows.maxlen)
+        windows = [window for window in self._windows if now - window.start < max_age]
+        counts = [sum(window.counts[bucket] for window in windows) for bucket in range(self._bucket_count)]
+        count = sum(counts)
+        if count == 0:
+            return self.Summary(sample_count=0, mean_seconds=0.0, p50_seconds=0.0, p99_seconds=0.0, max_seconds=0.0)
+        return self.Summary(
+            sample_count=count,
+            mean_seconds=sum(window.total_seconds for window in windows) / count,
+            p50_seconds=self._percentile(counts, count, 0.50),
+            p99_seconds=self._percentile(counts, count, 0.99),
+            max_seconds=max(window.max_seconds for window in windows),
+        )
+
+    @staticmethod
+    def _percentile(counts: typing.List[int], count: int, fraction: float) -> float:
+        """Return the upper bound of the bucket containing the given
+        percentile.
+        """
+        threshold = fraction * count
+        seen = 0
+        for (bucket, bucket_count) in enumerate(counts):
+            seen += bucket_count
+            if seen >= threshold:
+                return (1 << bucket) / 1_000_000
+        return (1 << (len(counts) - 1)) / 1_000_000
+
+_HistogramKey = typing.Tuple[QueryName, QueryPhase]
+
+class QueryMetrics:
+    """Latency histograms for database queries, per query name and phase.
+
+    This object is thread-safe.
+    """
+
+    class Row(typing.NamedTuple):
+        query_name: QueryName
+        phase: QueryPhase
+        summary: RollingHistogram.Summary
+
+    # NOTE[QueryMetrics-shards]: Every database call records a sample, so
+    # record must not make threads wait for each other. Each thread records
+    # into its own shard, guarded by a lock which only get_summaries contends
+    # for. get_summaries merges the shards. Shards of threads which exited are
+    # merged into _retired so they do not pile up.
+
+    class _Shard:
+        thread: threading.Thread
+        lock: threading.Lock
+        # Protected by lock:
+        histograms: typing.Dict[_HistogramKey, RollingHistogram]
+
+        def __init__(self, thread: threading.Thread) -> None:
+            self.thread = thread
+            self.lock = threading.Lock()
+            self.histograms = {}
+
+    _local: threading.local
+
+    _lock: threading.Lock
+    # Protected by _lock:
+    _shards: typing.List[_Shard]
+    _retired: typing.Dict[_HistogramKey, RollingHistogram]
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = {}
+
+    def record(self, query_name: QueryName, phase: QueryPhase, seconds: float) -> None:
+        now = time.monotonic()
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._add_shard()
+        with shard.lock:
+            histogram = shard.histograms.get((query_name, phase))
+            if histogram is None:
+                histogram = RollingHistogram()
+                shard.histograms[(query_name, phase)] = histogram
+            histogram.record(seconds, now=now)
+
+    def _add_shard(self) -> "QueryMetrics._Shard":
+        shard = self._Shard(threading.current_thread())
+        with self._lock:
+            self._retire_exited_shards()
+            self._shards.append(shard)
+        self._local.shard = shard
+        return shard
+
+    def _retire_exited_shards(self) -> None:
+        """Precondition: self._lock is held."""
+        live_shards = []
+        for shard in self._shards:
+            if shard.thread.is_alive():
+                live_shards.append(shard)
+                continue
+            with shard.lock:
+                self._merge_histograms(self._retired, shard.histograms)
+        self._shards = live_shards
+
+    @staticmethod
+    def _merge_histograms(into: typing.Dict[_HistogramKey, RollingHistogram], histograms: typing.Dict[_HistogramKey, RollingHistogram]) -> None:
+        for (key, histogram) in histograms.items():
+            merged = into.get(key)
+            if merged is None:
+                merged = RollingHistogram()
+                into[key] = merged
+            merged.merge(histogram)
+
+    def get_summaries(self) -> typing.List[Row]:
+        """Return a summary for every query name and phase with samples,
+        slowest total time first.
+        """
+        now = time.monotonic()
+        histograms: typing.Dict[_HistogramKey, RollingHistogram] = {}
+        with self._lock:
+            self._retire_exited_shards()
+            self._merge_histograms(histograms, self._retired)
+            for shard in self._shards:
+                with shard.lock:
+                    self._merge_histograms(histograms, shard.histograms)
+        rows = [
+            self.Row(query_name=query_name, phase=phase, summary=histogram.summarize(now=now))
+            for ((query_name, phase), histogram) in histograms.items()
+        ]
+        rows = [row for row in rows if row.summary.sample_count > 0]
+        rows.sort(key=lambda row: (-row.summary.mean_seconds * row.summary.sample_count, row.query_name, row.phase))
+        return rows
+
+    def clear_for_testing(self) -> None:
+        with self._lock:
+            self._retired.clear()
+            for shard in self._shards:
+                with shard.lock:
+                    shard.histograms.clear()
+
+# Shared by every DbBase. See NOTE[DbBase-metrics].
+query_metrics = QueryMetrics()
@@ -1,24 +1,220 @@
 """PointsDb"""
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import itertools
+import json
+import logging
+import queue
 import sqlite3
+import sys
 import threading
+import time
 import typing
-from datetime import datetime
+from datetime import date, datetime, timezone
 from first.config import cfg
-from first.db import DbBase
+from first.db import BackfillMigration, DbBase, IndexMigration, InsertBackfillMigration, SchemaMigration, SQLCode, SQLTableName
 from first.errors import RowNotFoundError
 from first.twitch import TwitchUserId
 
 RewardId = str
 StreamerId = str
 Date = datetime
+Month = str
 
 points_config = cfg["pointsdb"]
 
+logger = logging.getLogger(__name__)
+
+def month_of(timestamp: datetime) -> Month:
+    """Return the calendar month of timestamp in the same format as the month
+    columns of PointsDb's tables ("YYYY-MM").
+
+    Naive timestamps are assumed to be UTC, like SQLite does.
+    """
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+    return f"{timestamp.year:04d}-{timestamp.month:02d}"
+
+def current_month() -> Month:
+    return month_of(datetime.now(timezone.utc))
+
+class Redemption(typing.NamedTuple):
+    broadcaster_id: StreamerId
+    redemption_id: RewardId
+    user_id: TwitchUserId
+    redeemed_at: Date
+    points: int
+    level: int
+
+RedemptionListener = typing.Callable[[Redemption], None]
+
+StreamSessionId = int
+
+class StreamSession(typing.NamedTuple):
+    session_id: StreamSessionId
+    broadcaster_id: StreamerId
+    # Twitch's ID for the stream.
+    stream_id: str
+    started_at: Date
+    # None if the stream is still live.
+    ended_at: typing.Optional[Date]
+
+LeaderboardScope = typing.Literal["lifetime", "monthly"]
+
+class LeaderboardRow(typing.NamedTuple):
+    # A user ID or a streamer ID, depending on the leaderboard.
+    id: str
+    # None if the user is not in the users database.
+    display_name: typing.Optional[str]
+    points: int
+
+class PointsSnapshot(typing.NamedTuple):
+    # (broadcaster_id, user_id, month, points) for every row in channel_points.
+    channel_points: typing.List[typing.Tuple[StreamerId, TwitchUserId, str, int]]
+    # (broadcaster_id, month, firsts) for every broadcaster with level 1
+    # redemptions.
+    streamer_firsts: typing.List[typing.Tuple[StreamerId, str, int]]
+
+SnapshotListener = typing.Callable[[PointsSnapshot], None]
+
+class _PendingRedemption(typing.NamedTuple):
+    redemption: Redemption
+    future: "concurrent.futures.Future[None]"
+
 class PointsDb(DbBase):
-    def __init__(self, db=points_config["db"]):
+    # Protected by _lock:
+    _redemption_listeners: typing.List[RedemptionListener]
+    _snapshot_listeners: typing.List[SnapshotListener]
+
+    # See NOTE[PointsDb-redemption-timestamps].
+    _redemption_timestamps_backfill_version = 6
+    # See NOTE[PointsDb-rollup-backfill].
+    _channel_points_backfill_version = 12
+    _channel_points_daily_backfill_version = 13
+
+    # See NOTE[PointsDb-group-commit].
+    _group_commit_lock: threading.Lock
+    # Protected by _group_commit_lock:
+    _group_commit_queue: "typing.Optional[queue.Queue[typing.Optional[_PendingRedemption]]]" = None
+    _group_commit_thread: typing.Optional[threading.Thread] = None
+
+    def __init__(self, db=points_config["db"], users_db: typing.Optional[str] = None):
+        """users_db is the path of a TwitchUsersDb database. If given, it is
+        attached so that add_display_names can JOIN against it, and db must
+        not be ":memory:".
+        """
         super().__init__()
+        self._redemption_listeners = []
+        self._snapshot_listeners = []
+        self._group_commit_lock = threading.Lock()
         self._create_sqlite3_database(db)
-        cur = self.db.cursor()
+        self._migrate([
+            SchemaMigration(version=1, description="create redemptions", apply=self._create_redemptions_table),
+            SchemaMigration(version=2, description="add redemption timestamp columns", apply=self._add_redemption_timestamp_columns),
+            # channel_points has the points per calendar month.
+            SchemaMigration(
+                version=3,
+                description="create channel_points",
+                apply=lambda cur: self._create_points_rollup(cur, table_name="channel_points", bucket_column="month", bucket_format="%Y-%m", backfill_version=self._channel_points_backfill_version),
+            ),
+            # channel_points_daily has the points per day. See
+            # get_channel_points_between.
+            SchemaMigration(
+                version=4,
+                description="create channel_points_daily",
+                apply=lambda cur: self._create_points_rollup(cur, table_name="channel_points_daily", bucket_column="day", bucket_format="%Y-%m-%d", backfill_version=self._channel_points_daily_backfill_version),
+            ),
+            SchemaMigration(version=5, description="create stream sessions", apply=self._create_stream_session_tables),
+            BackfillMigration(
+                version=self._redemption_timestamps_backfill_version,
+                description="backfill redemption timestamps",
+                table_name="redemptions",
+                set_sql=(
+                    "redeemed_at_epoch = CAST(strftime('%s', redeemed_at) AS INTEGER), "
+                    "month = strftime('%Y-%m', redeemed_at)"
+                ),
+                where_sql="redeemed_at_epoch IS NULL",
+            ),
+            IndexMigration(
+                version=7,
+                description="index redemptions by broadcaster and month",
+                table_name="redemptions",
+                create_index_sql=(
+                    "CREATE INDEX IF NOT EXISTS "
+                    "redemptions_by_broadcaster_month ON redemptions (broadcaster_id, month, user_id)"
+                ),
+            ),
+            IndexMigration(
+                version=8,
+                description="index redemptions by user and month",
+                table_name="redemptions",
+                create_index_sql=(
+                    "CREATE INDEX IF NOT EXISTS "
+                    "redemptions_by_user_month ON redemptions (user_id, month)"
+                ),
+            ),
+            IndexMigration(
+                version=9,
+                description="index redemptions by stream session",
+                table_name="redemptions",
+                create_index_sql=(
+                    "CREATE INDEX IF NOT EXISTS "
+                    "redemptions_by_session ON redemptions (session_id)"
+                ),
+            ),
+            SchemaMigration(version=10, description="create journal_offsets", apply=self._create_journal_offsets_table),
+            # Lets get_streamers_monthly_leaderboard search one month's level
+            # 1 redemptions, grouped by broadcaster, without reading the
+            # table. (redemptions_by_broadcaster_month starts with
+            # broadcaster_id, so it cannot narrow a query by month alone.)
+            IndexMigration(
+                version=11,
+                description="index redemptions by month and level",
+                table_name="redemptions",
+                create_index_sql=(
+                    "CREATE INDEX IF NOT EXISTS "
+                    "redemptions_by_month_level ON redemptions (month, level, broadcaster_id, points)"
+                ),
+            ),
+            # See NOTE[PointsDb-rollup-backfill].
+            InsertBackfillMigration(
+                version=self._channel_points_backfill_version,
+                description="backfill channel_points",
+                table_name="redemptions",
+                insert_sql=self._backfill_points_rollup_sql(table_name="channel_points", bucket_column="month", bucket_format="%Y-%m"),
+            ),
+            InsertBackfillMigration(
+                version=self._channel_points_daily_backfill_version,
+                description="backfill channel_points_daily",
+                table_name="redemptions",
+                insert_sql=self._backfill_points_rollup_sql(table_name="channel_points_daily", bucket_column="day", bucket_format="%Y-%m-%d"),
+            ),
+        ])
+        if users_db is not None:
+            self._attach_database(users_db, schema_name="users")
+
+    # NOTE[PointsDb-redemption-timestamps]: redeemed_at is stored as text by
+    # sqlite3's default datetime adapter, which is slow to filter by. Each
+    # redemption also has:
+    #
+    # * redeemed_at_epoch: redeemed_at as seconds since the Unix epoch
+    # * month: redeemed_at's calendar month in UTC ("YYYY-MM"), matching
+    #   channel_points.month
+    #
+    # Both columns are indexed together with broadcaster_id and user_id.
+    #
+    # Databases created before these columns existed are backfilled by an
+    # online migration (see NOTE[DbBase-migrations]). Until that migration
+    # finishes, queries use the old redeemed_at column instead.
+
+    @property
+    def _redemption_timestamps_migrated(self) -> bool:
+        """See NOTE[PointsDb-redemption-timestamps]."""
+        return self._is_migration_applied(self._redemption_timestamps_backfill_version)
+
+    def _create_redemptions_table(self, cur: sqlite3.Cursor) -> None:
         cur.execute(
             (
                 "CREATE TABLE IF NOT EXISTS "
@@ -33,44 +229,737 @@ class PointsDb(DbBase):
             )
         )
 
-        self._lock = threading.Lock()
+    def _add_redemption_timestamp_columns(self, cur: sqlite3.Cursor) -> None:
+        """See NOTE[PointsDb-redemption-timestamps]."""
+        columns = {name for (_cid, name, *_rest) in cur.execute("PRAGMA table_info(redemptions)").fetchall()}
+        if "redeemed_at_epoch" not in columns:
+            cur.execute("ALTER TABLE redemptions ADD COLUMN redeemed_at_epoch INTEGER")
+        if "month" not in columns:
+            cur.execute("ALTER TABLE redemptions ADD COLUMN month")
 
-    def insert_new_redemption(self, broadcaster_id: StreamerId,
-                              redemption_id: RewardId, user_id: TwitchUserId,
-                              redeemed_at: Date, points: int, level: int):
+    # NOTE[PointsDb-stream-sessions]: A stream session is the time between a
+    # stream.online EventSub event and the matching stream.offline event.
+    # Sessions are recorded in the stream_sessions table.
+    #
+    # When a redemption is inserted, redemptions.session_id is set to the
+    # broadcaster's session which was live at redeemed_at, or NULL if the
+    # broadcaster was offline. stream_session_points holds the points per
+    # user per session and is maintained by a trigger, like channel_points.
+    #
+    # stream.online can arrive after the stream's first redemptions.
+    # start_stream_session tags such redemptions when the session is created.
+
+    def _create_stream_session_tables(self, cur: sqlite3.Cursor) -> None:
+        """See NOTE[PointsDb-stream-sessions]."""
+        columns = {name for (_cid, name, *_rest) in cur.execute("PRAGMA table_info(redemptions)").fetchall()}
+        if "session_id" not in columns:
+            cur.execute("ALTER TABLE redemptions ADD COLUMN session_id INTEGER")
+        cur.execute(
+            (
+                "CREATE TABLE IF NOT EXISTS "
+                "stream_sessions("
+                    "session_id INTEGER PRIMARY KEY, "
+                    "broadcaster_id NOT NULL, "
+                    "stream_id UNIQUE NOT NULL, "
+                    "started_at_epoch INTEGER NOT NULL, "
+                    "ended_at_epoch INTEGER"
+                ")"
+            )
+        )
+        cur.execute(
+            (
+                "CREATE INDEX IF NOT EXISTS "
+                "stream_sessions_by_broadcaster ON stream_sessions (broadcaster_id, started_at_epoch)"
+            )
+        )
+        cur.execute(
+            (
+                "CREATE TABLE IF NOT EXISTS "
+                "stream_session_points("
+                    "session_id INTEGER NOT NULL, "
+                    "user_id NOT NULL, "
+                    "points INTEGER NOT NULL DEFAULT 0, "
+                    "PRIMARY KEY (session_id, user_id)"
+                ")"
+            )
+        )
+        cur.execute(
+            (
+                "CREATE INDEX IF NOT EXISTS "
+                "stream_session_points_by_points ON stream_session_points (session_id, points DESC, user_id)"
+            )
+        )
+        cur.execute(
+            (
+                "CREATE TRIGGER IF NOT EXISTS [redemptions_stream_session_points_insert]"
+                "  AFTER INSERT ON redemptions FOR EACH ROW"
+                "  WHEN NEW.session_id IS NOT NULL"
+                " BEGIN"
+                "   INSERT INTO stream_session_points (session_id, user_id, points)"
+                "   VALUES (NEW.session_id, NEW.user_id, NEW.points)"
+                "   ON CONFLICT (session_id, user_id)"
+                "   DO UPDATE SET points = points + excluded.points;"
+                " END;"
+            )
+        )
+
+    def start_stream_session(self, broadcaster_id: StreamerId, stream_id: str, started_at: Date) -> None:
+        """Record that the broadcaster went live.
+
+        If the broadcaster's previous session was never ended (e.g. because
+        stream.offline was missed), it is ended at started_at.
+
+        Calling this function again with the same stream_id does nothing.
+
+        See NOTE[PointsDb-stream-sessions].
+        """
         with self._lock:
             cur = self.db.cursor()
             data = {
                 "broadcaster_id": broadcaster_id,
-                "redemption_id": redemption_id,
-                "user_id": user_id,
-                "redeemed_at": redeemed_at,
-                "points": points,
-                "level": level,
+                "stream_id": stream_id,
+                "started_at": started_at,
+            }
+            try:
+                cur.execute(
+                    (
+                        "UPDATE stream_sessions SET ended_at_epoch = CAST(strftime('%s', :started_at) AS INTEGER) "
+                        "WHERE broadcaster_id = :broadcaster_id AND ended_at_epoch IS NULL AND stream_id != :stream_id"
+                    ),
+                    data
+                )
+                cur.execute(
+                    (
+                        "INSERT OR IGNORE INTO stream_sessions (broadcaster_id, stream_id, started_at_epoch) "
+                        "VALUES (:broadcaster_id, :stream_id, CAST(strftime('%s', :started_at) AS INTEGER))"
+                    ),
+                    data
+                )
+                if cur.rowcount == 1:
+                    # Tag redemptions which arrived before stream.online.
+                    data["session_id"] = cur.lastrowid
+                    cur.execute(
+                        (
+                            "UPDATE redemptions SET session_id = :session_id "
+                            "WHERE broadcaster_id = :broadcaster_id AND session_id IS NULL "
+                            "AND redeemed_at_epoch >= CAST(strftime('%s', :started_at) AS INTEGER)"
+                        ),
+                        data
+                    )
+                    cur.execute(
+                        (
+                            "INSERT INTO stream_session_points (session_id, user_id, points) "
+                            "SELECT session_id, user_id, SUM(points) FROM redemptions "
+                            "WHERE session_id = :session_id "
+                            "GROUP BY user_id"
+                        ),
+                        data
+                    )
+            except BaseException:
+                self.db.rollback()
+                raise
+            self.db.commit()
+
+    def end_stream_session(self, broadcaster_id: StreamerId, ended_at: Date) -> None:
+        """Record that the broadcaster went offline.
+
+        If the broadcaster has no live session, this function does nothing.
+
+        See NOTE[PointsDb-stream-sessions].
+        """
+        with self._lock:
+            cur = self.db.cursor()
+            data = {
+                "broadcaster_id": broadcaster_id,
+                "ended_at": ended_at,
             }
             cur.execute(
                 (
-                    "INSERT INTO redemptions "
-                    "(broadcaster_id, redemption_id, user_id, redeemed_at, points, level) "
-                    "VALUES(:broadcaster_id, :redemption_id, :user_id, :redeemed_at, :points, :level)"
-                ), data)
+                    "UPDATE stream_sessions SET ended_at_epoch = CAST(strftime('%s', :ended_at) AS INTEGER) "
+                    "WHERE broadcaster_id = :broadcaster_id AND ended_at_epoch IS NULL"
+                ),
+                data
+            )
+            self.db.commit()
+
+    def get_latest_stream_session(self, broadcaster_id: StreamerId) -> StreamSession:
+        """Return the broadcaster's live session, or their most recent session
+        if they are offline.
+
+        Throws RowNotFoundError if the broadcaster has never gone live.
+        """
+        with self._read_connection() as db:
+            cur = db.cursor()
+            data = {
+                "broadcaster_id": broadcaster_id,
+            }
+            result = cur.execute(
+                (
+                    "SELECT session_id, broadcaster_id, stream_id, started_at_epoch, ended_at_epoch FROM stream_sessions "
+                    "WHERE broadcaster_id = :broadcaster_id "
+                    "ORDER BY started_at_epoch DESC, session_id DESC "
+                    "LIMIT 1"
+                ),
+                data
+            )
+            result_fetched = result.fetchone()
+        if result_fetched is None:
+            raise RowNotFoundError
+        (session_id, broadcaster_id, stream_id, started_at_epoch, ended_at_epoch) = result_fetched
+        return StreamSession(
+            session_id=session_id,
+            broadcaster_id=broadcaster_id,
+            stream_id=stream_id,
+            started_at=datetime.fromtimestamp(started_at_epoch, timezone.utc),
+            ended_at=None if ended_at_epoch is None else datetime.fromtimestamp(ended_at_epoch, timezone.utc),
+        )
+
+    def _create_points_rollup(self, cur: sqlite3.Cursor, table_name: SQLTableName, bucket_column: str, bucket_format: str, backfill_version: int) -> None:
+        """Create a rollup table and keep it in sync with the redemptions
+        table.
+
+        The rollup table holds the sum of points per broadcaster, per user, per
+        time bucket. The bucket of a redemption is
+        strftime(bucket_format, redeemed_at), i.e. computed in UTC. The table
+        is maintained by a trigger, so every insert into redemptions updates
+        the rollup table in the same transaction.
+
+        If the rollup table is missing from an existing database, the
+        migration with backfill_version fills it with the existing
+        redemptions. See NOTE[PointsDb-rollup-backfill].
+        """
+        result = cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :table_name", {"table_name": table_name})
+        needs_backfill = result.fetchone() is None
+        cur.execute(
+            (
+                "CREATE TABLE IF NOT EXISTS "
+                f"{table_name}("
+                    "broadcaster_id NOT NULL, "
+                    "user_id NOT NULL, "
+                    f"{bucket_column} NOT NULL, "
+                    "points INTEGER NOT NULL DEFAULT 0, "
+                    f"PRIMARY KEY (broadcaster_id, user_id, {bucket_column})"
+                ")"
+            )
+        )
+        cur.execute(
+            (
+                "CREATE INDEX IF NOT EXISTS "
+                f"{table_name}_by_{bucket_column} ON {table_name} (broadcaster_id, {bucket_column})"
+            )
+        )
+        cur.execute(
+            (
+                f"CREATE TRIGGER IF NOT EXISTS [redemptions_{table_name}_insert]"
+                "  AFTER INSERT ON redemptions FOR EACH ROW"
+                "  WHEN NEW.redeemed_at IS NOT NULL"
+                " BEGIN"
+                f"   INSERT INTO {table_name} (broadcaster_id, user_id, {bucket_column}, points)"
+                f"   VALUES (NEW.broadcaster_id, NEW.user_id, strftime('{bucket_format}', NEW.redeemed_at), NEW.points)"
+                f"   ON CONFLICT (broadcaster_id, user_id, {bucket_column})"
+                "   DO UPDATE SET points = points + excluded.points;"
+                " END;"
+            )
+        )
+        if needs_backfill:
+            self._record_insert_backfill_end(cur, version=backfill_version, table_name="redemptions")
+
+    # NOTE[PointsDb-rollup-backfill]: Filling a new rollup table from a big
+    # redemptions table takes a while, so it is an online migration (see
+    # NOTE[DbBase-migrations]). The trigger created with the rollup table
+    # handles redemptions inserted afterwards, and the backfill copies the
+    # redemptions which existed before, a chunk at a time.
+    #
+    # Until the backfill is done, queries read a rollup computed from
+    # redemptions instead (see _points_rollup_sql).
+
+    @staticmethod
+    def _backfill_points_rollup_sql(table_name: SQLTableName, bucket_column: str, bucket_format: str) -> SQLCode:
+        """See NOTE[PointsDb-rollup-backfill]."""
+        return (
+            f"INSERT INTO {table_name} (broadcaster_id, user_id, {bucket_column}, points) "
+            f"SELECT broadcaster_id, user_id, strftime('{bucket_format}', redeemed_at), SUM(points) "
+            "FROM redemptions "
+            "WHERE rowid > :start_rowid AND rowid <= :end_rowid "
+            "AND redeemed_at IS NOT NULL "
+            f"GROUP BY broadcaster_id, user_id, strftime('{bucket_format}', redeemed_at) "
+            f"ON CONFLICT (broadcaster_id, user_id, {bucket_column}) "
+            "DO UPDATE SET points = points + excluded.points"
+        )
+
+    def _points_rollup_sql(self, table_name: SQLTableName) -> SQLCode:
+        """Return SQL for FROM which reads the given rollup table.
+
+        See NOTE[PointsDb-rollup-backfill].
+        """
+        if table_name == "channel_points":
+            (version, bucket_column, bucket_format) = (self._channel_points_backfill_version, "month", "%Y-%m")
+        elif table_name == "channel_points_daily":
+            (version, bucket_column, bucket_format) = (self._channel_points_daily_backfill_version, "day", "%Y-%m-%d")
+        else:
+            raise ValueError(f"unknown rollup table: {table_name!r}")
+        if self._is_migration_applied(version):
+            return f"{table_name} "
+        return (
+            f"(SELECT broadcaster_id, user_id, strftime('{bucket_format}', redeemed_at) AS {bucket_column}, SUM(points) AS points "
+            "FROM redemptions "
+            "WHERE redeemed_at IS NOT NULL "
+            f"GROUP BY broadcaster_id, user_id, strftime('{bucket_format}', redeemed_at)) AS {table_name} "
+        )
+
+    def insert_new_redemption(self, broadcaster_id: StreamerId,
+                              redemption_id: RewardId, user_id: TwitchUserId,
+                              redeemed_at: Date, points: int, level: int):
+        """Insert a redemption and wait for it to be committed.
+
+        If group commit is enabled, this function waits for the background
+        writer. See NOTE[PointsDb-group-commit].
+        """
+        redemption = Redemption(
+            broadcaster_id=broadcaster_id,
+            redemption_id=redemption_id,
+            user_id=user_id,
+            redeemed_at=redeemed_at,
+            points=points,
+            level=level,
+        )
+        future = self._maybe_enqueue_redemption(redemption)
+        if future is not None:
+            future.result()
+            return
+        with self._lock:
+            cur = self.db.cursor()
+            self._insert_redemption_without_commit(cur, redemption)
+            self.db.commit()
+            self._notify_redemption_listeners(redemption)
+
+    def insert_new_redemption_async(self, broadcaster_id: StreamerId,
+                                    redemption_id: RewardId, user_id: TwitchUserId,
+                                    redeemed_at: Date, points: int, level: int) -> "concurrent.futures.Future[None]":
+        """Like insert_new_redemption, but return a future instead of waiting.
+
+        The future completes once the redemption is durably committed, or
+        fails with the exception raised by the insert (e.g.
+        sqlite3.IntegrityError for a duplicate redemption_id).
+
+        If group commit is not enabled, the redemption is committed before this
+        function returns.
+        """
+        redemption = Redemption(
+            broadcaster_id=broadcaster_id,
+            redemption_id=redemption_id,
+            user_id=user_id,
+            redeemed_at=redeemed_at,
+            points=points,
+            level=level,
+        )
+        queued_future = self._maybe_enqueue_redemption(redemption)
+        if queued_future is not None:
+            return queued_future
+        future: concurrent.futures.Future[None] = concurrent.futures.Future()
+        try:
+            self.insert_new_redemption(**redemption._asdict())
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+        return future
+
+    # NOTE[PointsDb-group-commit]: Committing costs an fsync. When many
+    # redemptions arrive at once (e.g. when many streams go live), committing
+    # each redemption separately limits throughput.
+    #
+    # In group commit mode, inserts are queued and a background writer thread
+    # inserts them in batches, committing each batch in a single transaction.
+    # A batch is committed once it has max_batch_size redemptions or once its
+    # oldest redemption has waited max_delay_seconds, whichever comes first.
+    #
+    # With max_delay_seconds=0, the writer commits whatever is queued without
+    # waiting. Batches still form naturally: redemptions queue up while the
+    # previous batch is being committed.
+
+    def start_group_commit(self, max_batch_size: int = 500, max_delay_seconds: float = 0) -> None:
+        """Start the background writer. See NOTE[PointsDb-group-commit].
+
+        Precondition: Group commit is not already running.
+        """
+        assert max_batch_size >= 1
+        group_commit_queue: queue.Queue[typing.Optional[_PendingRedemption]] = queue.Queue()
+        thread = threading.Thread(
+            target=lambda: self._run_group_commit_thread(group_commit_queue, max_batch_size=max_batch_size, max_delay_seconds=max_delay_seconds),
+            name="PointsDb group commit",
+            daemon=True,
+        )
+        with self._group_commit_lock:
+            assert self._group_commit_thread is None, "group commit is already running"
+            thread.start()
+            self._group_commit_thread = thread
+            self._group_commit_queue = group_commit_queue
+
+    def stop_group_commit(self) -> None:
+        """Commit all queued redemptions then stop the background writer.
+
+        If group commit is not running, this function does nothing.
+        """
+        with self._group_commit_lock:
+            group_commit_queue = self._group_commit_queue
+            thread = self._group_commit_thread
+            if group_commit_queue is None or thread is None:
+                return
+            self._group_commit_queue = None
+            self._group_commit_thread = None
+            # No redemptions can be queued after this sentinel.
+            group_commit_queue.put(None)
+        thread.join()
+
+    def _maybe_enqueue_redemption(self, redemption: Redemption) -> "typing.Optional[concurrent.futures.Future[None]]":
+        """Queue redemption for the background writer.
+
+        Returns None if group commit is not running.
+        """
+        with self._group_commit_lock:
+            if self._group_commit_queue is None:
+                return None
+            future: concurrent.futures.Future[None] = concurrent.futures.Future()
+            self._group_commit_queue.put(_PendingRedemption(redemption=redemption, future=future))
+            return future
+
+    def _run_group_commit_thread(self, group_commit_queue: "queue.Queue[typing.Optional[_PendingRedemption]]", max_batch_size: int, max_delay_seconds: float) -> None:
+        while True:
+            first_pending = group_commit_queue.get()
+            if first_pending is None:
+                return
+            batch = [first_pending]
+            should_stop = False
+            deadline = time.monotonic() + max_delay_seconds
+            while len(batch) < max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        pending = group_commit_queue.get(timeout=timeout)
+                    else:
+                        pending = group_commit_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if pending is None:
+                    should_stop = True
+                    break
+                batch.append(pending)
+            self._commit_batch(batch)
+            if should_stop:
+                return
 
+    def _commit_batch(self, batch: typing.List[_PendingRedemption]) -> None:
+        inserted: typing.List[_PendingRedemption] = []
+        failures: typing.List[typing.Tuple[_PendingRedemption, Exception]] = []
+        with self._lock:
+            cur = self.db.cursor()
+            try:
+                for pending in batch:
+                    try:
+                        self._insert_redemption_without_commit(cur, pending.redemption)
+                    except sqlite3.IntegrityError as e:
+                        # A failed INSERT only undoes its own statement.
+                        # The rest of the transaction survives.
+                        failures.append((pending, e))
+                    else:
+                        inserted.append(pending)
+                self.db.commit()
+            except Exception as e:
+                self.db.rollback()
+                logger.error("failed to commit a batch of %d redemptions", len(batch), exc_info=True)
+                for pending in batch:
+                    pending.future.set_exception(e)
+                return
+            for pending in inserted:
+                pending.future.set_result(None)
+            for (pending, exception) in failures:
+                pending.future.set_exception(exception)
+            for pending in inserted:
+                self._notify_redemption_listeners(pending.redemption)
+
+    # NOTE[PointsDb-journal]: Redemptions can be appended to a Journal (see
+    # first.journal) then projected into this database in batches. The
+    # journal_offsets table records how much of each journal has been
+    # projected. insert_journaled_redemptions updates it in the same
+    # transaction as the inserts, so after a crash, projection resumes at the
+    # first batch which was not committed.
+
+    def _create_journal_offsets_table(self, cur: sqlite3.Cursor) -> None:
+        """See NOTE[PointsDb-journal]."""
+        cur.execute(
+            (
+                "CREATE TABLE IF NOT EXISTS "
+                "journal_offsets("
+                    "journal_name TEXT PRIMARY KEY, "
+                    "journal_offset INTEGER NOT NULL"
+                ")"
+            )
+        )
+
+    def get_journal_offset(self, journal_name: str) -> int:
+        """Return the offset recorded by insert_journaled_redemptions or
+        set_journal_offset, or 0 if there is none.
+
+        See NOTE[PointsDb-journal].
+        """
+        with self._read_connection() as db:
+            cur = db.cursor()
+            data = {"journal_name": journal_name}
+            row = cur.execute("SELECT journal_offset FROM journal_offsets WHERE journal_name = :journal_name", data).fetchone()
+        return 0 if row is None else row[0]
+
+    def set_journal_offset(self, journal_name: str, journal_offset: int) -> None:
+        """See NOTE[PointsDb-journal]."""
+        with self._lock:
+            cur = self.db.cursor()
+            self._set_journal_offset_without_commit(cur, journal_name, journal_offset)
             self.db.commit()
 
-    def get_monthly_channel_points(self, broadcaster_id: StreamerId) -> typing.List[typing.Tuple[TwitchUserId, int]]:
+    def insert_journaled_redemptions(self, redemptions: typing.Sequence[Redemption], journal_name: str, journal_offset: int) -> typing.List[Redemption]:
+        """Insert redemptions and record journal_offset in one transaction.
+
+        Redemptions whose redemption_id is already in the database are
+        skipped, so inserting the same batch twice is harmless. Returns the
+        redemptions which were inserted.
+
+        See NOTE[PointsDb-journal].
+        """
+        inserted = []
         with self._lock:
             cur = self.db.cursor()
+            try:
+                for redemption in redemptions:
+                    cur.execute(f"INSERT OR IGNORE {self._insert_redemption_sql}", redemption._asdict())
+                    if cur.rowcount == 1:
+                        inserted.append(redemption)
+                self._set_journal_offset_without_commit(cur, journal_name, journal_offset)
+            except BaseException:
+                self.db.rollback()
+                raise
+            self.db.commit()
+            for redemption in inserted:
+                self._notify_redemption_listeners(redemption)
+        return inserted
+
+    def _set_journal_offset_without_commit(self, cur: sqlite3.Cursor, journal_name: str, journal_offset: int) -> None:
+        """Precondition: self._lock is held."""
+        data = {
+            "journal_name": journal_name,
+            "journal_offset": journal_offset,
+        }
+        cur.execute(
+            (
+                "INSERT INTO journal_offsets (journal_name, journal_offset) "
+                "VALUES (:journal_name, :journal_offset) "
+                "ON CONFLICT (journal_name) DO UPDATE SET journal_offset = excluded.journal_offset"
+            ),
+            data
+        )
+
+    def _insert_redemption_without_commit(self, cur: sqlite3.Cursor, redemption: Redemption) -> None:
+        """Precondition: self._lock is held."""
+        cur.execute(f"INSERT {self._insert_redemption_sql}", redemption._asdict())
+
+    # Follows "INSERT" or "INSERT OR IGNORE".
+    _insert_redemption_sql = (
+        "INTO redemptions "
+        "(broadcaster_id, redemption_id, user_id, redeemed_at, points, level, redeemed_at_epoch, month, session_id) "
+        "VALUES(:broadcaster_id, :redemption_id, :user_id, :redeemed_at, :points, :level, "
+        "CAST(strftime('%s', :redeemed_at) AS INTEGER), strftime('%Y-%m', :redeemed_at), "
+        # See NOTE[PointsDb-stream-sessions].
+        "(SELECT session_id FROM stream_sessions "
+        "WHERE broadcaster_id = :broadcaster_id "
+        "AND started_at_epoch <= CAST(strftime('%s', :redeemed_at) AS INTEGER) "
+        "AND (ended_at_epoch IS NULL OR ended_at_epoch >= CAST(strftime('%s', :redeemed_at) AS INTEGER)) "
+        "ORDER BY started_at_epoch DESC "
+        "LIMIT 1))"
+    )
+
+    def _notify_redemption_listeners(self, redemption: Redemption) -> None:
+        """Precondition: self._lock is held, and redemption is committed.
+
+        A listener which raises is logged, so it cannot undo or hide the
+        commit.
+        """
+        for listener in self._redemption_listeners:
+            try:
+                listener(redemption)
+            except Exception:
+                logger.error("redemption listener failed for redemption %s", redemption.redemption_id, exc_info=True)
+
+    class ImportResult(typing.NamedTuple):
+        # Number of redemptions given to import_redemptions.
+        read: int
+        # Number of redemptions which were not already in the database.
+        inserted: int
+
+    def import_redemptions(self, redemptions: typing.Iterable[Redemption], batch_size: int = 10000, progress: typing.Optional[typing.Callable[[ImportResult], None]] = None) -> ImportResult:
+        """Insert many redemptions efficiently.
+
+        Redemptions whose redemption_id is already in the database are
+        skipped.
+
+        redemptions is consumed lazily, batch_size redemptions at a time, and
+        each batch is committed in one transaction. progress (if given) is
+        called after each batch with the running totals.
+
+        Redemption listeners (see subscribe_to_redemptions) are not called for
+        imported redemptions. Instead, after the import, snapshot listeners
+        are called with new totals.
+        """
+        read = 0
+        inserted = 0
+        iterator = iter(redemptions)
+        while True:
+            batch = list(itertools.islice(iterator, batch_size))
+            if not batch:
+                break
+            with self._lock:
+                cur = self.db.cursor()
+                try:
+                    cur.executemany(f"INSERT OR IGNORE {self._insert_redemption_sql}", (redemption._asdict() for redemption in batch))
+                    batch_inserted = cur.rowcount
+                except BaseException:
+                    self.db.rollback()
+                    raise
+                self.db.commit()
+            read += len(batch)
+            inserted += batch_inserted
+            if progress is not None:
+                progress(self.ImportResult(read=read, inserted=inserted))
+        if inserted > 0:
+            with self._lock:
+                if self._snapshot_listeners:
+                    snapshot = self._read_points_snapshot(self.db.cursor())
+                    for snapshot_listener in self._snapshot_listeners:
+                        snapshot_listener(snapshot)
+        return self.ImportResult(read=read, inserted=inserted)
+
+    def export_redemptions(self, batch_size: int = 10000) -> typing.Iterator[Redemption]:
+        """Yield every redemption in insertion order.
+
+        Redemptions are fetched batch_size at a time. The lock is not held
+        while the caller consumes the redemptions.
+        """
+        last_rowid = 0
+        while True:
+            with self._read_connection() as db:
+                cur = db.cursor()
+                data = {
+                    "last_rowid": last_rowid,
+                    "batch_size": batch_size,
+                }
+                rows = cur.execute(
+                    (
+                        "SELECT rowid, broadcaster_id, redemption_id, user_id, redeemed_at, points, level FROM redemptions "
+                        "WHERE rowid > :last_rowid "
+                        "ORDER BY rowid "
+                        "LIMIT :batch_size"
+                    ),
+                    data
+                ).fetchall()
+            if not rows:
+                return
+            for (rowid, broadcaster_id, redemption_id, user_id, redeemed_at, points, level) in rows:
+                yield Redemption(
+                    broadcaster_id=broadcaster_id,
+                    redemption_id=redemption_id,
+                    user_id=user_id,
+                    redeemed_at=datetime.fromisoformat(redeemed_at),
+                    points=points,
+                    level=level,
+                )
+                last_rowid = rowid
+
+    def subscribe_to_redemptions(self, listener: RedemptionListener, snapshot_listener: typing.Optional[SnapshotListener] = None) -> PointsSnapshot:
+        """Read the current points totals and register listener to be called
+        for every redemption inserted afterwards.
+
+        The snapshot and the registration are atomic: every redemption is
+        either counted in the returned snapshot or given to listener, never
+        both.
+
+        Some redemptions are inserted without calling listener (see
+        import_redemptions). After they are inserted, snapshot_listener (if
+        given) is called with new totals which replace the earlier snapshot
+        and every redemption given to listener so far.
+
+        listener and snapshot_listener are called after the redemptions are
+        committed, with the database lock held. They must be fast and must
+        not call back into this PointsDb.
+        """
+        with self._lock:
+            snapshot = self._read_points_snapshot(self.db.cursor())
+            self._redemption_listeners.append(listener)
+            if snapshot_listener is not None:
+                self._snapshot_listeners.append(snapshot_listener)
+        return snapshot
+
+    def _read_points_snapshot(self, cur: sqlite3.Cursor) -> PointsSnapshot:
+        """Precondition: self._lock is held."""
+        channel_points = cur.execute(
+            f"SELECT broadcaster_id, user_id, month, points FROM {self._points_rollup_sql('channel_points')}"
+        ).fetchall()
+        streamer_firsts = cur.execute(
+            (
+                "SELECT broadcaster_id, strftime('%Y-%m', redeemed_at), COUNT(points) FROM redemptions "
+                "WHERE level = 1 AND redeemed_at IS NOT NULL "
+                "GROUP BY broadcaster_id, strftime('%Y-%m', redeemed_at)"
+            )
+        ).fetchall()
+        return PointsSnapshot(channel_points=channel_points, streamer_firsts=streamer_firsts)
+
+    # NOTE[PointsDb-pagination]: Leaderboards are ordered by points (highest
+    # first) then by ID (lowest first). To fetch the next page of a
+    # leaderboard, pass the last row of the previous page as 'after'.
+    #
+    # If limit is None, all remaining rows are returned.
+    #
+    # Some leaderboards also take an 'offset', the number of rows to skip. The
+    # skipped rows are still computed by SQLite, so prefer 'after' if you have
+    # the previous page.
+
+    def get_monthly_channel_points(self, broadcaster_id: StreamerId, limit: typing.Optional[int] = None, after: typing.Optional[typing.Tuple[TwitchUserId, int]] = None) -> typing.List[typing.Tuple[TwitchUserId, int]]:
+        """See NOTE[PointsDb-pagination]."""
+        with self._read_connection() as db:
+            cur = db.cursor()
             data = {
                 "broadcaster_id": broadcaster_id,
+                **self._pagination_parameters(limit=limit, after=after),
             }
             result = cur.execute(
                 (
-                    "SELECT user_id, SUM(points) FROM redemptions "
+                    f"SELECT user_id, points FROM {self._points_rollup_sql('channel_points')}"
+                    "WHERE broadcaster_id = :broadcaster_id "
+                    "AND month = strftime('%Y-%m', 'now') "
+                    "AND (:after_points IS NULL OR points < :after_points OR (points = :after_points AND user_id > :after_id)) "
+                    "ORDER BY points DESC, user_id ASC "
+                    "LIMIT :limit"
+                ),
+                data
+            )
+            result_fetched = result.fetchall()
+        if result_fetched is None:
+            raise RowNotFoundError
+        return result_fetched
+
+    def get_lifetime_channel_points(self, broadcaster_id: StreamerId, limit: typing.Optional[int] = None, after: typing.Optional[typing.Tuple[TwitchUserId, int]] = None) -> typing.List[typing.Tuple[TwitchUserId, int]]:
+        """See NOTE[PointsDb-pagination]."""
+        with self._read_connection() as db:
+            cur = db.cursor()
+            data = {
+                "broadcaster_id": broadcaster_id,
+                **self._pagination_parameters(limit=limit, after=after),
+            }
+            result = cur.execute(
+                (
+                    f"SELECT user_id, SUM(points) FROM {self._points_rollup_sql('channel_points')}"
                     "WHERE broadcaster_id = :broadcaster_id "
-                    "AND redeemed_at >= date('now', 'start of month') "
-                    "AND redeemed_at < date('now', 'start of month', '+1 month') "
                     "GROUP BY user_id "
-                    "ORDER BY SUM(points) DESC"
+                    "HAVING :after_points IS NULL OR SUM(points) < :after_points OR (SUM(points) = :after_points AND user_id > :after_id) "
+                    "ORDER BY SUM(points) DESC, user_id ASC "
+                    "LIMIT :limit"
                 ),
                 data
             )
@@ -79,18 +968,57 @@ class PointsDb(DbBase):
             raise RowNotFoundError
         return result_fetched
 
-    def get_lifetime_channel_points(self, broadcaster_id: StreamerId) -> typing.List[typing.Tuple[TwitchUserId, int]]:
-        with self._lock:
-            cur = self.db.cursor()
+    def get_channel_points_between(self, broadcaster_id: StreamerId, start: date, end: date, limit: typing.Optional[int] = None, after: typing.Optional[typing.Tuple[TwitchUserId, int]] = None, offset: int = 0) -> typing.List[typing.Tuple[TwitchUserId, int]]:
+        """Points per user for redemptions on or after the start day and
+        before the end day (UTC).
+
+        See NOTE[PointsDb-pagination].
+        """
+        with self._read_connection() as db:
+            cur = db.cursor()
             data = {
                 "broadcaster_id": broadcaster_id,
+                "start_day": start.isoformat(),
+                "end_day": end.isoformat(),
+                "offset": offset,
+                **self._pagination_parameters(limit=limit, after=after),
             }
             result = cur.execute(
                 (
-                    "SELECT user_id, SUM(points) FROM redemptions "
+                    f"SELECT user_id, SUM(points) FROM {self._points_rollup_sql('channel_points_daily')}"
                     "WHERE broadcaster_id = :broadcaster_id "
+                    "AND day >= :start_day AND day < :end_day "
                     "GROUP BY user_id "
-                    "ORDER BY SUM(points) DESC"
+                    "HAVING :after_points IS NULL OR SUM(points) < :after_points OR (SUM(points) = :after_points AND user_id > :after_id) "
+                    "ORDER BY SUM(points) DESC, user_id ASC "
+                    "LIMIT :limit OFFSET :offset"
+                ),
+                data
+            )
+            result_fetched = result.fetchall()
+        if result_fetched is None:
+            raise RowNotFoundError
+        return result_fetched
+
+    def get_stream_session_channel_points(self, session_id: StreamSessionId, limit: typing.Optional[int] = None, after: typing.Optional[typing.Tuple[TwitchUserId, int]] = None, offset: int = 0) -> typing.List[typing.Tuple[TwitchUserId, int]]:
+        """Points per user for redemptions during a stream session.
+
+        See NOTE[PointsDb-pagination] and NOTE[PointsDb-stream-sessions].
+        """
+        with self._read_connection() as db:
+            cur = db.cursor()
+            data = {
+                "session_id": session_id,
+                "offset": offset,
+                **self._pagination_parameters(limit=limit, after=after),
+            }
+            result = cur.execute(
+                (
+                    "SELECT user_id, points FROM stream_session_points "
+                    "WHERE session_id = :session_id "
+                    "AND (:after_points IS NULL OR points < :after_points OR (points = :after_points AND user_id > :after_id)) "
+                    "ORDER BY points DESC, user_id ASC "
+                    "LIMIT :limit OFFSET :offset"
                 ),
                 data
             )
@@ -99,18 +1027,112 @@ class PointsDb(DbBase):
             raise RowNotFoundError
         return result_fetched
 
+    def add_display_names(self, rows: typing.Sequence[typing.Tuple[str, int]]) -> typing.List[LeaderboardRow]:
+        """Look up the display name of every (id, points) row of a leaderboard
+        page with one JOIN against the attached users database.
+
+        If no users database is attached (see __init__), every display_name
+        is None.
+        """
+        if "users" not in self._attached_databases:
+            return [LeaderboardRow(id=id, display_name=None, points=points) for (id, points) in rows]
+        named_rows: typing.List[LeaderboardRow] = []
+        # NOTE[sqlite-parameter-chunks]: Stay well below SQLite's limit on the
+        # number of parameters in a statement.
+        chunk_size = 500
+        with self._read_connection() as db:
+            cur = db.cursor()
+            for chunk_start in range(0, len(rows), chunk_size):
+                chunk = rows[chunk_start:chunk_start + chunk_size]
+                data: typing.Dict[str, typing.Any] = {}
+                values_sql = []
+                for (index, (id, points)) in enumerate(chunk):
+                    data[f"id_{index}"] = id
+                    data[f"points_{index}"] = points
+                    values_sql.append(f"({index}, :id_{index}, :points_{index})")
+                result = cur.execute(
+                    (
+                        f"WITH page(position, id, points) AS (VALUES {', '.join(values_sql)}) "
+                        "SELECT page.id, NULLIF(users.users.user_name, ''), page.points FROM page "
+                        "LEFT JOIN users.users ON users.users.user_id = page.id "
+                        "ORDER BY page.position"
+                    ),
+                    data
+                )
+                named_rows.extend(LeaderboardRow(*row) for row in result.fetchall())
+        return named_rows
+
+    def get_user_rank(self, broadcaster_id: StreamerId, user_id: TwitchUserId, scope: LeaderboardScope) -> int:
+        """Return the 1-based position of user_id in the broadcaster's
+        monthly or lifetime leaderboard.
+
+        Throws RowNotFoundError if the user has no points in the leaderboard.
+        """
+        if scope == "monthly":
+            points_per_user_sql = (
+                f"SELECT user_id, points FROM {self._points_rollup_sql('channel_points')}"
+                "WHERE broadcaster_id = :broadcaster_id "
+                "AND month = strftime('%Y-%m', 'now')"
+            )
+        elif scope == "lifetime":
+            points_per_user_sql = (
+                f"SELECT user_id, SUM(points) AS points FROM {self._points_rollup_sql('channel_points')}"
+                "WHERE broadcaster_id = :broadcaster_id "
+                "GROUP BY user_id"
+            )
+        else:
+            raise ValueError(f"unknown leaderboard scope: {scope!r}")
+        with self._read_connection() as db:
+            cur = db.cursor()
+            data = {
+                "broadcaster_id": broadcaster_id,
+                "user_id": user_id,
+            }
+            result = cur.execute(
+                (
+                    f"WITH points_per_user AS ({points_per_user_sql}) "
+                    "SELECT "
+                        "(SELECT COUNT(*) FROM points_per_user AS other "
+                        "WHERE other.points > target.points OR (other.points = target.points AND other.user_id < target.user_id)) "
+                    "FROM points_per_user AS target "
+                    "WHERE target.user_id = :user_id"
+                ),
+                data
+            )
+            result_fetched = result.fetchone()
+        if result_fetched is None:
+            raise RowNotFoundError
+        users_ahead, = result_fetched
+        return users_ahead + 1
+
+    def _pagination_parameters(self, limit: typing.Optional[int], after: typing.Optional[typing.Tuple[str, int]]) -> typing.Dict[str, typing.Any]:
+        """See NOTE[PointsDb-pagination]."""
+        after_id, after_points = (None, None) if after is None else after
+        return {
+            # In SQLite, a negative LIMIT means no limit.
+            "limit": -1 if limit is None else limit,
+            "after_id": after_id,
+            "after_points": after_points,
+        }
+
     def get_monthly_user_points(self, user_id: TwitchUserId) -> int:
-        with self._lock:
-            cur = self.db.cursor()
+        with self._read_connection() as db:
+            cur = db.cursor()
             data = {
                 "user_id": user_id,
             }
+            if self._redemption_timestamps_migrated:
+                this_month_sql = "month = strftime('%Y-%m', 'now') "
+            else:
+                this_month_sql = (
+                    "redeemed_at >= date('now', 'start of month') "
+                    "AND redeemed_at < date('now', 'start of month', '+1 month') "
+                )
             result = cur.execute(
                 (
                     "SELECT SUM(points) FROM redemptions "
                     "WHERE user_id = :user_id "
-                    "AND redeemed_at >= date('now', 'start of month') "
-                    "AND redeemed_at < date('now', 'start of month', '+1 month') "
+                    f"AND {this_month_sql}"
                     "GROUP BY user_id "
                     "ORDER BY SUM(points) DESC"
                 ),
@@ -123,8 +1145,8 @@ class PointsDb(DbBase):
         return points
 
     def get_lifetime_user_points(self, user_id: TwitchUserId) -> int:
-        with self._lock:
-            cur = self.db.cursor()
+        with self._read_connection() as db:
+            cur = db.cursor()
             data = {
                 "user_id": user_id,
             }
@@ -143,36 +1165,146 @@ class PointsDb(DbBase):
         points, = result_fetched
         return points
 
-    def get_streamers_monthly_leaderboard(self) -> typing.List[typing.Tuple[StreamerId, int]]:
-        with self._lock:
-            cur = self.db.cursor()
+    # NOTE[PointsDb-streamer-leaderboards]: The home page reads the streamer
+    # leaderboards from PointsLeaderboards (see first/leaderboard.py), which
+    # keeps them in memory. These queries scan every level 1 redemption.
+
+    def get_streamers_monthly_leaderboard(self, limit: typing.Optional[int] = None, after: typing.Optional[typing.Tuple[StreamerId, int]] = None) -> typing.List[typing.Tuple[StreamerId, int]]:
+        """See NOTE[PointsDb-pagination]."""
+        with self._read_connection() as db:
+            cur = db.cursor()
+            data = self._pagination_parameters(limit=limit, after=after)
+            if self._redemption_timestamps_migrated:
+                this_month_sql = "month = strftime('%Y-%m', 'now') "
+            else:
+                this_month_sql = (
+                    "redeemed_at >= date('now', 'start of month') "
+                    "AND redeemed_at < date('now', 'start of month', '+1 month') "
+                )
             result = cur.execute(
                 (
                     "SELECT broadcaster_id, COUNT(points) FROM redemptions "
                     "WHERE level = 1 "
-                    "AND redeemed_at >= date('now', 'start of month') "
-                    "AND redeemed_at < date('now', 'start of month', '+1 month') "
+                    f"AND {this_month_sql}"
                     "GROUP BY broadcaster_id "
-                    "ORDER BY COUNT(points) DESC"
+                    f"HAVING {self._streamers_after_sql}"
+                    "ORDER BY COUNT(points) DESC, broadcaster_id ASC "
+                    "LIMIT :limit"
                 ),
+                data
             )
-            result_fetched = result.fetchall()
-        if result_fetched is None:
-            raise RowNotFoundError
-        return result_fetched
+            return result.fetchall()
 
-    def get_streamers_lifetime_leaderboard(self) -> typing.List[typing.Tuple[StreamerId, int]]:
-        with self._lock:
-            cur = self.db.cursor()
+    def get_streamers_lifetime_leaderboard(self, limit: typing.Optional[int] = None, after: typing.Optional[typing.Tuple[StreamerId, int]] = None) -> typing.List[typing.Tuple[StreamerId, int]]:
+        """See NOTE[PointsDb-pagination]."""
+        with self._read_connection() as db:
+            cur = db.cursor()
+            data = self._pagination_parameters(limit=limit, after=after)
             result = cur.execute(
                 (
                     "SELECT broadcaster_id, COUNT(points) FROM redemptions "
                     "WHERE level = 1 "
                     "GROUP BY broadcaster_id "
-                    "ORDER BY COUNT(points) DESC"
+                    f"HAVING {self._streamers_after_sql}"
+                    "ORDER BY COUNT(points) DESC, broadcaster_id ASC "
+                    "LIMIT :limit"
                 ),
+                data
             )
-            result_fetched = result.fetchall()
-        if result_fetched is None:
-            raise RowNotFoundError
-        return result_fetched
+            return result.fetchall()
+
+    _streamers_after_sql = (
+        "(:after_points IS NULL OR COUNT(points) < :after_points "
+        "OR (COUNT(points) = :after_points AND broadcaster_id > :after_id)) "
+    )
+
+RedemptionFileFormat = typing.Literal["ndjson", "csv"]
+
+def read_redemptions(file: typing.TextIO, format: RedemptionFileFormat) -> typing.Iterator[Redemption]:
+    """Parse redemptions written by write_redemptions.
+
+    Redemptions are parsed lazily, one line at a time.
+    """
+    if format == "ndjson":
+        rows: typing.Iterable[typing.Dict[str, typing.Any]] = (json.loads(line) for line in file if line.strip())
+    elif format == "csv":
+        rows = csv.DictReader(file)
+    else:
+        raise ValueError(f"unknown format: {format!r}")
+    for row in rows:
+        yield Redemption(
+            broadcaster_id=str(row["broadcaster_id"]),
+            redemption_id=str(row["redemption_id"]),
+            user_id=str(row["user_id"]),
+            redeemed_at=datetime.fromisoformat(row["redeemed_at"]),
+            points=int(row["points"]),
+            level=int(row["level"]),
+        )
+
+def write_redemptions(file: typing.TextIO, format: RedemptionFileFormat, redemptions: typing.Iterable[Redemption]) -> None:
+    """Write redemptions as newline-delimited JSON or CSV.
+
+    Each redemption has the fields of Redemption. redeemed_at is written in
+    ISO 8601 format.
+    """
+    if format == "ndjson":
+        for redemption in redemptions:
+            row = redemption._asdict()
+            row["redeemed_at"] = redemption.redeemed_at.isoformat()
+            file.write(json.dumps(row) + "\n")
+    elif format == "csv":
+        writer = csv.DictWriter(file, fieldnames=Redemption._fields)
+        writer.writeheader()
+        for redemption in redemptions:
+            row = redemption._asdict()
+            row["redeemed_at"] = redemption.redeemed_at.isoformat()
+            writer.writerow(row)
+    else:
+        raise ValueError(f"unknown format: {format!r}")
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    """Import or export redemptions from the command line.
+
+    Usage:
+    $ python -m first.pointsdb export redemptions.ndjson
+    $ python -m first.pointsdb import --format csv redemptions.csv
+
+    A running web server does not see imported redemptions in its
+    leaderboards until it is restarted. See PointsLeaderboards.
+    """
+    parser = argparse.ArgumentParser(prog="python -m first.pointsdb", description="Import or export First! redemptions.")
+    parser.add_argument("--db", default=points_config["db"], help="path to the points database (default: %(default)s)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command in ["import", "export"]:
+        subparser = subparsers.add_parser(command, help=f"{command} redemptions")
+        subparser.add_argument("file", help="path to the redemptions file, or - for standard input/output")
+        subparser.add_argument("--format", choices=["ndjson", "csv"], help="file format (default: guessed from the file extension, or ndjson)")
+        subparser.add_argument("--batch-size", type=int, default=10000, help="number of redemptions per transaction (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    format: RedemptionFileFormat = args.format or ("csv" if args.file.endswith(".csv") else "ndjson")
+    points_db = PointsDb(args.db)
+    if args.command == "import":
+        def report_progress(result: PointsDb.ImportResult) -> None:
+            logger.info("read %d redemptions, inserted %d", result.read, result.inserted)
+        with contextlib.ExitStack() as exit_stack:
+            file = sys.stdin if args.file == "-" else exit_stack.enter_context(open(args.file, "r", newline="", encoding="utf-8"))
+            result = points_db.import_redemptions(read_redemptions(file, format), batch_size=args.batch_size, progress=report_progress)
+        logger.info("done: read %d redemptions, inserted %d, skipped %d duplicates", result.read, result.inserted, result.read - result.inserted)
+    elif args.command == "export":
+        exported = 0
+        def count_exported(redemptions: typing.Iterable[Redemption]) -> typing.Iterator[Redemption]:
+            nonlocal exported
+            for redemption in redemptions:
+                yield redemption
+                exported += 1
+                if exported % args.batch_size == 0:
+                    logger.info("exported %d redemptions", exported)
+        with contextlib.ExitStack() as exit_stack:
+            file = sys.stdout if args.file == "-" else exit_stack.enter_context(open(args.file, "w", newline="", encoding="utf-8"))
+            write_redemptions(file, format, count_exported(points_db.export_redemptions(batch_size=args.batch_size)))
+        logger.info("done: exported %d redemptions", exported)
+
+if __name__ == "__main__":
+    main()
@@ -29,6 +29,8 @@ class Twitch:
     class RefreshAuthTokenResult(typing.NamedTuple):
         new_access_token: "Token"
         new_refresh_token: "Token"
+        # None if Twitch did not say when the token expires.
+        new_access_token_expires_in_seconds: typing.Optional[float] = None
 
     def refresh_auth_token(self, refresh_token: "Token") -> RefreshAuthTokenResult:
         refresh_data = {
@@ -43,16 +45,28 @@ class Twitch:
         return self.RefreshAuthTokenResult(
             new_access_token=refresh_result["access_token"],
             new_refresh_token=refresh_result["refresh_token"],
+            new_access_token_expires_in_seconds=refresh_result.get("expires_in"),
         )
 
-    def get_authenticated_app_access_token(self) -> "Token":
+    class AppAccessToken(typing.NamedTuple):
+        access_token: "Token"
+        # None if Twitch did not say when the token expires.
+        expires_in_seconds: typing.Optional[float]
+
+    def get_app_access_token(self) -> AppAccessToken:
         data = {
             "grant_type": "client_credentials",
             "client_id": twitch_config["client_id"],
             "client_secret": twitch_config["client_secret"],
         }
         response = requests.post("https://id.twitch.tv/oauth2/token", data=data).json()
-        return response["access_token"]
+        return self.AppAccessToken(
+            access_token=response["access_token"],
+            expires_in_seconds=response.get("expires_in"),
+        )
+
+    def get_authenticated_app_access_token(self) -> "Token":
+        return self.get_app_access_token().access_token
 
 class AuthenticatedTwitch:
     """Authenticated Twitch API access.
@@ -75,6 +89,48 @@ class AuthenticatedTwitch:
         # TODO(strager): Robust error handling.
         return data["data"][0]["display_name"] if data["data"] else f"DELETED USER ID {user_id}"
 
+    # Maximum number of IDs in one /helix/users request.
+    max_users_per_request = 100
+
+    def get_user_display_names_by_user_ids(self, user_ids: typing.Sequence["TwitchUserId"]) -> typing.Dict["TwitchUserId", str]:
+        """Like get_users_by_user_ids, but return only display names."""
+        return {user_id: display_name for (user_id, (_login, display_name)) in self.get_users_by_user_ids(user_ids).items()}
+
+    def get_users_by_user_ids(self, user_ids: typing.Sequence["TwitchUserId"]) -> typing.Dict["TwitchUserId", typing.Tuple[str, str]]:
+        """Look up many users with one /helix/users request per 100 users.
+        Returns (login, display_name) for each user ID.
+        https://dev.twitch.tv/docs/api/reference/#get-users
+
+        Users which do not exist (e.g. deleted users) are missing from the
+        returned dict.
+        """
+        users = {}
+        for chunk_start in range(0, len(user_ids), self.max_users_per_request):
+            chunk = user_ids[chunk_start:chunk_start + self.max_users_per_request]
+            query = "&".join(f"id={quote_plus(user_id)}" for user_id in chunk)
+            data = self._get_json(f"https://api.twitch.tv/helix/users?{query}")
+            # TODO(strager): Robust error handling.
+            for user in data["data"]:
+                users[user["id"]] = (user["login"], user["display_name"])
+        return users
+
+    def get_users_by_logins(self, logins: typing.Sequence[str]) -> typing.Dict[str, typing.Tuple["TwitchUserId", str]]:
+        """Look up many users by login name with one /helix/users request per
+        100 users. Returns (user_id, display_name) for each login.
+        https://dev.twitch.tv/docs/api/reference/#get-users
+
+        Users which do not exist are missing from the returned dict.
+        """
+        users = {}
+        for chunk_start in range(0, len(logins), self.max_users_per_request):
+            chunk = logins[chunk_start:chunk_start + self.max_users_per_request]
+            query = "&".join(f"login={quote_plus(login)}" for login in chunk)
+            data = self._get_json(f"https://api.twitch.tv/helix/users?{query}")
+            # TODO(strager): Robust error handling.
+            for user in data["data"]:
+                users[user["login"]] = (user["id"], user["display_name"])
+        return users
+
     def create_custom_channel_points_reward(
         self,
         broadcaster_id: TwitchUserId,
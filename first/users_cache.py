@@ -1,45 +1,323 @@
 """Twitch User Name Cache"""
+import logging
 import sqlite3
 import threading
+import time
 import typing
 from first.config import cfg
 from first.twitch import Twitch, AuthenticatedTwitch, TwitchUserId
 from first.errors import UserNotFoundError
 from first.authdb import TwitchAuthDb, TwitchAppTokenProvider
+from first.cache import LruCache
 
 from first.usersdb import TwitchUsersDb
 
 users_config = cfg["usersdb"]
 DbPath = str
 
+logger = logging.getLogger(__name__)
+
 class TwitchUserNameCache(TwitchUsersDb):
+    # NOTE[TwitchUserNameCache-memory]: Display names are looked up in three
+    # places, fastest first:
+    #
+    # 1. _display_names, an in-memory LRU cache. Pages often show the same
+    #    user many times (e.g. in the lifetime and monthly leaderboards).
+    # 2. The users database.
+    # 3. Twitch's /helix/users endpoint.
+    #
+    # Users which Twitch does not know about (e.g. deleted users) are cached
+    # in memory only, as _deleted_user_display_name, for a shorter time, in
+    # case the lookup failed for another reason.
+    _memory_cache_max_size = 10000
+    _memory_cache_ttl_seconds = 10 * 60
+    _memory_cache_deleted_user_ttl_seconds = 60 * 60
+
+    _display_names: LruCache[TwitchUserId, str]
+    # Logins which Twitch does not know. See get_user_ids_from_user_names_batch.
+    _unknown_user_logins: LruCache[str, bool]
+
+    # NOTE[TwitchUserNameCache-single-flight]: When a popular page is cold,
+    # many request threads miss on the same users at once. Only the first
+    # thread to miss on a user fetches it from Twitch. The others wait for
+    # that fetch (a _Flight) and use its result. If the fetch fails, the
+    # waiting threads fail too rather than retrying all at once.
+    #
+    # fetched_users counts users requested from Twitch. coalesced_users
+    # counts lookups which waited for another thread's request instead.
+    class FetchStats(typing.NamedTuple):
+        fetched_users: int
+        coalesced_users: int
+
+    class _Flight:
+        done: threading.Event
+        # Set before done is set.
+        display_name: typing.Optional[str] = None
+        error: typing.Optional[BaseException] = None
+
+        def __init__(self) -> None:
+            self.done = threading.Event()
+
+    _flights_lock: threading.Lock
+    # Protected by _flights_lock:
+    _flights: typing.Dict[TwitchUserId, _Flight]
+    _fetched_users: int = 0
+    _coalesced_users: int = 0
+
+    # NOTE[TwitchUserNameCache-refresh]: Users rename themselves, so stored
+    # display names go stale. Instead of expiring names (which would make
+    # page renders wait for Twitch), a background thread re-fetches names
+    # which are nearing max_age_seconds, 100 users per /helix/users request.
+    # A rename shows up within max_age_seconds (plus the memory cache's TTL).
+    _refresh_stop_requested: threading.Event
+    _refresh_lock: threading.Lock
+    # Protected by _refresh_lock:
+    _refresh_thread: typing.Optional[threading.Thread] = None
 
     def __init__(self, db: DbPath = users_config["db"]):
         super().__init__(db=db)
         self.twitch = AuthenticatedTwitch(TwitchAppTokenProvider())
+        self._display_names = LruCache(max_size=self._memory_cache_max_size)
+        self._unknown_user_logins = LruCache(max_size=self._memory_cache_max_size)
+        self._flights_lock = threading.Lock()
+        self._flights = {}
+        self._refresh_stop_requested = threading.Event()
+        self._refresh_lock = threading.Lock()
 
     def get_display_name_from_id(self, user_id: TwitchUserId) -> str:
         """Calls Twitch's /helix/users endpoint if the data is missing from the database.
         https://dev.twitch.tv/docs/api/reference/#get-users
+
+        See NOTE[TwitchUserNameCache-memory].
+        """
+        return self.get_display_name_from_id_batch([user_id])[user_id]
+
+    def get_display_name_from_id_batch(self, user_ids: typing.Iterable[TwitchUserId]) -> typing.Dict[TwitchUserId, str]:
+        """Like get_display_name_from_id, but for many users at once.
+
+        Users missing from the database are fetched from Twitch's /helix/users
+        endpoint, 100 users per request.
+        """
+        display_names = {}
+        uncached_user_ids = []
+        for user_id in dict.fromkeys(user_ids):
+            display_name = self._display_names.get(user_id)
+            if display_name is None:
+                uncached_user_ids.append(user_id)
+            else:
+                display_names[user_id] = display_name
+        if not uncached_user_ids:
+            return display_names
+
+        stored_display_names = self.get_user_names_from_ids(uncached_user_ids)
+        for (user_id, display_name) in stored_display_names.items():
+            self._display_names.put(user_id, display_name, ttl_seconds=self._memory_cache_ttl_seconds)
+        display_names.update(stored_display_names)
+
+        missing_user_ids = [user_id for user_id in uncached_user_ids if user_id not in stored_display_names]
+        if missing_user_ids:
+            display_names.update(self._fetch_display_names(missing_user_ids))
+        return display_names
+
+    def _fetch_display_names(self, user_ids: typing.List[TwitchUserId]) -> typing.Dict[TwitchUserId, str]:
+        """Fetch display names from Twitch, waiting for fetches of the same
+        users by other threads instead of fetching them again.
+
+        See NOTE[TwitchUserNameCache-single-flight].
+        """
+        display_names = {}
+        own_flights = {}
+        other_flights = {}
+        with self._flights_lock:
+            for user_id in user_ids:
+                flight = self._flights.get(user_id)
+                if flight is not None:
+                    other_flights[user_id] = flight
+                    continue
+                # Another thread might have finished fetching this user after
+                # we missed the memory cache.
+                display_name = self._display_names.peek(user_id)
+                if display_name is not None:
+                    display_names[user_id] = display_name
+                    continue
+                flight = self._Flight()
+                self._flights[user_id] = flight
+                own_flights[user_id] = flight
+            self._fetched_users += len(own_flights)
+            self._coalesced_users += len(other_flights)
+
+        if own_flights:
+            try:
+                fetched_users = self.twitch.get_users_by_user_ids(list(own_flights))
+                self._store_users(
+                    self.UserInfo(user_id=user_id, user_login=user_login, user_name=display_name)
+                    for (user_id, (user_login, display_name)) in fetched_users.items()
+                )
+                for (user_id, flight) in own_flights.items():
+                    fetched_user = fetched_users.get(user_id)
+                    if fetched_user is None:
+                        display_name = self._deleted_user_display_name(user_id)
+                        self._display_names.put(user_id, display_name, ttl_seconds=self._memory_cache_deleted_user_ttl_seconds)
+                    else:
+                        display_name = fetched_user[1]
+                    flight.display_name = display_name
+                    display_names[user_id] = display_name
+            except BaseException as error:
+                for flight in own_flights.values():
+                    flight.error = error
+                raise
+            finally:
+                with self._flights_lock:
+                    for (user_id, flight) in own_flights.items():
+                        del self._flights[user_id]
+                        flight.done.set()
+
+        for (user_id, flight) in other_flights.items():
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            assert flight.display_name is not None
+            display_names[user_id] = flight.display_name
+        return display_names
+
+    def get_fetch_stats(self) -> "TwitchUserNameCache.FetchStats":
+        """See NOTE[TwitchUserNameCache-single-flight]."""
+        with self._flights_lock:
+            return self.FetchStats(fetched_users=self._fetched_users, coalesced_users=self._coalesced_users)
+
+    @staticmethod
+    def _deleted_user_display_name(user_id: TwitchUserId) -> str:
+        # Match AuthenticatedTwitch.get_user_display_name_by_user_id.
+        return f"DELETED USER ID {user_id}"
+
+    def refresh_stale_display_names(self, max_age_seconds: float, refresh_ahead_fraction: float = 0.2, max_batches: int = 10) -> int:
+        """Re-fetch up to max_batches batches of display names fetched more
+        than (1 - refresh_ahead_fraction) * max_age_seconds ago.
+
+        Returns the number of users refreshed.
+
+        See NOTE[TwitchUserNameCache-refresh].
+        """
+        fetched_before_epoch = int(time.time() - max_age_seconds * (1 - refresh_ahead_fraction))
+        refreshed = 0
+        for _ in range(max_batches):
+            user_ids = self.get_user_ids_fetched_before(fetched_before_epoch, limit=AuthenticatedTwitch.max_users_per_request)
+            if not user_ids:
+                break
+            # Store logins too. A user might have renamed and another user might
+            # have taken the old login. See get_user_ids_from_logins.
+            fetched_users = self.twitch.get_users_by_user_ids(user_ids)
+            self._store_users(
+                self.UserInfo(user_id=user_id, user_login=user_login, user_name=display_name)
+                for (user_id, (user_login, display_name)) in fetched_users.items()
+            )
+            self.mark_users_fetched([user_id for user_id in user_ids if user_id not in fetched_users])
+            refreshed += len(user_ids)
+        return refreshed
+
+    def start_refreshing(self, max_age_seconds: float = 24 * 60 * 60, interval_seconds: float = 60) -> None:
+        """Call refresh_stale_display_names every interval_seconds on a
+        background thread.
+
+        Precondition: The thread is not already running.
+        """
+        thread = threading.Thread(target=lambda: self._run_refresh_thread(max_age_seconds, interval_seconds), name="TwitchUserNameCache refresh", daemon=True)
+        with self._refresh_lock:
+            assert self._refresh_thread is None, "refresh thread is already running"
+            self._refresh_stop_requested.clear()
+            thread.start()
+            self._refresh_thread = thread
+
+    def stop_refreshing(self) -> None:
+        """If the refresh thread is not running, this function does nothing."""
+        with self._refresh_lock:
+            thread = self._refresh_thread
+            self._refresh_thread = None
+        if thread is None:
+            return
+        self._refresh_stop_requested.set()
+        thread.join()
+
+    def _run_refresh_thread(self, max_age_seconds: float, interval_seconds: float) -> None:
+        while not self._refresh_stop_requested.wait(timeout=interval_seconds):
+            try:
+                refreshed = self.refresh_stale_display_names(max_age_seconds=max_age_seconds)
+            except Exception:
+                logger.warning("failed to refresh display names", exc_info=True)
+                continue
+            if refreshed:
+                logger.info("refreshed %d display names", refreshed)
+
+    def get_memory_cache_stats(self) -> LruCache.Stats:
+        """See NOTE[TwitchUserNameCache-memory]."""
+        return self._display_names.get_stats()
+
+    def get_user_id_from_user_name(self, user_login: str) -> TwitchUserId:
+        """Calls Twitch's /helix/users endpoint if the data is missing from the database.
+        https://dev.twitch.tv/docs/api/reference/#get-users
+
+        Raises UserNotFoundError if Twitch does not know the login.
         """
-        try:
-            display_name = self.get_user_name_from_id(user_id)
-        except UserNotFoundError:
-            display_name = self.twitch.get_user_display_name_by_user_id(user_id)
-            self.set_user_info(user_id=user_id, display_name=display_name)
-        return display_name
+        user_login = user_login.lower()
+        user_id = self.get_user_ids_from_user_names_batch([user_login]).get(user_login)
+        if user_id is None:
+            raise UserNotFoundError()
+        return user_id
 
-    # Not needed right now:
-    # Twitch's /helix/users endpoint allows multiple IDs. We can leverage this fact to improve performance of batch queries:
-    # def get_display_name_from_id_batch(self, ids: typing.List[TwitchUserId]) -> typing.List[str]: ...
+    def get_user_ids_from_user_names_batch(self, user_logins: typing.Iterable[str]) -> typing.Dict[str, TwitchUserId]:
+        """Like get_user_id_from_user_name, but for many users at once.
 
-    # Not needed right now:
-    # Calls Twitch's /helix/users endpoint if the data is missing from the database.
-    # https://dev.twitch.tv/docs/api/reference/#get-users
-    # def get_user_id_from_user_name(self, user_name: str) -> TwitchUserId: ...
+        Logins missing from the database are fetched from Twitch's
+        /helix/users endpoint, 100 users per request. Logins which Twitch does
+        not know are missing from the returned dict, and are not looked up on
+        Twitch again for a while.
+        """
+        user_logins = [user_login.lower() for user_login in dict.fromkeys(user_logins)]
+        user_ids = self.get_user_ids_from_logins(user_logins)
+        missing_user_logins = [
+            user_login
+            for user_login in user_logins
+            if user_login not in user_ids and self._unknown_user_logins.get(user_login) is None
+        ]
+        if missing_user_logins:
+            fetched_users = self.twitch.get_users_by_logins(missing_user_logins)
+            self._store_users(
+                self.UserInfo(user_id=user_id, user_login=user_login, user_name=display_name)
+                for (user_login, (user_id, display_name)) in fetched_users.items()
+            )
+            for user_login in missing_user_logins:
+                fetched_user = fetched_users.get(user_login)
+                if fetched_user is None:
+                    self._unknown_user_logins.put(user_login, True, ttl_seconds=self._memory_cache_deleted_user_ttl_seconds)
+                else:
+                    user_ids[user_login] = fetched_user[0]
+        return user_ids
+
+    def set_users_info(self, users: typing.Iterable[TwitchUsersDb.UserInfo]) -> None:
+        """Like set_user_info, but for many users at once.
+
+        If a user appears more than once, the last appearance wins. Users
+        whose display name is already in the memory cache are skipped, so
+        writing through every EventSub notification rarely touches the
+        database.
+        """
+        self._store_users(
+            user
+            for user in {user.user_id: user for user in users}.values()
+            if user.user_name is None or self._display_names.peek(user.user_id) != user.user_name
+        )
 
     def set_user_info(self, user_id: TwitchUserId, user_login: typing.Optional[str] = None, display_name: typing.Optional[str] = None):
         """Update the cache if we happen to receive data from some Twitch API
         (such as a redemption notification).
         """
-        self.insert_or_update_user(user_id=user_id, user_login=user_login, user_name=display_name)
+        self._store_users([self.UserInfo(user_id=user_id, user_login=user_login, user_name=display_name)])
+
+    def _store_users(self, users: typing.Iterable[TwitchUsersDb.UserInfo]) -> None:
+        users = list(users)
+        self.upsert_users(users)
+        for user in users:
+            if user.user_name is None:
+                self._display_names.discard(user.user_id)
+            else:
+                self._display_names.put(user.user_id, user.user_name, ttl_seconds=self._memory_cache_ttl_seconds)
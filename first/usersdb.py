@@ -1,9 +1,10 @@
 """Twitch Users Db"""
 import sqlite3
 import threading
+import time
 import typing
 from first.config import cfg
-from first.db import DbBase
+from first.db import DbBase, IndexMigration, SchemaMigration
 from first.errors import UserNotFoundError
 from first.twitch import TwitchUserId
 
@@ -14,10 +15,34 @@ class TwitchUsersDb(DbBase):
         login_name: str
         user_name: str
 
+    class UserInfo(typing.NamedTuple):
+        user_id: TwitchUserId
+        # None if unknown.
+        user_login: typing.Optional[str] = None
+        # None if unknown.
+        user_name: typing.Optional[str] = None
+
     def __init__(self, db: DbPath):
         super().__init__()
         self._create_sqlite3_database(db)
-        cur = self.db.cursor()
+        self._migrate([
+            SchemaMigration(version=1, description="create users", apply=self._create_users_table),
+            SchemaMigration(version=2, description="add users.fetched_at_epoch", apply=self._add_fetched_at_column),
+            IndexMigration(
+                version=3,
+                description="index users by fetched_at_epoch",
+                table_name="users",
+                create_index_sql="CREATE INDEX IF NOT EXISTS users_by_fetched_at ON users (fetched_at_epoch)",
+            ),
+            IndexMigration(
+                version=4,
+                description="index users by user_login",
+                table_name="users",
+                create_index_sql="CREATE INDEX IF NOT EXISTS users_by_login ON users (user_login)",
+            ),
+        ])
+
+    def _create_users_table(self, cur: sqlite3.Cursor) -> None:
         cur.execute(
             (
                 "CREATE TABLE IF NOT EXISTS "
@@ -29,38 +54,52 @@ class TwitchUsersDb(DbBase):
             )
         )
 
-        self._lock = threading.Lock()
+    def _add_fetched_at_column(self, cur: sqlite3.Cursor) -> None:
+        """fetched_at_epoch is the time (in seconds since the Unix epoch) when
+        user_name was last received from Twitch, or NULL if unknown.
+        """
+        columns = {name for (_cid, name, *_rest) in cur.execute("PRAGMA table_info(users)").fetchall()}
+        if "fetched_at_epoch" not in columns:
+            cur.execute("ALTER TABLE users ADD COLUMN fetched_at_epoch INTEGER")
 
     def insert_or_update_user(self, user_id: TwitchUserId, user_login: typing.Optional[str] = None, user_name: typing.Optional[str] = None):
-        if user_name is None:
-            try:
-                user_name = self.get_user_name_from_id(user_id)
-            except UserNotFoundError:
-                user_name = ""
-        if user_login is None:
-            try:
-                user_login = self.get_user_login_from_id(user_id)
-            except UserNotFoundError:
-                user_login = ""
+        self.upsert_users([self.UserInfo(user_id=user_id, user_login=user_login, user_name=user_name)])
+
+    def upsert_users(self, users: typing.Iterable[UserInfo]) -> None:
+        """Insert or update many users in one transaction.
+
+        A user_login or user_name of None keeps the stored value (or stores ""
+        for a new user).
+        """
+        now_epoch = int(time.time())
+        data = [
+            {
+                "user_id": user.user_id,
+                "user_login": user.user_login,
+                "user_name": user.user_name,
+                # Only a new user_name counts as fresh data.
+                "fetched_at_epoch": None if user.user_name is None else now_epoch,
+            }
+            for user in users
+        ]
+        if not data:
+            return
         with self._lock:
             cur = self.db.cursor()
-            data = {
-                "user_id": user_id,
-                "user_login": user_login,
-                "user_name": user_name,
-            }
-            cur.execute(
+            cur.executemany(
                 (
-                    "INSERT INTO users (user_id, user_login, user_name) "
-                    "VALUES(:user_id, :user_login, :user_name) "
+                    "INSERT INTO users (user_id, user_login, user_name, fetched_at_epoch) "
+                    "VALUES(:user_id, COALESCE(:user_login, ''), COALESCE(:user_name, ''), :fetched_at_epoch) "
                     "ON CONFLICT (user_id) "
-                    "DO UPDATE SET user_login = :user_login, user_name = :user_name"
+                    "DO UPDATE SET user_login = COALESCE(:user_login, users.user_login), "
+                    "user_name = COALESCE(:user_name, users.user_name), "
+                    "fetched_at_epoch = COALESCE(:fetched_at_epoch, users.fetched_at_epoch)"
                 ), data)
             self.db.commit()
 
     def _get_user_fields_by_id(self, user_id: TwitchUserId) -> UserFields:
-        with self._lock:
-            cur = self.db.cursor()
+        with self._read_connection() as db:
+            cur = db.cursor()
             data = {
                 "user_id": user_id,
             }
@@ -71,6 +110,92 @@ class TwitchUsersDb(DbBase):
         fields = self.UserFields(*result_fetched)
         return fields
 
+    def get_user_names_from_ids(self, user_ids: typing.Sequence[TwitchUserId]) -> typing.Dict[TwitchUserId, str]:
+        """Like get_user_name_from_id, but for many users at once.
+
+        Users which are not in the database are missing from the returned
+        dict.
+        """
+        user_names: typing.Dict[TwitchUserId, str] = {}
+        # See NOTE[sqlite-parameter-chunks].
+        chunk_size = 500
+        with self._read_connection() as db:
+            cur = db.cursor()
+            for chunk_start in range(0, len(user_ids), chunk_size):
+                chunk = user_ids[chunk_start:chunk_start + chunk_size]
+                data = {f"user_id_{index}": user_id for (index, user_id) in enumerate(chunk)}
+                result = cur.execute(
+                    f"SELECT user_id, user_name FROM users WHERE user_id IN ({', '.join(':' + name for name in data)})",
+                    data
+                )
+                user_names.update(result.fetchall())
+        return user_names
+
+    def get_user_ids_from_logins(self, user_logins: typing.Sequence[str]) -> typing.Dict[str, TwitchUserId]:
+        """Look up users by login name.
+
+        Logins which are not in the database are missing from the returned
+        dict. If a login was renamed away and later reused by another user,
+        the most recently fetched user wins.
+        """
+        user_ids: typing.Dict[str, TwitchUserId] = {}
+        # See NOTE[sqlite-parameter-chunks].
+        chunk_size = 500
+        with self._read_connection() as db:
+            cur = db.cursor()
+            for chunk_start in range(0, len(user_logins), chunk_size):
+                chunk = user_logins[chunk_start:chunk_start + chunk_size]
+                data = {f"user_login_{index}": user_login for (index, user_login) in enumerate(chunk)}
+                result = cur.execute(
+                    (
+                        "SELECT user_login, user_id FROM users "
+                        f"WHERE user_login IN ({', '.join(':' + name for name in data)}) "
+                        "ORDER BY fetched_at_epoch"
+                    ),
+                    data,
+                )
+                # NULLs sort first, so later (fresher) rows overwrite earlier ones.
+                for (user_login, user_id) in result.fetchall():
+                    user_ids[user_login] = user_id
+        return user_ids
+
+    def get_user_ids_fetched_before(self, fetched_before_epoch: int, limit: int) -> typing.List[TwitchUserId]:
+        """Return up to limit users whose user_name was fetched before
+        fetched_before_epoch (or at an unknown time), least recently fetched
+        first.
+        """
+        with self._read_connection() as db:
+            cur = db.cursor()
+            data = {
+                "fetched_before_epoch": fetched_before_epoch,
+                "limit": limit,
+            }
+            result = cur.execute(
+                (
+                    "SELECT user_id FROM users "
+                    "WHERE fetched_at_epoch IS NULL OR fetched_at_epoch < :fetched_before_epoch "
+                    "ORDER BY fetched_at_epoch "
+                    "LIMIT :limit"
+                ),
+                data
+            )
+            return [user_id for (user_id,) in result.fetchall()]
+
+    def mark_users_fetched(self, user_ids: typing.Sequence[TwitchUserId]) -> None:
+        """Set the fetched time of users to now without changing their data.
+
+        Use this when Twitch has no data for the users (e.g. they were
+        deleted), so that they are not fetched again soon.
+        """
+        with self._lock:
+            cur = self.db.cursor()
+            fetched_at_epoch = int(time.time())
+            cur.executemany(
+                "UPDATE users SET fetched_at_epoch = :fetched_at_epoch WHERE user_id = :user_id",
+                ({"user_id": user_id, "fetched_at_epoch": fetched_at_epoch} for user_id in user_ids)
+            )
+            self.db.commit()
+
     def get_user_login_from_id(self, user_id: TwitchUserId) -> str:
         return self._get_user_fields_by_id(user_id).login_name
 
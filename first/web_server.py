@@ -1,3 +1,4 @@
+import atexit
 import flask
 import secrets
 import binascii
@@ -12,16 +13,27 @@ import requests
 import typing
 from first.twitch_eventsub import TwitchEventSubWebSocketManager, FakeTwitchEventSubWebSocketThread, TwitchEventSubWebSocketThread, stub_twitch_eventsub_delegate, TwitchEventSubDelegate
 from first.users_cache import TwitchUserNameCache
-from first.pointsdb import PointsDb
+from first.pointsdb import LeaderboardRow, PointsDb, Redemption, StreamSession
+from first.journal import Journal, JournalEntry, JournalProjector
+from first.leaderboard import PointsLeaderboards
 import datetime
 import functools
 import base64
 from first.accountdb import FirstAccountDb, FirstAccountId
+from first.backup import BackupScheduler
+from first.maintenance import MaintenanceScheduler
+from first.errors import FirstAccountNotFoundError, RowNotFoundError, UserNotFoundError
+from first.metrics import query_metrics
 import multiprocessing.dummy
+import re
+import threading
 
 # TODO(strager): Fancier logging.
 logging.basicConfig(level=logging.INFO)
 
+# Number of rows in each page of a leaderboard.
+LEADERBOARD_PAGE_SIZE = 100
+
 twitch_config = first.config.cfg["twitch"]
 website_config = first.config.cfg["website"]
 
@@ -42,11 +54,56 @@ class PointsDbTwitchEventSubDelegate(TwitchEventSubDelegate):
     _points_db: PointsDb
     _account_db: FirstAccountDb
     _authdb: TwitchAuthDb
-
-    def __init__(self, points_db: PointsDb, account_db: FirstAccountDb, authdb: TwitchAuthDb) -> None:
+    _journal: typing.Optional[Journal]
+    _users_cache: typing.Optional[TwitchUserNameCache]
+
+    # TODO(strager): reward_id<->level mapping should be configured
+    # per-streamer.
+    class _LevelMap(typing.NamedTuple):
+        level: int
+        next_max_redemptions: int
+        points: int
+        next_title: str
+    _level_map = {
+        "first": _LevelMap(level=1, next_max_redemptions=2, points=5, next_title="second"),
+        "second": _LevelMap(level=2, next_max_redemptions=3, points=3, next_title="third"),
+        "third": _LevelMap(level=3, next_max_redemptions=1, points=1, next_title="first"),
+    }
+
+    # Name of the journal in PointsDb's journal_offsets table.
+    _journal_name = "redemptions"
+
+    def __init__(self, points_db: PointsDb, account_db: FirstAccountDb, authdb: TwitchAuthDb, journal: typing.Optional[Journal] = None, users_cache: typing.Optional[TwitchUserNameCache] = None) -> None:
+        """If journal is given, redemptions are appended to it instead of
+        being handled immediately. See NOTE[redemption-journal].
+
+        If users_cache is given, user names in redemptions are written
+        through to it. See NOTE[redemption-users-cache].
+        """
         self._points_db = points_db
         self._account_db = account_db
         self._authdb = authdb
+        self._journal = journal
+        self._users_cache = users_cache
+
+    # NOTE[redemption-journal]: Handling a redemption queries the accounts
+    # database, commits to the points database, and calls Twitch's API. Doing
+    # this on the EventSub thread delays receiving the next notification.
+    #
+    # With a journal, the EventSub thread only appends the notification to the
+    # journal (which is cheap, even under bursts; see
+    # NOTE[Journal-group-fsync]). A JournalProjector (see
+    # create_journal_projector) handles journaled redemptions in batches on
+    # another thread. Redemptions are inserted idempotently by redemption_id
+    # (see NOTE[PointsDb-journal]), and Twitch is only called for newly
+    # inserted redemptions, so replaying the journal after a crash is safe.
+
+    # NOTE[redemption-users-cache]: Redemption notifications include the
+    # login and display name of the redeeming user and of the broadcaster.
+    # These are exactly the users shown on leaderboards, so writing them
+    # through to the users cache means most leaderboard names never need a
+    # /helix/users request. With a journal, the users in a whole batch of
+    # entries are written at once on the projector's thread.
 
     def on_eventsub_notification(self,
                                  subscription_type: str,
@@ -54,46 +111,128 @@ class PointsDbTwitchEventSubDelegate(TwitchEventSubDelegate):
                                  event_data: typing.Dict[str, typing.Any]) -> None:
         if subscription_type == "channel.channel_points_custom_reward_redemption.add":
             assert subscription_version == "1"
-            # TODO(strager): reward_id<->level mapping should be configured
-            # per-streamer.
-            class LevelMap(typing.NamedTuple):
-                level: int
-                next_max_redemptions: int
-                points: int
-                next_title: str
-            level_map = {
-                "first": LevelMap(level=1, next_max_redemptions=2, points=5, next_title="second"),
-                "second": LevelMap(level=2, next_max_redemptions=3, points=3, next_title="third"),
-                "third": LevelMap(level=3, next_max_redemptions=1, points=1, next_title="first"),
-            }
-            broadcaster_id = event_data["broadcaster_user_id"]
-            account_id = self._account_db.get_account_id_by_twitch_user_id(broadcaster_id)
-
-            reward_id = self._account_db.get_account_reward_id(account_id)
-            if reward_id == event_data["reward"]["id"]:
-                reward_title = event_data["reward"]["title"]
-                level = level_map[reward_title].level
-                points = level_map[reward_title].points
-                next_title = level_map[reward_title].next_title
-                self._points_db.insert_new_redemption(
-                    broadcaster_id=broadcaster_id,
-                    redemption_id=event_data["id"],
-                    user_id=event_data["user_id"],
-                    # FIXME(strager): This should come from event_data["redeemed_at"] instead.
-                    redeemed_at=datetime.datetime.now(),
-                    points=points,
-                    level=level,
-                )
-                twitch = AuthenticatedTwitch(TwitchAuthDbUserTokenProvider(self._authdb, broadcaster_id))
-                twitch.update_channel_reward(broadcaster_id, reward_id, next_title, max_redemptions=level_map[reward_title].next_max_redemptions)
+            # FIXME(strager): This should come from event_data["redeemed_at"] instead.
+            # Use UTC so the redemption lines up with
+            # stream sessions, whose times come from Twitch in UTC.
+            received_at = datetime.datetime.now(datetime.timezone.utc)
+            if self._journal is not None:
+                self._journal.append({"event": event_data, "received_at": received_at.isoformat()})
+            else:
+                redemption = self._redemption_from_event(event_data, received_at)
+                if redemption is not None:
+                    self._points_db.insert_new_redemption(**redemption._asdict())
+                    self._update_reward_after_redemption(redemption, event_data)
+                self._write_users_through(self._users_from_event(event_data))
 
         elif subscription_type == "channel.channel_points_custom_reward_redemption.update":
             # TODO(#13): Handle rejected redemptions.
             pass
+        elif subscription_type == "stream.online":
+            assert subscription_version == "1"
+            self._points_db.start_stream_session(
+                broadcaster_id=event_data["broadcaster_user_id"],
+                stream_id=event_data["id"],
+                started_at=datetime.datetime.fromisoformat(event_data["started_at"]),
+            )
+        elif subscription_type == "stream.offline":
+            assert subscription_version == "1"
+            self._points_db.end_stream_session(
+                broadcaster_id=event_data["broadcaster_user_id"],
+                # stream.offline does not say when the stream ended.
+                ended_at=datetime.datetime.now(datetime.timezone.utc),
+            )
         else:
             # Ignore.
             pass
 
+    def create_journal_projector(self) -> JournalProjector:
+        """Create a projector which handles redemptions appended to the
+        journal. See NOTE[redemption-journal].
+
+        Precondition: This delegate was created with a journal.
+        """
+        assert self._journal is not None
+        return JournalProjector(
+            self._journal,
+            load_offset=lambda: self._points_db.get_journal_offset(self._journal_name),
+            project=self._project_journal_entries,
+            reset_offset=lambda: self._points_db.set_journal_offset(self._journal_name, 0),
+        )
+
+    def _project_journal_entries(self, entries: typing.List[JournalEntry]) -> None:
+        redemptions = []
+        events = {}
+        users = []
+        for entry in entries:
+            event_data = entry.data["event"]
+            users.extend(self._users_from_event(event_data))
+            try:
+                redemption = self._redemption_from_event(event_data, datetime.datetime.fromisoformat(entry.data["received_at"]))
+            except (RowNotFoundError, FirstAccountNotFoundError):
+                logger.warning("ignoring journaled redemption %s for unknown broadcaster %s", event_data.get("id"), event_data.get("broadcaster_user_id"))
+                continue
+            except KeyError:
+                # For example, the reward was renamed, so its title is not in
+                # _level_map.
+                logger.warning("ignoring malformed journaled redemption %s: %r", event_data.get("id"), event_data, exc_info=True)
+                continue
+            if redemption is not None:
+                redemptions.append(redemption)
+                events[redemption.redemption_id] = event_data
+        inserted = self._points_db.insert_journaled_redemptions(redemptions, journal_name=self._journal_name, journal_offset=entries[-1].end_offset)
+        for redemption in inserted:
+            try:
+                self._update_reward_after_redemption(redemption, events[redemption.redemption_id])
+            except Exception:
+                # The redemption is already committed. Retrying would not
+                # call Twitch again, so just log.
+                logger.warning("failed to update reward after redemption %s", redemption.redemption_id, exc_info=True)
+        self._write_users_through(users)
+
+    @staticmethod
+    def _users_from_event(event_data: typing.Dict[str, typing.Any]) -> typing.List[TwitchUserNameCache.UserInfo]:
+        users = []
+        for prefix in ("broadcaster_user", "user"):
+            user_id = event_data.get(f"{prefix}_id")
+            user_name = event_data.get(f"{prefix}_name")
+            if user_id is not None and user_name is not None:
+                users.append(TwitchUserNameCache.UserInfo(user_id=user_id, user_login=event_data.get(f"{prefix}_login"), user_name=user_name))
+        return users
+
+    def _write_users_through(self, users: typing.List[TwitchUserNameCache.UserInfo]) -> None:
+        """See NOTE[redemption-users-cache]."""
+        if self._users_cache is None or not users:
+            return
+        try:
+            self._users_cache.set_users_info(users)
+        except Exception:
+            # The users cache can fetch the names from Twitch later.
+            logger.warning("failed to write %d users to the users cache", len(users), exc_info=True)
+
+    def _redemption_from_event(self, event_data: typing.Dict[str, typing.Any], redeemed_at: datetime.datetime) -> typing.Optional[Redemption]:
+        """Return None if the redemption is not for the broadcaster's First!
+        reward.
+        """
+        broadcaster_id = event_data["broadcaster_user_id"]
+        account_id = self._account_db.get_account_id_by_twitch_user_id(broadcaster_id)
+        reward_id = self._account_db.get_account_reward_id(account_id)
+        if reward_id != event_data["reward"]["id"]:
+            return None
+        level_map = self._level_map[event_data["reward"]["title"]]
+        return Redemption(
+            broadcaster_id=broadcaster_id,
+            redemption_id=event_data["id"],
+            user_id=event_data["user_id"],
+            redeemed_at=redeemed_at,
+            points=level_map.points,
+            level=level_map.level,
+        )
+
+    def _update_reward_after_redemption(self, redemption: Redemption, event_data: typing.Dict[str, typing.Any]) -> None:
+        level_map = self._level_map[event_data["reward"]["title"]]
+        twitch = AuthenticatedTwitch(TwitchAuthDbUserTokenProvider(self._authdb, redemption.broadcaster_id))
+        twitch.update_channel_reward(redemption.broadcaster_id, event_data["reward"]["id"], level_map.next_title, max_redemptions=level_map.next_max_redemptions)
+
 def create_app_for_testing(
     account_db: FirstAccountDb = FirstAccountDb(":memory:"),
     authdb: TwitchAuthDb = TwitchAuthDb(":memory:"),
@@ -102,26 +241,73 @@ def create_app_for_testing(
     # Used only if eventsub_websocket_manager is None.
     eventsub_delegate: TwitchEventSubDelegate = stub_twitch_eventsub_delegate,
     twitch_users_cache: TwitchUserNameCache = TwitchUserNameCache(":memory:"),
+    backup_scheduler: typing.Optional[BackupScheduler] = None,
 ) -> flask.Flask:
     if eventsub_websocket_manager is None:
         eventsub_websocket_manager = TwitchEventSubWebSocketManager(FakeTwitchEventSubWebSocketThread, eventsub_delegate)
-    return create_app_from_dependencies(account_db=account_db, authdb=authdb, points_db=points_db, eventsub_websocket_manager=eventsub_websocket_manager, twitch_users_cache=twitch_users_cache)
+    return create_app_from_dependencies(account_db=account_db, authdb=authdb, points_db=points_db, eventsub_websocket_manager=eventsub_websocket_manager, twitch_users_cache=twitch_users_cache, backup_scheduler=backup_scheduler)
 
 def create_app() -> flask.Flask:
     """Create the Flask app for production. Named 'create_app' because that's
     the name that Flask looks for.
     """
-    points_db = PointsDb()
+    twitch_users_cache = TwitchUserNameCache()
+    # See NOTE[TwitchUserNameCache-refresh].
+    twitch_users_cache.start_refreshing()
+    # Attach the users database so leaderboards can look up display names
+    # with a JOIN. See PointsDb.add_display_names.
+    points_db = PointsDb(users_db=first.config.cfg["usersdb"]["db"])
+    if first.config.cfg["pointsdb"].get("group_commit", False):
+        points_db.start_group_commit()
+        atexit.register(points_db.stop_group_commit)
     account_db = FirstAccountDb()
     authdb = TwitchAuthDb()
-    eventsub_delegate = PointsDbTwitchEventSubDelegate(points_db=points_db, account_db=account_db, authdb=authdb)
+    # Finish backfills and index builds before serving requests. See
+    # NOTE[DbBase-migrations].
+    for db in (twitch_users_cache, points_db, account_db, authdb):
+        db.run_online_migrations()
+    journal_path = first.config.cfg["pointsdb"].get("journal")
+    journal = None if journal_path is None else Journal(journal_path)
+    eventsub_delegate = PointsDbTwitchEventSubDelegate(points_db=points_db, account_db=account_db, authdb=authdb, journal=journal, users_cache=twitch_users_cache)
+    if journal is not None:
+        journal_projector = eventsub_delegate.create_journal_projector()
+        # Catch up on redemptions journaled before the last shutdown.
+        journal_projector.project_pending()
+        journal_projector.start()
+        atexit.register(journal_projector.stop)
+    backup_scheduler = None
+    backup_config = first.config.cfg.get("backup")
+    if backup_config is not None:
+        backup_scheduler = BackupScheduler(
+            databases={
+                "points": points_db,
+                "accounts": account_db,
+                "auth": authdb,
+                "users": twitch_users_cache,
+            },
+            directory=backup_config["directory"],
+            keep=backup_config.get("keep", 7),
+        )
+        interval_hours = backup_config.get("interval_hours")
+        if interval_hours is not None:
+            backup_scheduler.start(interval_seconds=interval_hours * 60 * 60)
+    maintenance_config = first.config.cfg.get("maintenance", {})
+    if maintenance_config.get("enabled", True):
+        maintenance_scheduler = MaintenanceScheduler({
+            "points": points_db,
+            "accounts": account_db,
+            "auth": authdb,
+            "users": twitch_users_cache,
+        })
+        maintenance_scheduler.start(hour_utc=maintenance_config.get("hour_utc", 9))
     eventsub_websocket_manager = TwitchEventSubWebSocketManager(TwitchEventSubWebSocketThread, eventsub_delegate)
     return create_app_from_dependencies(
         account_db=account_db,
         authdb=authdb,
         points_db=points_db,
         eventsub_websocket_manager=eventsub_websocket_manager,
-        twitch_users_cache=TwitchUserNameCache(),
+        twitch_users_cache=twitch_users_cache,
+        backup_scheduler=backup_scheduler,
     )
 
 def create_app_from_dependencies(
@@ -130,12 +316,15 @@ def create_app_from_dependencies(
     points_db: PointsDb,
     eventsub_websocket_manager: TwitchEventSubWebSocketManager,
     twitch_users_cache: TwitchUserNameCache,
+    backup_scheduler: typing.Optional[BackupScheduler] = None,
 ) -> flask.Flask:
     app = flask.Flask(__name__)
     app.secret_key = website_config["session_secret_key"]
 
     thread_pool = multiprocessing.dummy.Pool(processes=4)
 
+    leaderboards = PointsLeaderboards(points_db)
+
     @app.context_processor
     def inject_template_globals():
         return {
@@ -143,21 +332,130 @@ def create_app_from_dependencies(
             "twitch_users_cache": twitch_users_cache,
         }
 
+    def resolve_display_names(pages: typing.Sequence[typing.Optional[typing.List[LeaderboardRow]]], extra_user_ids: typing.Sequence[TwitchUserId] = ()) -> typing.Dict[TwitchUserId, str]:
+        """Return the display names of extra_user_ids and of every row whose
+        display name add_display_names did not find.
+
+        Names missing from the users database are fetched from Twitch in
+        batches, so rendering a page does not call Twitch once per row.
+        """
+        user_ids = list(extra_user_ids)
+        for rows in pages:
+            if rows is not None:
+                user_ids.extend(row.id for row in rows if row.display_name is None)
+        return twitch_users_cache.get_display_name_from_id_batch(user_ids)
+
+    def fill_in_display_names(rows: typing.List[LeaderboardRow], display_names: typing.Dict[TwitchUserId, str]) -> typing.List[LeaderboardRow]:
+        """See resolve_display_names."""
+        return [row if row.display_name is not None else row._replace(display_name=display_names[row.id]) for row in rows]
+
+    def get_leaderboard_page_number() -> int:
+        """Parse the ?page= query parameter. Pages start at 1."""
+        page = flask.request.args.get("page", 1, type=int)
+        return max(page, 1)
+
     @app.route("/")
     def home():
-        return flask.render_template('index.html', firsts_per_streamer=points_db.get_streamers_lifetime_leaderboard(), id_to_display_name=twitch_users_cache.get_display_name_from_id)
+        page = get_leaderboard_page_number()
+        offset = (page - 1) * LEADERBOARD_PAGE_SIZE
+        # Fetch one extra row to find out whether there is a next page.
+        firsts_per_streamer = leaderboards.get_streamers_lifetime_leaderboard(limit=LEADERBOARD_PAGE_SIZE + 1, offset=offset)
+        named_firsts_per_streamer = points_db.add_display_names(firsts_per_streamer[:LEADERBOARD_PAGE_SIZE])
+        display_names = resolve_display_names([named_firsts_per_streamer])
+        return flask.render_template(
+            'index.html',
+            firsts_per_streamer=fill_in_display_names(named_firsts_per_streamer, display_names),
+            page=page,
+            has_next_page=len(firsts_per_streamer) > LEADERBOARD_PAGE_SIZE,
+            rank_offset=offset,
+            id_to_display_name=twitch_users_cache.get_display_name_from_id,
+        )
 
     @app.get("/login")
     def log_in_view():
         return flask.render_template('login.html')
 
-    @app.get("/stream/<broadcaster_id>")
-    def stream_leaderboard(broadcaster_id: TwitchUserId):
+    @app.get("/stream/<broadcaster>")
+    def stream_leaderboard(broadcaster: str):
+        """broadcaster is either a Twitch user ID or a login name."""
+        if broadcaster.isdigit():
+            broadcaster_id: TwitchUserId = broadcaster
+        elif not re.fullmatch(r"\w{1,25}", broadcaster, re.ASCII):
+            # Not a valid login name. Don't bother asking Twitch.
+            return "", 404
+        else:
+            try:
+                broadcaster_id = twitch_users_cache.get_user_id_from_user_name(broadcaster)
+            except UserNotFoundError:
+                return "", 404
+        page = get_leaderboard_page_number()
+        offset = (page - 1) * LEADERBOARD_PAGE_SIZE
+        # Fetch one extra row to find out whether there is a next page.
+        lifetime_points = leaderboards.get_lifetime_channel_points(broadcaster_id=broadcaster_id, limit=LEADERBOARD_PAGE_SIZE + 1, offset=offset)
+        monthly_points = leaderboards.get_monthly_channel_points(broadcaster_id=broadcaster_id, limit=LEADERBOARD_PAGE_SIZE + 1, offset=offset)
+        has_next_page = len(lifetime_points) > LEADERBOARD_PAGE_SIZE or len(monthly_points) > LEADERBOARD_PAGE_SIZE
+
+        stream_session: typing.Optional[StreamSession]
+        try:
+            stream_session = points_db.get_latest_stream_session(broadcaster_id)
+        except RowNotFoundError:
+            stream_session = None
+        stream_session_points = None
+        if stream_session is not None:
+            stream_session_points = points_db.get_stream_session_channel_points(
+                session_id=stream_session.session_id,
+                limit=LEADERBOARD_PAGE_SIZE + 1,
+                offset=offset,
+            )
+            has_next_page = has_next_page or len(stream_session_points) > LEADERBOARD_PAGE_SIZE
+            stream_session_points = stream_session_points[:LEADERBOARD_PAGE_SIZE]
+
+        # Optional custom date range: ?from=YYYY-MM-DD&to=YYYY-MM-DD (both
+        # inclusive).
+        range_args = {}
+        range_points = None
+        range_from_string = flask.request.args.get("from", None)
+        range_to_string = flask.request.args.get("to", None)
+        if range_from_string is not None or range_to_string is not None:
+            try:
+                range_from = datetime.date.fromisoformat(range_from_string) if range_from_string else datetime.date.min
+                range_to = datetime.date.fromisoformat(range_to_string) if range_to_string else datetime.datetime.now(datetime.timezone.utc).date()
+            except ValueError:
+                return "", 400
+            if range_to >= datetime.date.max:
+                return "", 400
+            range_args = {"from": range_from.isoformat(), "to": range_to.isoformat()}
+            range_points = points_db.get_channel_points_between(
+                broadcaster_id=broadcaster_id,
+                start=range_from,
+                end=range_to + datetime.timedelta(days=1),
+                limit=LEADERBOARD_PAGE_SIZE + 1,
+                offset=offset,
+            )
+            has_next_page = has_next_page or len(range_points) > LEADERBOARD_PAGE_SIZE
+            range_points = range_points[:LEADERBOARD_PAGE_SIZE]
+
+        named_lifetime_points = points_db.add_display_names(lifetime_points[:LEADERBOARD_PAGE_SIZE])
+        named_monthly_points = points_db.add_display_names(monthly_points[:LEADERBOARD_PAGE_SIZE])
+        named_range_points = None if range_points is None else points_db.add_display_names(range_points)
+        named_stream_session_points = None if stream_session_points is None else points_db.add_display_names(stream_session_points)
+        display_names = resolve_display_names(
+            [named_lifetime_points, named_monthly_points, named_range_points, named_stream_session_points],
+            extra_user_ids=[broadcaster_id],
+        )
         return flask.render_template(
             'stream-leaderboard.html',
-            stream_name=twitch_users_cache.get_display_name_from_id(broadcaster_id),
-            lifetime_points=points_db.get_lifetime_channel_points(broadcaster_id=broadcaster_id),
-            monthly_points=points_db.get_monthly_channel_points(broadcaster_id=broadcaster_id),
+            broadcaster=broadcaster,
+            stream_name=display_names[broadcaster_id],
+            lifetime_points=fill_in_display_names(named_lifetime_points, display_names),
+            monthly_points=fill_in_display_names(named_monthly_points, display_names),
+            range_points=None if named_range_points is None else fill_in_display_names(named_range_points, display_names),
+            stream_session=stream_session,
+            stream_session_points=None if named_stream_session_points is None else fill_in_display_names(named_stream_session_points, display_names),
+            range_args=range_args,
+            page=page,
+            has_next_page=has_next_page,
+            rank_offset=offset,
             id_to_display_name=twitch_users_cache.get_display_name_from_id,
         )
 
@@ -178,6 +476,33 @@ def create_app_from_dependencies(
             id_to_display_name=twitch_users_cache.get_display_name_from_id,
         )
 
+    @app.get("/admin/metrics")
+    @requires_admin_auth
+    def admin_metrics():
+        return flask.render_template(
+            'admin/metrics.html',
+            query_metrics=query_metrics.get_summaries(),
+            display_name_cache_stats=twitch_users_cache.get_memory_cache_stats(),
+            display_name_fetch_stats=twitch_users_cache.get_fetch_stats(),
+        )
+
+    @app.get("/admin/backups")
+    @requires_admin_auth
+    def admin_backups():
+        return flask.render_template(
+            'admin/backups.html',
+            backup_scheduler=backup_scheduler,
+            backup_statuses=[] if backup_scheduler is None else backup_scheduler.get_statuses(),
+        )
+
+    @app.post("/admin/backups")
+    @requires_admin_auth
+    def admin_backups_post():
+        if backup_scheduler is None:
+            return "", 404
+        backup_scheduler.back_up_all_in_background()
+        return flask.redirect(flask.url_for(admin_backups.__name__))
+
     @app.get("/admin/accounts")
     @requires_admin_auth
     def admin_accounts():
@@ -284,6 +609,7 @@ def create_app_from_dependencies(
             user_id=user_id,
             access_token=access_token,
             refresh_token=refresh_token,
+            access_token_expires_in_seconds=response.get('expires_in'),
         )
 
         account_id = account_db.create_or_get_account(twitch_user_id=user_id)
@@ -345,6 +671,15 @@ def create_app_from_dependencies(
                     "broadcaster_user_id": user_id,
                 },
             )
+            # See NOTE[PointsDb-stream-sessions].
+            for stream_subscription_type in ("stream.online", "stream.offline"):
+                ws_connection.add_subscription(
+                    type=stream_subscription_type,
+                    version="1",
+                    condition={
+                        "broadcaster_user_id": user_id,
+                    },
+                )
             ws_connection.start_thread()
 
     @app.route("/api/whoami")
@@ -357,7 +692,6 @@ def create_app_from_dependencies(
         for user_id in account_db.get_all_twitch_user_ids_with_any_reward_id():
             start_or_stop_eventsub_for_user_as_needed_sync(user_id)
 
-        import atexit
         atexit.register(lambda: thread_pool.terminate())
 
     set_up()
@@ -1,9 +1,10 @@
 from datetime import datetime, timezone
+import json
 import responses
 import threading
 import time
 import pytest
-from first.authdb import TwitchAuthDb, TwitchAuthDbUserTokenProvider
+from first.authdb import AppTokenCache, TwitchAppTokenProvider, TwitchAuthDb, TwitchAuthDbUserTokenProvider, app_token_cache, user_access_token_cache
 from first.errors import UserNotFoundError
 import urllib.parse
 import first.config
@@ -212,3 +213,102 @@ def test_token_provider_refresh_gets_new_access_and_access_tokens_from_twitch_ap
 
     assert authdb.get_access_token(user_id="5") == "new_access_token"
     assert authdb.get_refresh_token(user_id="5") == "new_refresh_token"
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def mock_app_tokens(expires_in=None):
+    """Make Twitch return app_token_1, app_token_2, etc."""
+    tokens_issued = 0
+    def issue_token(request):
+        nonlocal tokens_issued
+        tokens_issued += 1
+        body = {"access_token": f"app_token_{tokens_issued}", "token_type": "bearer"}
+        if expires_in is not None:
+            body["expires_in"] = expires_in
+        return (200, {}, json.dumps(body))
+    responses.add_callback(responses.POST, "https://id.twitch.tv/oauth2/token", callback=issue_token)
+
+@responses.activate
+def test_app_token_is_shared_by_providers():
+    mock_app_tokens(expires_in=5000000)
+    app_token_cache.clear_for_testing()
+    assert TwitchAppTokenProvider().get_access_token() == "app_token_1"
+    assert TwitchAppTokenProvider().get_access_token() == "app_token_1"
+    assert len(responses.calls) == 1
+    app_token_cache.clear_for_testing()
+
+@responses.activate
+def test_app_token_is_refreshed_shortly_before_it_expires():
+    mock_app_tokens(expires_in=1000)
+    clock = FakeClock()
+    cache = AppTokenCache(clock=clock)
+    assert cache.get_access_token() == "app_token_1"
+    clock.now = 899
+    assert cache.get_access_token() == "app_token_1"
+    clock.now = 950
+    assert cache.get_access_token() == "app_token_2"
+    clock.now = 1800
+    assert cache.get_access_token() == "app_token_2"
+    assert len(responses.calls) == 2
+
+@responses.activate
+def test_old_app_token_is_used_if_early_refresh_fails():
+    mock_app_tokens(expires_in=1000)
+    clock = FakeClock()
+    cache = AppTokenCache(clock=clock)
+    assert cache.get_access_token() == "app_token_1"
+    responses.replace(responses.POST, "https://id.twitch.tv/oauth2/token", body=ConnectionError("Twitch is down"))
+    clock.now = 950
+    assert cache.get_access_token() == "app_token_1"
+    clock.now = 1000
+    with pytest.raises(ConnectionError):
+        cache.get_access_token()
+
+@responses.activate
+def test_rejected_app_token_is_refreshed_once():
+    mock_app_tokens()
+    clock = FakeClock()
+    cache = AppTokenCache(clock=clock)
+    assert cache.get_access_token() == "app_token_1"
+    clock.now = 60
+    assert cache.refresh_access_token() == "app_token_2"
+    clock.now = 61
+    assert cache.refresh_access_token() == "app_token_2", "token was refreshed too recently"
+    assert cache.get_access_token() == "app_token_2"
+
+def test_access_tokens_are_cached_until_updated(monkeypatch):
+    user_access_token_cache.clear_for_testing()
+    authdb = TwitchAuthDb(":memory:")
+    authdb.update_or_create_user(user_id="5", access_token="token_1", refresh_token="refresh_1")
+    database_reads = []
+    get_access_token_from_database = authdb._get_access_token_from_database
+    def counting_get_access_token_from_database(user_id):
+        database_reads.append(user_id)
+        return get_access_token_from_database(user_id)
+    monkeypatch.setattr(authdb, "_get_access_token_from_database", counting_get_access_token_from_database)
+
+    assert TwitchAuthDbUserTokenProvider(authdb, user_id="5").get_access_token() == "token_1"
+    assert TwitchAuthDbUserTokenProvider(authdb, user_id="5").get_access_token() == "token_1"
+    assert database_reads == ["5"]
+
+    authdb.update_or_create_user(user_id="5", access_token="token_2", refresh_token="refresh_2", access_token_expires_in_seconds=3600)
+    assert authdb.get_access_token(user_id="5") == "token_2"
+    assert database_reads == ["5"], "token with known expiry should be cached by update"
+
+    authdb.update_or_create_user(user_id="5", access_token="token_3", refresh_token="refresh_3", access_token_expires_in_seconds=30)
+    assert authdb.get_access_token(user_id="5") == "token_3"
+    assert database_reads == ["5", "5"], "token about to expire should not be cached by update"
+    user_access_token_cache.clear_for_testing()
+
+def test_access_tokens_are_shared_by_authdbs():
+    user_access_token_cache.clear_for_testing()
+    writer_authdb = TwitchAuthDb(":memory:")
+    writer_authdb.update_or_create_user(user_id="5", access_token="token_1", refresh_token="refresh_1", access_token_expires_in_seconds=3600)
+    reader_authdb = TwitchAuthDb(":memory:")
+    assert reader_authdb.get_access_token(user_id="5") == "token_1"
+    user_access_token_cache.clear_for_testing()
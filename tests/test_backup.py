@@ -0,0 +1,38 @@
+import pathlib
+from first.backup import BackupScheduler
+from first.db import DbBase
+from first.pointsdb import PointsDb
+
+def test_back_up_all_keeps_newest_backups(tmp_path):
+    points_db = PointsDb(str(tmp_path / "points.db"))
+    backup_directory = tmp_path / "backups"
+    scheduler = BackupScheduler({"points": points_db}, directory=str(backup_directory), keep=2, pause_seconds=0)
+    for _ in range(3):
+        assert scheduler.back_up_all()
+    [status] = scheduler.get_statuses()
+    assert status.name == "points"
+    assert not status.in_progress
+    assert status.last_error is None
+    assert status.last_finished_at is not None
+    assert status.pages_copied == status.pages_total
+    assert len(status.backups) == 2
+    assert sorted(str(path) for path in backup_directory.iterdir()) == sorted(status.backups)
+
+    # Existing backups are found by a new scheduler.
+    scheduler = BackupScheduler({"points": points_db}, directory=str(backup_directory), keep=2)
+    [status] = scheduler.get_statuses()
+    assert len(status.backups) == 2
+
+class BrokenDb(DbBase):
+    def back_up_to(self, destination_path, pages_per_step=100, pause_seconds=0.005, progress=None) -> None:
+        raise OSError("disk full")
+
+def test_failed_backup_is_reported_and_other_databases_are_backed_up(tmp_path):
+    points_db = PointsDb(str(tmp_path / "points.db"))
+    scheduler = BackupScheduler({"broken": BrokenDb(), "points": points_db}, directory=str(tmp_path / "backups"), pause_seconds=0)
+    assert scheduler.back_up_all()
+    (broken_status, points_status) = scheduler.get_statuses()
+    assert broken_status.last_error == "disk full"
+    assert broken_status.backups == []
+    assert points_status.last_error is None
+    assert len(points_status.backups) == 1
@@ -0,0 +1,38 @@
+from first.cache import LruCache
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def test_lru_cache_expires_entries():
+    clock = FakeClock()
+    cache: LruCache[str, str] = LruCache(max_size=10, clock=clock)
+    cache.put("a", "A", ttl_seconds=10)
+    assert cache.get("a") == "A"
+    clock.now = 10
+    assert cache.get("a") is None
+    assert cache.get_stats() == LruCache.Stats(hits=1, misses=1, size=0)
+
+def test_lru_cache_evicts_least_recently_used_entry():
+    cache: LruCache[str, str] = LruCache(max_size=2)
+    cache.put("a", "A", ttl_seconds=60)
+    cache.put("b", "B", ttl_seconds=60)
+    assert cache.get("a") == "A"
+    cache.put("c", "C", ttl_seconds=60)
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+    assert cache.get_stats().hit_rate == 3 / 4
+
+def test_lru_cache_peek_does_not_count_lookups():
+    cache: LruCache[str, str] = LruCache(max_size=2)
+    cache.put("a", "A", ttl_seconds=60)
+    cache.put("b", "B", ttl_seconds=60)
+    assert cache.peek("a") == "A"
+    assert cache.peek("c") is None
+    assert cache.get_stats() == LruCache.Stats(hits=0, misses=0, size=2)
+    cache.put("c", "C", ttl_seconds=60)
+    assert cache.peek("a") is None, "peek should not mark entries as recently used"
@@ -0,0 +1,182 @@
+from datetime import datetime, timezone
+import pytest
+import sqlite3
+import threading
+import time
+import typing
+from first.db import BackfillMigration, DbBase, IndexMigration, SchemaMigration
+from first.metrics import query_metrics
+import first.pointsdb
+from first.pointsdb import PointsDb
+from first.usersdb import TwitchUsersDb
+
+def test_file_database_uses_wal(tmp_path):
+    points_db = PointsDb(str(tmp_path / "points.db"))
+    journal_mode, = points_db.db.execute("PRAGMA journal_mode").fetchone()
+    assert journal_mode == "wal"
+
+def test_reads_see_committed_writes(tmp_path):
+    points_db = PointsDb(str(tmp_path / "points.db"))
+    assert points_db.get_lifetime_channel_points("streamer_1") == []
+    points_db.insert_new_redemption(broadcaster_id="streamer_1", redemption_id="r1", user_id="user_1", redeemed_at=datetime.now(timezone.utc), points=5, level=1)
+    assert points_db.get_lifetime_channel_points("streamer_1") == [("user_1", 5)]
+
+def test_reads_do_not_wait_for_writer_lock(tmp_path):
+    points_db = PointsDb(str(tmp_path / "points.db"))
+    points_db.insert_new_redemption(broadcaster_id="streamer_1", redemption_id="r1", user_id="user_1", redeemed_at=datetime.now(timezone.utc), points=5, level=1)
+
+    results = []
+    with points_db._lock:
+        thread = threading.Thread(target=lambda: results.append(points_db.get_lifetime_channel_points("streamer_1")))
+        thread.start()
+        thread.join(timeout=10)
+        assert not thread.is_alive(), "read should not wait for the writer lock"
+    assert results == [[("user_1", 5)]]
+
+def test_read_connections_are_read_only(tmp_path):
+    points_db = PointsDb(str(tmp_path / "points.db"))
+    with points_db._read_connection() as db:
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            db.execute("DELETE FROM redemptions")
+
+def test_queries_are_timed_per_method():
+    query_metrics.clear_for_testing()
+    points_db = PointsDb(":memory:")
+    points_db.insert_new_redemption(broadcaster_id="streamer_1", redemption_id="r1", user_id="user_1", redeemed_at=datetime.now(timezone.utc), points=5, level=1)
+    points_db.get_lifetime_channel_points("streamer_1")
+    phases = {(row.query_name, row.phase) for row in query_metrics.get_summaries()}
+    assert ("PointsDb.insert_new_redemption", "lock_wait") in phases
+    # Queries are named after the method which took the lock, not the helper
+    # which ran them.
+    assert ("PointsDb.insert_new_redemption", "execute") in phases
+    assert ("PointsDb.insert_new_redemption", "commit") in phases
+    assert ("PointsDb.get_lifetime_channel_points", "lock_wait") in phases
+    assert ("PointsDb.get_lifetime_channel_points", "execute") in phases
+    assert ("PointsDb.get_lifetime_channel_points", "fetch") in phases
+
+class WidgetDb(DbBase):
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self._create_sqlite3_database(path)
+        self._migrate([
+            SchemaMigration(version=1, description="create widgets", apply=lambda cur: cur.execute("CREATE TABLE IF NOT EXISTS widgets(name, size)")),
+            SchemaMigration(version=2, description="add doubled size", apply=self._add_doubled_size_column),
+            BackfillMigration(version=3, description="backfill doubled size", table_name="widgets", set_sql="doubled_size = size * 2", where_sql="doubled_size IS NULL"),
+            IndexMigration(version=4, description="index widgets by doubled size", table_name="widgets", create_index_sql="CREATE INDEX IF NOT EXISTS widgets_by_doubled_size ON widgets (doubled_size)"),
+        ])
+
+    def _add_doubled_size_column(self, cur: sqlite3.Cursor) -> None:
+        columns = {name for (_cid, name, *_rest) in cur.execute("PRAGMA table_info(widgets)").fetchall()}
+        if "doubled_size" not in columns:
+            cur.execute("ALTER TABLE widgets ADD COLUMN doubled_size")
+
+def get_applied_versions(db: DbBase) -> typing.List[int]:
+    return [version for (version,) in db.db.execute("SELECT version FROM schema_migrations ORDER BY version")]
+
+def test_migrations_of_new_database_are_applied_immediately():
+    db = WidgetDb(":memory:")
+    assert get_applied_versions(db) == [1, 2, 3, 4]
+    assert db.db.execute("SELECT name FROM sqlite_master WHERE name = 'widgets_by_doubled_size'").fetchone() is not None
+
+def test_online_migrations_of_existing_database_are_deferred_and_resumable(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "widgets.db")
+    old_db = sqlite3.connect(db_path)
+    old_db.execute("CREATE TABLE widgets(name, size)")
+    old_db.executemany("INSERT INTO widgets VALUES (?, ?)", [(f"widget_{i}", i) for i in range(5)])
+    old_db.commit()
+    old_db.close()
+
+    db = WidgetDb(db_path)
+    assert get_applied_versions(db) == [1, 2]
+
+    # Interrupt the backfill after the first chunk.
+    class Interrupted(Exception):
+        pass
+    def interrupt(_seconds: float) -> None:
+        raise Interrupted()
+    monkeypatch.setattr(time, "sleep", interrupt)
+    with pytest.raises(Interrupted):
+        db.run_online_migrations(chunk_size=2, pause_seconds=0)
+    monkeypatch.undo()
+    assert db.db.execute("SELECT COUNT(*) FROM widgets WHERE doubled_size IS NOT NULL").fetchone()[0] == 2
+
+    db = WidgetDb(db_path)
+    assert get_applied_versions(db) == [1, 2]
+    db.run_online_migrations(chunk_size=2, pause_seconds=0)
+    assert get_applied_versions(db) == [1, 2, 3, 4]
+    assert db.db.execute("SELECT size, doubled_size FROM widgets WHERE doubled_size != size * 2").fetchall() == []
+    assert db.db.execute("SELECT name FROM sqlite_master WHERE name = 'widgets_by_doubled_size'").fetchone() is not None
+
+    # Nothing is left to do.
+    db = WidgetDb(db_path)
+    db.run_online_migrations()
+    assert get_applied_versions(db) == [1, 2, 3, 4]
+
+@pytest.mark.parametrize("in_memory", [False, True])
+def test_back_up_to_copies_database(tmp_path, in_memory):
+    points_db = PointsDb(":memory:" if in_memory else str(tmp_path / "points.db"))
+    for i in range(100):
+        points_db.insert_new_redemption(broadcaster_id="streamer_1", redemption_id=f"r{i}", user_id=f"user_{i % 3}", redeemed_at=datetime.now(timezone.utc), points=5, level=1)
+    progress = []
+    backup_path = str(tmp_path / "backup.db")
+    points_db.back_up_to(backup_path, pages_per_step=1, pause_seconds=0, progress=lambda copied, total: progress.append((copied, total)))
+    assert progress[-1][0] == progress[-1][1]
+    backup_db = PointsDb(backup_path)
+    assert backup_db.get_lifetime_channel_points("streamer_1") == points_db.get_lifetime_channel_points("streamer_1")
+
+def test_back_up_to_copies_a_snapshot_without_blocking_writes(tmp_path):
+    points_db = PointsDb(str(tmp_path / "points.db"))
+    for i in range(100):
+        points_db.insert_new_redemption(broadcaster_id="streamer_1", redemption_id=f"r{i}", user_id="user_1", redeemed_at=datetime.now(timezone.utc), points=5, level=1)
+    def write_during_backup(copied: int, total: int) -> None:
+        if copied == 1:
+            points_db.insert_new_redemption(broadcaster_id="streamer_1", redemption_id="during_backup", user_id="user_2", redeemed_at=datetime.now(timezone.utc), points=5, level=1)
+    backup_path = str(tmp_path / "backup.db")
+    points_db.back_up_to(backup_path, pages_per_step=1, pause_seconds=0, progress=write_during_backup)
+    assert PointsDb(backup_path).get_lifetime_channel_points("streamer_1") == [("user_1", 500)]
+    assert points_db.get_lifetime_channel_points("streamer_1") == [("user_1", 500), ("user_2", 5)]
+
+def test_maintenance_reclaims_deleted_pages(tmp_path):
+    points_db = PointsDb(str(tmp_path / "points.db"))
+    points_db.import_redemptions(
+        first.pointsdb.Redemption(broadcaster_id="streamer_1", redemption_id=f"r{i}", user_id=f"user_{i}", redeemed_at=datetime.now(timezone.utc), points=5, level=1)
+        for i in range(5000)
+    )
+    with points_db._lock:
+        points_db.db.execute("DELETE FROM redemptions")
+        points_db.db.commit()
+    result = points_db.run_maintenance(vacuum_pages_per_step=10, pause_seconds=0)
+    assert result.bytes_reclaimed > 0
+    assert result.unreclaimable_free_pages == 0
+    (free_pages,) = points_db.db.execute("PRAGMA freelist_count").fetchone()
+    assert free_pages == 0
+    assert not (tmp_path / "points.db-wal").exists() or (tmp_path / "points.db-wal").stat().st_size == 0
+
+def test_maintenance_reports_free_pages_of_old_databases(tmp_path):
+    db_path = str(tmp_path / "points.db")
+    old_db = sqlite3.connect(db_path)
+    old_db.execute("CREATE TABLE filler(data)")
+    old_db.executemany("INSERT INTO filler VALUES (?)", [(b"x" * 1000,) for _ in range(1000)])
+    old_db.execute("DELETE FROM filler")
+    old_db.commit()
+    old_db.close()
+    result = PointsDb(db_path).run_maintenance()
+    assert result.unreclaimable_free_pages > 0
+
+def test_maintenance_does_not_touch_attached_databases(tmp_path):
+    users_db_path = str(tmp_path / "users.db")
+    users_db = TwitchUsersDb(users_db_path)
+    users_db.insert_or_update_user(user_id="user_1", user_login="one", user_name="One")
+    assert (tmp_path / "users.db-wal").stat().st_size > 0
+    points_db = PointsDb(str(tmp_path / "points.db"), users_db=users_db_path)
+    points_db.run_maintenance(pause_seconds=0)
+    assert (tmp_path / "users.db-wal").stat().st_size > 0, "users.db should be checkpointed by its own DbBase"
+
+def test_attached_databases_are_not_attached_to_writer(tmp_path):
+    users_db_path = str(tmp_path / "users.db")
+    users_db = TwitchUsersDb(users_db_path)
+    users_db.insert_or_update_user(user_id="user_1", user_login="one", user_name="One")
+    points_db = PointsDb(str(tmp_path / "points.db"), users_db=users_db_path)
+    # Transactions on the writer must not lock users.db.
+    assert [name for (_seq, name, _path) in points_db.db.execute("PRAGMA database_list")] == ["main"]
+    assert points_db.add_display_names([("user_1", 5)])[0].display_name == "One"
@@ -0,0 +1,141 @@
+import pytest
+import threading
+from first.journal import CorruptJournalEntryError, Journal, JournalEntry, JournalProjector
+
+def test_appended_entries_can_be_read_back(tmp_path):
+    journal = Journal(str(tmp_path / "test.journal"))
+    journal.append({"n": 1})
+    journal.append({"n": 2})
+    entries = journal.read_entries(0, max_count=10)
+    assert [entry.data for entry in entries] == [{"n": 1}, {"n": 2}]
+    assert entries[-1].end_offset == journal.size
+    assert journal.read_entries(entries[0].end_offset, max_count=10) == entries[1:]
+    assert journal.read_entries(0, max_count=1) == entries[:1]
+
+def test_entries_survive_reopening(tmp_path):
+    path = str(tmp_path / "test.journal")
+    journal = Journal(path)
+    journal.append({"n": 1})
+    journal.close()
+    journal = Journal(path)
+    journal.append({"n": 2})
+    assert [entry.data for entry in journal.read_entries(0, max_count=10)] == [{"n": 1}, {"n": 2}]
+
+def test_incomplete_entry_is_discarded_when_reopening(tmp_path):
+    path = str(tmp_path / "test.journal")
+    journal = Journal(path)
+    journal.append({"n": 1})
+    journal.close()
+    with open(path, "ab") as file:
+        file.write(b'{"n":')
+    journal = Journal(path)
+    journal.append({"n": 2})
+    assert [entry.data for entry in journal.read_entries(0, max_count=10)] == [{"n": 1}, {"n": 2}]
+
+def test_concurrent_appends_are_all_durable(tmp_path):
+    journal = Journal(str(tmp_path / "test.journal"))
+    def append_many(thread_index: int) -> None:
+        for i in range(50):
+            journal.append({"thread": thread_index, "i": i})
+    threads = [threading.Thread(target=append_many, args=(thread_index,)) for thread_index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    entries = journal.read_entries(0, max_count=1000)
+    assert len(entries) == 200
+    for thread_index in range(4):
+        assert [entry.data["i"] for entry in entries if entry.data["thread"] == thread_index] == list(range(50))
+
+class FakeStore:
+    def __init__(self) -> None:
+        self.offset = 0
+        self.projected: list = []
+
+    def project(self, entries: list) -> None:
+        self.projected.extend(entry.data for entry in entries)
+        self.offset = entries[-1].end_offset
+
+    def reset_offset(self) -> None:
+        self.offset = 0
+
+    def create_projector(self, journal: Journal, **kwargs) -> JournalProjector:
+        return JournalProjector(journal, load_offset=lambda: self.offset, project=self.project, reset_offset=self.reset_offset, **kwargs)
+
+def test_projector_resumes_from_recorded_offset(tmp_path):
+    path = str(tmp_path / "test.journal")
+    store = FakeStore()
+    journal = Journal(path)
+    journal.append({"n": 1})
+    assert store.create_projector(journal).project_pending() == 1
+    journal.append({"n": 2})
+    journal.close()
+
+    # Simulate a restart.
+    journal = Journal(path)
+    projector = store.create_projector(journal)
+    assert projector.project_pending() == 1
+    assert store.projected == [{"n": 1}, {"n": 2}]
+    assert projector.project_pending() == 0
+
+def test_projector_resets_journal_once_caught_up(tmp_path):
+    store = FakeStore()
+    journal = Journal(str(tmp_path / "test.journal"))
+    projector = store.create_projector(journal, batch_size=2, reset_after_bytes=1)
+    for n in range(5):
+        journal.append({"n": n})
+    assert projector.project_pending() == 5
+    assert journal.size == 0
+    assert store.offset == 0
+    journal.append({"n": 5})
+    assert projector.project_pending() == 1
+    assert store.projected == [{"n": n} for n in range(6)]
+
+def test_projector_skips_entries_which_keep_failing(tmp_path):
+    store = FakeStore()
+    def project(entries: list) -> None:
+        if any(entry.data["n"] == 1 for entry in entries):
+            raise ValueError("bad entry")
+        FakeStore.project(store, entries)
+    journal = Journal(str(tmp_path / "test.journal"))
+    projector = JournalProjector(journal, load_offset=lambda: store.offset, project=project, reset_offset=store.reset_offset, max_attempts=2)
+    for n in range(3):
+        journal.append({"n": n})
+    with pytest.raises(ValueError):
+        projector.project_pending()
+    assert store.projected == []
+    assert projector.project_pending() == 2
+    assert store.projected == [{"n": 0}, {"n": 2}]
+    journal.append({"n": 3})
+    assert projector.project_pending() == 1
+    assert store.projected == [{"n": 0}, {"n": 2}, {"n": 3}]
+
+def test_projector_skips_corrupt_entries(tmp_path):
+    path = str(tmp_path / "test.journal")
+    store = FakeStore()
+    journal = Journal(path)
+    journal.append({"n": 0})
+    journal.close()
+    with open(path, "ab") as file:
+        file.write(b"not json\n")
+    journal = Journal(path)
+    journal.append({"n": 1})
+    entries = journal.read_entries(0, max_count=10)
+    assert [entry.data for entry in entries] == [{"n": 0}]
+    with pytest.raises(CorruptJournalEntryError):
+        journal.read_entries(entries[0].end_offset, max_count=10)
+
+    projector = store.create_projector(journal)
+    assert projector.project_pending() == 2
+    assert store.projected == [{"n": 0}, {"n": 1}]
+    assert store.offset == journal.size
+
+def test_projector_thread_projects_entries_before_stopping(tmp_path):
+    store = FakeStore()
+    journal = Journal(str(tmp_path / "test.journal"))
+    projector = store.create_projector(journal)
+    projector.start()
+    for n in range(10):
+        journal.append({"n": n})
+    projector.stop()
+    assert store.projected == [{"n": n} for n in range(10)]
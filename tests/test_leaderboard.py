@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+import random
+from first.errors import RowNotFoundError
+from first.leaderboard import Leaderboard, PointsLeaderboards, month_of
+from first.pointsdb import PointsDb, Redemption
+
+def test_leaderboard_ranks_highest_score_first():
+    leaderboard = Leaderboard()
+    leaderboard.add_points("a", 1)
+    leaderboard.add_points("b", 5)
+    leaderboard.add_points("c", 3)
+    assert leaderboard.get_top() == [("b", 5), ("c", 3), ("a", 1)]
+    assert leaderboard.get_top(2) == [("b", 5), ("c", 3)]
+    assert leaderboard.get_slice(1, 3) == [("c", 3), ("a", 1)]
+
+def test_leaderboard_reranks_after_adding_points():
+    leaderboard = Leaderboard()
+    leaderboard.add_points("a", 1)
+    leaderboard.add_points("b", 5)
+    leaderboard.add_points("a", 10)
+    assert leaderboard.get_top() == [("a", 11), ("b", 5)]
+    assert leaderboard.get_score("a") == 11
+    assert leaderboard.get_score("missing") is None
+    assert len(leaderboard) == 2
+
+def test_leaderboard_breaks_ties_by_id():
+    leaderboard = Leaderboard()
+    leaderboard.add_points("c", 2)
+    leaderboard.add_points("a", 2)
+    leaderboard.add_points("b", 2)
+    assert leaderboard.get_top() == [("a", 2), ("b", 2), ("c", 2)]
+
+def test_month_of_converts_to_utc():
+    assert month_of(datetime(2023, 7, 31, 23, 0, 0)) == "2023-07"
+    assert month_of(datetime(2023, 7, 31, 23, 0, 0, tzinfo=timezone(timedelta(hours=-5)))) == "2023-08"
+
+def insert_redemption(points_db: PointsDb, broadcaster_id: str, redemption_id: str, user_id: str, redeemed_at: datetime, level: int) -> None:
+    points_db.insert_new_redemption(
+        broadcaster_id=broadcaster_id,
+        redemption_id=redemption_id,
+        user_id=user_id,
+        redeemed_at=redeemed_at,
+        points={1: 5, 2: 3, 3: 1}[level],
+        level=level,
+    )
+
+def test_points_leaderboards_load_existing_redemptions():
+    now = datetime.now(timezone.utc)
+    points_db = PointsDb(":memory:")
+    insert_redemption(points_db, "streamer_1", "r1", "user_1", now, level=1)
+    insert_redemption(points_db, "streamer_1", "r2", "user_2", now, level=2)
+    insert_redemption(points_db, "streamer_1", "r3", "user_2", now - timedelta(days=62), level=1)
+    insert_redemption(points_db, "streamer_2", "r4", "user_1", now - timedelta(days=62), level=1)
+
+    leaderboards = PointsLeaderboards(points_db)
+    assert leaderboards.get_lifetime_channel_points("streamer_1") == [("user_2", 8), ("user_1", 5)]
+    assert leaderboards.get_monthly_channel_points("streamer_1") == [("user_1", 5), ("user_2", 3)]
+    assert leaderboards.get_monthly_channel_points("streamer_2") == []
+    assert leaderboards.get_streamers_lifetime_leaderboard() == [("streamer_1", 2), ("streamer_2", 1)]
+    assert leaderboards.get_streamers_monthly_leaderboard() == [("streamer_1", 1)]
+
+def test_points_leaderboards_update_on_new_redemptions():
+    now = datetime.now(timezone.utc)
+    points_db = PointsDb(":memory:")
+    leaderboards = PointsLeaderboards(points_db)
+    assert leaderboards.get_lifetime_channel_points("streamer_1") == []
+
+    insert_redemption(points_db, "streamer_1", "r1", "user_1", now, level=3)
+    insert_redemption(points_db, "streamer_1", "r2", "user_2", now, level=1)
+    insert_redemption(points_db, "streamer_2", "r3", "user_1", now - timedelta(days=62), level=1)
+    assert leaderboards.get_lifetime_channel_points("streamer_1") == [("user_2", 5), ("user_1", 1)]
+    assert leaderboards.get_monthly_channel_points("streamer_1", limit=1) == [("user_2", 5)]
+    assert leaderboards.get_lifetime_channel_points("streamer_2") == [("user_1", 5)]
+    assert leaderboards.get_monthly_channel_points("streamer_2") == []
+    assert leaderboards.get_streamers_lifetime_leaderboard() == [("streamer_1", 1), ("streamer_2", 1)]
+    assert leaderboards.get_streamers_monthly_leaderboard() == [("streamer_1", 1)]
+
+def test_points_leaderboards_agree_with_points_db():
+    now = datetime.now(timezone.utc)
+    points_db = PointsDb(":memory:")
+    leaderboards = PointsLeaderboards(points_db)
+    for i in range(30):
+        insert_redemption(points_db, "streamer_1", f"r{i}", f"user_{i % 7}", now - timedelta(days=i * 5), level=i % 3 + 1)
+    assert leaderboards.get_lifetime_channel_points("streamer_1") == points_db.get_lifetime_channel_points("streamer_1")
+    assert leaderboards.get_monthly_channel_points("streamer_1") == points_db.get_monthly_channel_points("streamer_1")
+
+def test_points_leaderboards_reload_after_import():
+    now = datetime.now(timezone.utc)
+    points_db = PointsDb(":memory:")
+    insert_redemption(points_db, "streamer_1", "r1", "user_1", now, level=3)
+    leaderboards = PointsLeaderboards(points_db)
+
+    points_db.import_redemptions([
+        # Already in the database.
+        Redemption(broadcaster_id="streamer_1", redemption_id="r1", user_id="user_1", redeemed_at=now, points=1, level=3),
+        Redemption(broadcaster_id="streamer_1", redemption_id="r2", user_id="user_2", redeemed_at=now, points=5, level=1),
+        Redemption(broadcaster_id="streamer_2", redemption_id="r3", user_id="user_1", redeemed_at=now - timedelta(days=62), points=5, level=1),
+    ], batch_size=2)
+    assert leaderboards.get_lifetime_channel_points("streamer_1") == [("user_2", 5), ("user_1", 1)]
+    assert leaderboards.get_monthly_channel_points("streamer_2") == []
+    assert leaderboards.get_streamers_lifetime_leaderboard() == [("streamer_1", 1), ("streamer_2", 1)]
+    assert leaderboards.get_streamers_monthly_leaderboard() == [("streamer_1", 1)]
+
+    # Redemptions after the import are counted once.
+    insert_redemption(points_db, "streamer_1", "r4", "user_1", now, level=2)
+    assert leaderboards.get_lifetime_channel_points("streamer_1") == points_db.get_lifetime_channel_points("streamer_1")
+    assert leaderboards.get_user_rank("streamer_1", "user_2", scope="monthly") == 1
+
+def test_leaderboard_get_rank():
+    leaderboard = Leaderboard()
+    leaderboard.add_points("a", 1)
+    leaderboard.add_points("b", 5)
+    leaderboard.add_points("c", 5)
+    assert leaderboard.get_rank("b") == 1
+    assert leaderboard.get_rank("c") == 2
+    assert leaderboard.get_rank("a") == 3
+    assert leaderboard.get_rank("missing") is None
+
+def test_points_leaderboards_pagination_and_rank():
+    now = datetime.now(timezone.utc)
+    points_db = PointsDb(":memory:")
+    leaderboards = PointsLeaderboards(points_db)
+    for i in range(5):
+        insert_redemption(points_db, "streamer_1", f"r{i}", f"user_{i}", now, level=1 if i == 3 else 2)
+    assert leaderboards.get_lifetime_channel_points("streamer_1", limit=2) == [("user_3", 5), ("user_0", 3)]
+    assert leaderboards.get_lifetime_channel_points("streamer_1", limit=2, offset=2) == [("user_1", 3), ("user_2", 3)]
+    assert leaderboards.get_monthly_channel_points("streamer_1", offset=4) == [("user_4", 3)]
+    assert leaderboards.get_user_rank("streamer_1", "user_3", scope="lifetime") == 1
+    assert leaderboards.get_user_rank("streamer_1", "user_2", scope="monthly") == 4
+    assert leaderboards.get_user_rank("streamer_1", "user_2", scope="monthly") == points_db.get_user_rank("streamer_1", "user_2", scope="monthly")
+    with pytest.raises(RowNotFoundError):
+        leaderboards.get_user_rank("streamer_1", "nobody", scope="lifetime")
+
+def test_leaderboard_with_many_blocks_agrees_with_sorting(monkeypatch):
+    monkeypatch.setattr(Leaderboard, "_block_size", 2)
+    rng = random.Random(42)
+    leaderboard = Leaderboard()
+    scores = {}
+    for _ in range(500):
+        id = f"user_{rng.randrange(60)}"
+        points = rng.choice([1, 3, 5])
+        leaderboard.add_points(id, points)
+        scores[id] = scores.get(id, 0) + points
+    expected = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    assert leaderboard.get_top() == expected
+    assert leaderboard.get_slice(7, 19) == expected[7:19]
+    assert leaderboard.get_slice(55, 100) == expected[55:]
+    for (rank, (id, score)) in enumerate(expected, start=1):
+        assert leaderboard.get_rank(id) == rank
@@ -0,0 +1,17 @@
+from datetime import datetime, timezone
+from first.maintenance import MaintenanceScheduler, seconds_until_hour
+from first.pointsdb import PointsDb
+
+def test_seconds_until_hour():
+    assert seconds_until_hour(datetime(2023, 7, 13, 8, 30, tzinfo=timezone.utc), 9) == 30 * 60
+    assert seconds_until_hour(datetime(2023, 7, 13, 9, 0, tzinfo=timezone.utc), 9) == 0
+    assert seconds_until_hour(datetime(2023, 7, 13, 9, 0, 1, tzinfo=timezone.utc), 9) == 24 * 60 * 60 - 1
+    assert seconds_until_hour(datetime(2023, 12, 31, 23, 0, tzinfo=timezone.utc), 0) == 60 * 60
+
+def test_run_all_maintains_every_database(tmp_path):
+    scheduler = MaintenanceScheduler({
+        "points": PointsDb(str(tmp_path / "points.db")),
+        "memory": PointsDb(":memory:"),
+    })
+    results = scheduler.run_all()
+    assert set(results) == {"points", "memory"}
@@ -0,0 +1,61 @@
+import threading
+from first.metrics import QueryMetrics, RollingHistogram
+
+def test_rolling_histogram_summary():
+    histogram = RollingHistogram(window_seconds=60, window_count=10)
+    for _ in range(99):
+        histogram.record(0.001, now=0)
+    histogram.record(0.5, now=0)
+    summary = histogram.summarize(now=0)
+    assert summary.sample_count == 100
+    assert summary.max_seconds == 0.5
+    # Buckets are powers of two microseconds.
+    assert 0.001 <= summary.p50_seconds < 0.002
+    assert 0.001 <= summary.p99_seconds < 0.002
+    assert abs(summary.mean_seconds - (99 * 0.001 + 0.5) / 100) < 1e-9
+
+def test_rolling_histogram_forgets_old_samples():
+    histogram = RollingHistogram(window_seconds=60, window_count=2)
+    histogram.record(0.5, now=0)
+    histogram.record(0.001, now=60)
+    assert histogram.summarize(now=60).sample_count == 2
+    histogram.record(0.001, now=120)
+    summary = histogram.summarize(now=120)
+    assert summary.sample_count == 2
+    assert summary.max_seconds == 0.001
+    assert histogram.summarize(now=1000).sample_count == 0
+
+def test_query_metrics_groups_by_query_and_phase():
+    metrics = QueryMetrics()
+    metrics.record("A.get", "execute", 0.001)
+    metrics.record("A.get", "execute", 0.003)
+    metrics.record("A.get", "fetch", 0.001)
+    metrics.record("B.put", "commit", 0.010)
+    rows = {(row.query_name, row.phase): row.summary.sample_count for row in metrics.get_summaries()}
+    assert rows == {("A.get", "execute"): 2, ("A.get", "fetch"): 1, ("B.put", "commit"): 1}
+    assert metrics.get_summaries()[0].query_name == "B.put", "slowest total time should be first"
+
+def test_query_metrics_merges_threads():
+    metrics = QueryMetrics()
+    metrics.record("A.get", "execute", 0.001)
+    thread = threading.Thread(target=lambda: metrics.record("A.get", "execute", 0.003))
+    thread.start()
+    thread.join()
+    (row,) = metrics.get_summaries()
+    assert row.summary.sample_count == 2
+    assert row.summary.max_seconds == 0.003
+    # The exited thread's samples are kept.
+    metrics.record("A.get", "execute", 0.001)
+    (row,) = metrics.get_summaries()
+    assert row.summary.sample_count == 3
+
+def test_rolling_histograms_can_be_merged():
+    histogram = RollingHistogram(window_seconds=60, window_count=2)
+    histogram.record(0.001, now=30)
+    other = RollingHistogram(window_seconds=60, window_count=2)
+    other.record(0.5, now=0)
+    other.record(0.002, now=70)
+    histogram.merge(other)
+    summary = histogram.summarize(now=70)
+    assert summary.sample_count == 3
+    assert summary.max_seconds == 0.5
@@ -1,7 +1,13 @@
+import contextlib
+import io
 import pytest
+import sqlite3
 import threading
-from datetime import datetime, timedelta
-from first.pointsdb import PointsDb
+from datetime import date, datetime, timedelta
+import first.pointsdb
+from first.pointsdb import PointsDb, read_redemptions, write_redemptions
+from first.errors import RowNotFoundError
+from first.usersdb import TwitchUsersDb
 from first.config import cfg
 
 points_config = cfg["pointsdb"]
@@ -76,8 +82,466 @@ def test_get_lifetime_user_points():
 
 def test_get_streamers_monthly_leaderboard():
     pointsdb = insert_data()
-    assert [("streamer_2", 1), ("streamer_1", 1)] == pointsdb.get_streamers_monthly_leaderboard()
+    # Ties are ordered by broadcaster ID.
+    assert [("streamer_1", 1), ("streamer_2", 1)] == pointsdb.get_streamers_monthly_leaderboard()
 
 def test_get_streamers_lifetime_leaderboard():
     pointsdb = insert_data()
     assert [("streamer_2", 2), ("streamer_1", 1)] == pointsdb.get_streamers_lifetime_leaderboard()
+
+def test_paginate_lifetime_redemptions():
+    pointsdb = insert_data()
+    first_page = pointsdb.get_lifetime_channel_points("streamer_1", limit=1)
+    assert [("user_1", 8)] == first_page
+    second_page = pointsdb.get_lifetime_channel_points("streamer_1", limit=1, after=first_page[-1])
+    assert [("user_2", 1)] == second_page
+    assert [] == pointsdb.get_lifetime_channel_points("streamer_1", limit=1, after=second_page[-1])
+
+def test_paginate_monthly_redemptions_with_ties():
+    pointsdb = insert_data()
+    for (i, user_id) in enumerate(["user_c", "user_a", "user_b"]):
+        pointsdb.insert_new_redemption(
+                broadcaster_id = "streamer_3",
+                redemption_id = f"tie-{i}",
+                user_id = user_id,
+                redeemed_at = datetime.fromisoformat(get_current_year_month()+"01T18:37:32Z"),
+                points = 3,
+                level = 2,
+        )
+    first_page = pointsdb.get_monthly_channel_points("streamer_3", limit=2)
+    assert [("user_a", 3), ("user_b", 3)] == first_page
+    assert [("user_c", 3)] == pointsdb.get_monthly_channel_points("streamer_3", limit=2, after=first_page[-1])
+
+def test_paginate_streamers_lifetime_leaderboard():
+    pointsdb = insert_data()
+    first_page = pointsdb.get_streamers_lifetime_leaderboard(limit=1)
+    assert [("streamer_2", 2)] == first_page
+    assert [("streamer_1", 1)] == pointsdb.get_streamers_lifetime_leaderboard(after=first_page[-1])
+
+def test_get_user_rank():
+    pointsdb = insert_data()
+    assert 1 == pointsdb.get_user_rank("streamer_1", "user_1", scope="lifetime")
+    assert 2 == pointsdb.get_user_rank("streamer_1", "user_2", scope="lifetime")
+    assert 1 == pointsdb.get_user_rank("streamer_1", "user_1", scope="monthly")
+    assert 2 == pointsdb.get_user_rank("streamer_1", "user_2", scope="monthly")
+    with pytest.raises(RowNotFoundError):
+        pointsdb.get_user_rank("streamer_2", "user_2", scope="lifetime")
+
+def test_channel_points_are_backfilled_for_existing_database(tmp_path):
+    db_path = str(tmp_path / "points.db")
+    old_db = sqlite3.connect(db_path)
+    old_db.execute("CREATE TABLE redemptions(broadcaster_id, redemption_id UNIQUE, user_id, redeemed_at, points, level)")
+    old_db.executemany(
+        "INSERT INTO redemptions VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            ("streamer_1", "r1", "user_1", datetime.fromisoformat(get_current_year_month()+"01T18:37:32Z"), 5, 1),
+            ("streamer_1", "r2", "user_2", datetime.fromisoformat(get_current_year_month()+"02T18:37:32Z"), 3, 2),
+            ("streamer_1", "r3", "user_2", datetime.fromisoformat(get_current_year_month()+"03T18:37:32Z")-timedelta(days=60), 3, 2),
+        ],
+    )
+    old_db.commit()
+    old_db.close()
+
+    pointsdb = PointsDb(db_path)
+    assert [("user_2", 6), ("user_1", 5)] == pointsdb.get_lifetime_channel_points("streamer_1")
+    assert [("user_1", 5), ("user_2", 3)] == pointsdb.get_monthly_channel_points("streamer_1")
+
+    # Reopening the database should not backfill again.
+    pointsdb = PointsDb(db_path)
+    assert [("user_2", 6), ("user_1", 5)] == pointsdb.get_lifetime_channel_points("streamer_1")
+
+def test_get_channel_points_between():
+    pointsdb = PointsDb(":memory:")
+    for (redemption_id, user_id, redeemed_at, points) in [
+        ("r1", "user_1", "2023-07-01T00:00:00+00:00", 5),
+        ("r2", "user_2", "2023-07-01T23:59:59+00:00", 3),
+        ("r3", "user_2", "2023-07-02T12:00:00+00:00", 3),
+        ("r4", "user_1", "2023-07-03T00:00:00+00:00", 1),
+        # 2023-07-02 in UTC.
+        ("r5", "user_3", "2023-07-01T22:00:00-05:00", 1),
+    ]:
+        pointsdb.insert_new_redemption(broadcaster_id="streamer_1", redemption_id=redemption_id, user_id=user_id, redeemed_at=datetime.fromisoformat(redeemed_at), points=points, level=2)
+
+    assert [("user_2", 6), ("user_1", 5), ("user_3", 1)] == pointsdb.get_channel_points_between("streamer_1", date(2023, 7, 1), date(2023, 7, 3))
+    assert [("user_2", 3), ("user_3", 1)] == pointsdb.get_channel_points_between("streamer_1", date(2023, 7, 2), date(2023, 7, 3))
+    assert [("user_2", 6)] == pointsdb.get_channel_points_between("streamer_1", date(2023, 7, 1), date(2023, 7, 3), limit=1)
+    assert [("user_1", 5)] == pointsdb.get_channel_points_between("streamer_1", date(2023, 7, 1), date(2023, 7, 3), limit=1, after=("user_2", 6))
+    assert [("user_1", 5)] == pointsdb.get_channel_points_between("streamer_1", date(2023, 7, 1), date(2023, 7, 3), limit=1, offset=1)
+    assert [] == pointsdb.get_channel_points_between("streamer_1", date(2023, 7, 4), date(2023, 8, 1))
+    assert [] == pointsdb.get_channel_points_between("streamer_2", date(2023, 7, 1), date(2023, 8, 1))
+
+def test_daily_channel_points_are_backfilled_for_existing_database(tmp_path):
+    db_path = str(tmp_path / "points.db")
+    old_db = sqlite3.connect(db_path)
+    old_db.execute("CREATE TABLE redemptions(broadcaster_id, redemption_id UNIQUE, user_id, redeemed_at, points, level)")
+    old_db.executemany(
+        "INSERT INTO redemptions VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            ("streamer_1", "r1", "user_1", datetime(2023, 7, 1, 18, 37, 32), 5, 1),
+            ("streamer_1", "r2", "user_2", datetime(2023, 7, 2, 18, 37, 32), 3, 2),
+        ],
+    )
+    old_db.commit()
+    old_db.close()
+
+    pointsdb = PointsDb(db_path)
+    assert [("user_1", 5)] == pointsdb.get_channel_points_between("streamer_1", date(2023, 7, 1), date(2023, 7, 2))
+    assert [("user_1", 5), ("user_2", 3)] == pointsdb.get_channel_points_between("streamer_1", date(2023, 7, 1), date(2023, 7, 3))
+
+def test_channel_points_backfill_of_existing_database_is_deferred_and_resumable(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "points.db")
+    old_db = sqlite3.connect(db_path)
+    old_db.execute("CREATE TABLE redemptions(broadcaster_id, redemption_id UNIQUE, user_id, redeemed_at, points, level)")
+    old_db.executemany(
+        "INSERT INTO redemptions VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            ("streamer_1", f"r{i}", f"user_{i % 2}", datetime.fromisoformat(get_current_year_month()+"01T18:37:32Z")-timedelta(days=60 * (i % 3)), 5, 1)
+            for i in range(6)
+        ],
+    )
+    old_db.commit()
+    old_db.close()
+
+    pointsdb = PointsDb(db_path)
+    assert 0 == pointsdb.db.execute("SELECT COUNT(*) FROM channel_points").fetchone()[0]
+    # Queries should work before the backfill.
+    assert [("user_0", 15), ("user_1", 15)] == pointsdb.get_lifetime_channel_points("streamer_1")
+    assert [("user_0", 5), ("user_1", 5)] == pointsdb.get_monthly_channel_points("streamer_1")
+
+    # Interrupt the channel_points backfill after the first chunk.
+    class Interrupted(Exception):
+        pass
+    def interrupt(_seconds: float) -> None:
+        if pointsdb.db.execute("SELECT 1 FROM migration_progress WHERE name = 'v12'").fetchone() is not None:
+            raise Interrupted()
+    monkeypatch.setattr(first.pointsdb.time, "sleep", interrupt)
+    with pytest.raises(Interrupted):
+        pointsdb.run_online_migrations(chunk_size=2, pause_seconds=0)
+    monkeypatch.undo()
+    # Redemptions inserted during the backfill should be counted once.
+    pointsdb.insert_new_redemption(broadcaster_id="streamer_1", redemption_id="r_new", user_id="user_1", redeemed_at=datetime.fromisoformat(get_current_year_month()+"01T19:00:00Z"), points=7, level=1)
+
+    # Resume the backfill.
+    pointsdb = PointsDb(db_path)
+    assert [("user_1", 22), ("user_0", 15)] == pointsdb.get_lifetime_channel_points("streamer_1")
+    pointsdb.run_online_migrations(chunk_size=2, pause_seconds=0)
+    assert [("user_1", 22), ("user_0", 15)] == pointsdb.get_lifetime_channel_points("streamer_1")
+    assert [("user_1", 12), ("user_0", 5)] == pointsdb.get_monthly_channel_points("streamer_1")
+    expected_daily_points = pointsdb.db.execute(
+        "SELECT broadcaster_id, user_id, strftime('%Y-%m-%d', redeemed_at), SUM(points) FROM redemptions GROUP BY 1, 2, 3 ORDER BY 1, 2, 3"
+    ).fetchall()
+    assert expected_daily_points == pointsdb.db.execute("SELECT broadcaster_id, user_id, day, points FROM channel_points_daily ORDER BY 1, 2, 3").fetchall()
+
+    # Reopening the database should not backfill again.
+    pointsdb = PointsDb(db_path)
+    assert pointsdb._is_migration_applied(pointsdb._channel_points_daily_backfill_version)
+    assert [("user_1", 22), ("user_0", 15)] == pointsdb.get_lifetime_channel_points("streamer_1")
+
+def test_redemptions_are_tagged_with_stream_session():
+    pointsdb = PointsDb(":memory:")
+    def insert(redemption_id: str, user_id: str, redeemed_at: str, points: int) -> None:
+        pointsdb.insert_new_redemption(broadcaster_id="streamer_1", redemption_id=redemption_id, user_id=user_id, redeemed_at=datetime.fromisoformat(redeemed_at), points=points, level=1)
+
+    with pytest.raises(RowNotFoundError):
+        pointsdb.get_latest_stream_session("streamer_1")
+    insert("r0", "user_1", "2023-07-01T11:00:00+00:00", 5)
+    pointsdb.start_stream_session(broadcaster_id="streamer_1", stream_id="stream_a", started_at=datetime.fromisoformat("2023-07-01T12:00:00+00:00"))
+    insert("r1", "user_1", "2023-07-01T12:00:01+00:00", 5)
+    insert("r2", "user_2", "2023-07-01T12:00:02+00:00", 3)
+    insert("r3", "user_2", "2023-07-01T12:30:00+00:00", 3)
+    session_a = pointsdb.get_latest_stream_session("streamer_1")
+    assert session_a.stream_id == "stream_a"
+    assert session_a.ended_at is None
+    assert [("user_2", 6), ("user_1", 5)] == pointsdb.get_stream_session_channel_points(session_a.session_id)
+    assert [("user_1", 5)] == pointsdb.get_stream_session_channel_points(session_a.session_id, limit=1, after=("user_2", 6))
+    assert [("user_1", 5)] == pointsdb.get_stream_session_channel_points(session_a.session_id, limit=1, offset=1)
+
+    pointsdb.end_stream_session(broadcaster_id="streamer_1", ended_at=datetime.fromisoformat("2023-07-01T13:00:00+00:00"))
+    insert("r4", "user_3", "2023-07-01T14:00:00+00:00", 1)
+    session_a = pointsdb.get_latest_stream_session("streamer_1")
+    assert session_a.ended_at == datetime.fromisoformat("2023-07-01T13:00:00+00:00")
+    assert [("user_2", 6), ("user_1", 5)] == pointsdb.get_stream_session_channel_points(session_a.session_id)
+
+    # stream.online arrives after the stream's first redemption.
+    insert("r5", "user_3", "2023-07-02T12:00:05+00:00", 5)
+    pointsdb.start_stream_session(broadcaster_id="streamer_1", stream_id="stream_b", started_at=datetime.fromisoformat("2023-07-02T12:00:00+00:00"))
+    insert("r6", "user_3", "2023-07-02T12:00:10+00:00", 3)
+    # Duplicate stream.online.
+    pointsdb.start_stream_session(broadcaster_id="streamer_1", stream_id="stream_b", started_at=datetime.fromisoformat("2023-07-02T12:00:00+00:00"))
+    session_b = pointsdb.get_latest_stream_session("streamer_1")
+    assert session_b.stream_id == "stream_b"
+    assert session_b.session_id != session_a.session_id
+    assert [("user_3", 8)] == pointsdb.get_stream_session_channel_points(session_b.session_id)
+
+    # stream.offline is missed.
+    pointsdb.start_stream_session(broadcaster_id="streamer_1", stream_id="stream_c", started_at=datetime.fromisoformat("2023-07-03T12:00:00+00:00"))
+    session_b = pointsdb.get_latest_stream_session("streamer_1")
+    assert session_b.stream_id == "stream_c"
+
+def test_stream_session_column_is_added_to_existing_database(tmp_path):
+    db_path = str(tmp_path / "points.db")
+    old_db = sqlite3.connect(db_path)
+    old_db.execute("CREATE TABLE redemptions(broadcaster_id, redemption_id UNIQUE, user_id, redeemed_at, points, level)")
+    old_db.execute("INSERT INTO redemptions VALUES ('streamer_1', 'r1', 'user_1', '2023-07-01 12:00:00', 5, 1)")
+    old_db.commit()
+    old_db.close()
+
+    pointsdb = PointsDb(db_path)
+    pointsdb.start_stream_session(broadcaster_id="streamer_1", stream_id="stream_a", started_at=datetime.fromisoformat("2023-07-02T12:00:00+00:00"))
+    pointsdb.insert_new_redemption(broadcaster_id="streamer_1", redemption_id="r2", user_id="user_2", redeemed_at=datetime.fromisoformat("2023-07-02T12:01:00+00:00"), points=5, level=1)
+    session = pointsdb.get_latest_stream_session("streamer_1")
+    assert [("user_2", 5)] == pointsdb.get_stream_session_channel_points(session.session_id)
+
+def test_add_display_names_joins_attached_users_db(tmp_path):
+    users_db_path = str(tmp_path / "users.db")
+    users_db = TwitchUsersDb(users_db_path)
+    users_db.insert_or_update_user(user_id="user_1", user_login="one", user_name="One")
+    users_db.insert_or_update_user(user_id="user_2", user_login="two")
+    pointsdb = PointsDb(str(tmp_path / "points.db"), users_db=users_db_path)
+    assert [("user_3", None, 7), ("user_1", "One", 5), ("user_2", None, 3)] == pointsdb.add_display_names([("user_3", 7), ("user_1", 5), ("user_2", 3)])
+    assert [] == pointsdb.add_display_names([])
+
+    # Names added later are visible.
+    users_db.insert_or_update_user(user_id="user_3", user_name="Three")
+    assert [("user_3", "Three", 7)] == pointsdb.add_display_names([("user_3", 7)])
+
+def test_add_display_names_without_users_db():
+    pointsdb = PointsDb(":memory:")
+    assert [("user_1", None, 5)] == pointsdb.add_display_names([("user_1", 5)])
+
+def test_group_commit_inserts_redemptions():
+    pointsdb = PointsDb(":memory:")
+    pointsdb.start_group_commit(max_batch_size=10, max_delay_seconds=0.01)
+    try:
+        futures = [
+            pointsdb.insert_new_redemption_async(
+                broadcaster_id = "streamer_1",
+                redemption_id = f"redemption_{i}",
+                user_id = f"user_{i % 3}",
+                redeemed_at = datetime.fromisoformat(get_current_year_month()+"01T18:37:32Z"),
+                points = 1,
+                level = 3,
+            )
+            for i in range(25)
+        ]
+        for future in futures:
+            assert future.result(timeout=5) is None
+        assert [("user_0", 9), ("user_1", 8), ("user_2", 8)] == pointsdb.get_lifetime_channel_points("streamer_1")
+    finally:
+        pointsdb.stop_group_commit()
+
+def test_group_commit_reports_duplicate_redemption_without_failing_batch():
+    pointsdb = PointsDb(":memory:")
+    pointsdb.start_group_commit(max_batch_size=10, max_delay_seconds=1)
+    try:
+        def insert(redemption_id: str, user_id: str):
+            return pointsdb.insert_new_redemption_async(
+                broadcaster_id = "streamer_1",
+                redemption_id = redemption_id,
+                user_id = user_id,
+                redeemed_at = datetime.fromisoformat(get_current_year_month()+"01T18:37:32Z"),
+                points = 5,
+                level = 1,
+            )
+        first_future = insert("same_id", "user_1")
+        duplicate_future = insert("same_id", "user_2")
+        other_future = insert("other_id", "user_3")
+    finally:
+        # Stopping should commit the pending batch.
+        pointsdb.stop_group_commit()
+    assert first_future.result(timeout=0) is None
+    assert other_future.result(timeout=0) is None
+    with pytest.raises(sqlite3.IntegrityError):
+        duplicate_future.result(timeout=0)
+    assert [("user_1", 5), ("user_3", 5)] == pointsdb.get_lifetime_channel_points("streamer_1")
+
+def test_group_commit_resolves_futures_when_a_listener_fails():
+    pointsdb = PointsDb(":memory:")
+    def failing_listener(redemption) -> None:
+        raise ValueError("listener bug")
+    pointsdb.subscribe_to_redemptions(failing_listener)
+    pointsdb.start_group_commit(max_batch_size=10, max_delay_seconds=0.01)
+    try:
+        futures = [
+            pointsdb.insert_new_redemption_async(
+                broadcaster_id = "streamer_1",
+                redemption_id = f"redemption_{i}",
+                user_id = "user_1",
+                redeemed_at = datetime.fromisoformat(get_current_year_month()+"01T18:37:32Z"),
+                points = 1,
+                level = 3,
+            )
+            for i in range(3)
+        ]
+        for future in futures:
+            assert future.result(timeout=5) is None
+        # The writer thread survives.
+        pointsdb.insert_new_redemption(
+                broadcaster_id = "streamer_1",
+                redemption_id = "redemption_3",
+                user_id = "user_1",
+                redeemed_at = datetime.fromisoformat(get_current_year_month()+"01T18:37:32Z"),
+                points = 1,
+                level = 3,
+        )
+        assert [("user_1", 4)] == pointsdb.get_lifetime_channel_points("streamer_1")
+    finally:
+        pointsdb.stop_group_commit()
+
+def test_insert_new_redemption_waits_for_group_commit():
+    pointsdb = PointsDb(":memory:")
+    pointsdb.start_group_commit()
+    try:
+        pointsdb.insert_new_redemption(
+                broadcaster_id = "streamer_1",
+                redemption_id = "92af127c-7326-4483-a52b-b0da0be61c01",
+                user_id = "user_1",
+                redeemed_at = datetime.fromisoformat(get_current_year_month()+"01T18:37:32Z"),
+                points = 5,
+                level = 1,
+        )
+        assert [("user_1", 5)] == pointsdb.get_lifetime_channel_points("streamer_1")
+    finally:
+        pointsdb.stop_group_commit()
+
+def test_redemption_timestamps_are_migrated_in_chunks(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "points.db")
+    old_db = sqlite3.connect(db_path)
+    old_db.execute("CREATE TABLE redemptions(broadcaster_id, redemption_id UNIQUE, user_id, redeemed_at, points, level)")
+    old_db.executemany(
+        "INSERT INTO redemptions VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            ("streamer_1", f"r{i}", "user_1", datetime.fromisoformat(get_current_year_month()+"01T18:37:32Z")-timedelta(days=60 * (i % 2)), 5, 1)
+            for i in range(5)
+        ],
+    )
+    old_db.commit()
+    old_db.close()
+
+    pointsdb = PointsDb(db_path)
+    # Queries should work before the migration.
+    assert 15 == pointsdb.get_monthly_user_points("user_1")
+    assert [("streamer_1", 3)] == pointsdb.get_streamers_monthly_leaderboard()
+
+    # Interrupt the migration after the first chunk.
+    class Interrupted(Exception):
+        pass
+    def interrupt(_seconds: float) -> None:
+        raise Interrupted()
+    monkeypatch.setattr(first.pointsdb.time, "sleep", interrupt)
+    with pytest.raises(Interrupted):
+        pointsdb.run_online_migrations(chunk_size=2, pause_seconds=0)
+    monkeypatch.undo()
+    assert 2 == pointsdb.db.execute("SELECT COUNT(*) FROM redemptions WHERE month IS NOT NULL").fetchone()[0]
+
+    # Resume the migration.
+    pointsdb = PointsDb(db_path)
+    assert not pointsdb._redemption_timestamps_migrated
+    pointsdb.run_online_migrations(chunk_size=2, pause_seconds=0)
+    rows = pointsdb.db.execute("SELECT redeemed_at, redeemed_at_epoch, month FROM redemptions").fetchall()
+    for (redeemed_at, redeemed_at_epoch, month) in rows:
+        timestamp = datetime.fromisoformat(redeemed_at)
+        assert redeemed_at_epoch == int(timestamp.timestamp())
+        assert month == f"{timestamp.year}-{timestamp.month:02d}"
+    indexes = {name for (name,) in pointsdb.db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert "redemptions_by_broadcaster_month" in indexes
+    assert "redemptions_by_user_month" in indexes
+    assert "redemptions_by_month_level" in indexes
+
+    assert 15 == pointsdb.get_monthly_user_points("user_1")
+    assert [("streamer_1", 3)] == pointsdb.get_streamers_monthly_leaderboard()
+
+    # Reopening the database should not need another migration.
+    pointsdb = PointsDb(db_path)
+    assert pointsdb._redemption_timestamps_migrated
+
+def test_streamers_monthly_leaderboard_searches_one_month(monkeypatch):
+    pointsdb = insert_data()
+    query_plans = []
+    read_connection = pointsdb._read_connection
+    class ExplainingCursor:
+        def __init__(self, cur):
+            self.cur = cur
+        def execute(self, sql, *args):
+            query_plans.append([detail for (_id, _parent, _unused, detail) in self.cur.execute(f"EXPLAIN QUERY PLAN {sql}", *args).fetchall()])
+            return self.cur.execute(sql, *args)
+    class ExplainingConnection:
+        def __init__(self, db):
+            self.db = db
+        def cursor(self):
+            return ExplainingCursor(self.db.cursor())
+    @contextlib.contextmanager
+    def explaining_read_connection():
+        with read_connection() as db:
+            yield ExplainingConnection(db)
+    monkeypatch.setattr(pointsdb, "_read_connection", explaining_read_connection)
+    pointsdb.get_streamers_monthly_leaderboard()
+    assert "SEARCH redemptions USING COVERING INDEX redemptions_by_month_level (month=? AND level=?)" in query_plans[-1]
+
+def test_new_redemptions_have_epoch_and_month():
+    pointsdb = insert_data()
+    rows = pointsdb.db.execute("SELECT redeemed_at, redeemed_at_epoch, month FROM redemptions").fetchall()
+    assert len(rows) == 5
+    for (redeemed_at, redeemed_at_epoch, month) in rows:
+        timestamp = datetime.fromisoformat(redeemed_at)
+        assert redeemed_at_epoch == int(timestamp.timestamp())
+        assert month == f"{timestamp.year}-{timestamp.month:02d}"
+
+@pytest.mark.parametrize("format", ["ndjson", "csv"])
+def test_export_then_import_redemptions(format):
+    pointsdb = insert_data()
+    file = io.StringIO()
+    write_redemptions(file, format, pointsdb.export_redemptions(batch_size=2))
+
+    file.seek(0)
+    new_pointsdb = PointsDb(":memory:")
+    progress_reports = []
+    result = new_pointsdb.import_redemptions(read_redemptions(file, format), batch_size=2, progress=progress_reports.append)
+    assert result == PointsDb.ImportResult(read=5, inserted=5)
+    assert progress_reports[-1] == result
+    assert len(progress_reports) == 3
+    assert list(new_pointsdb.export_redemptions()) == list(pointsdb.export_redemptions())
+    assert new_pointsdb.get_lifetime_channel_points("streamer_1") == pointsdb.get_lifetime_channel_points("streamer_1")
+    assert new_pointsdb.get_monthly_channel_points("streamer_2") == pointsdb.get_monthly_channel_points("streamer_2")
+    assert new_pointsdb.get_monthly_user_points("user_1") == pointsdb.get_monthly_user_points("user_1")
+
+def test_import_skips_existing_redemptions():
+    pointsdb = insert_data()
+    redemptions = list(pointsdb.export_redemptions())
+    new_redemption = redemptions[0]._replace(redemption_id="brand-new")
+    result = pointsdb.import_redemptions(redemptions + [new_redemption])
+    assert result == PointsDb.ImportResult(read=6, inserted=1)
+    assert [("user_1", 13), ("user_2", 1)] == pointsdb.get_lifetime_channel_points("streamer_1")
+
+def test_import_and_export_command_line(tmp_path):
+    source_db_path = str(tmp_path / "source.db")
+    source_pointsdb = PointsDb(source_db_path)
+    source_pointsdb.import_redemptions(insert_data().export_redemptions())
+    export_path = str(tmp_path / "redemptions.csv")
+    first.pointsdb.main(["--db", source_db_path, "export", export_path])
+
+    destination_db_path = str(tmp_path / "destination.db")
+    first.pointsdb.main(["--db", destination_db_path, "import", export_path])
+    first.pointsdb.main(["--db", destination_db_path, "import", export_path])
+    assert list(PointsDb(destination_db_path).export_redemptions()) == list(source_pointsdb.export_redemptions())
+
+def test_insert_journaled_redemptions_is_idempotent():
+    pointsdb = PointsDb(":memory:")
+    assert pointsdb.get_journal_offset("redemptions") == 0
+    redemptions = [
+        first.pointsdb.Redemption(
+            broadcaster_id = "streamer_1",
+            redemption_id = f"redemption_{i}",
+            user_id = "user_1",
+            redeemed_at = datetime.fromisoformat(get_current_year_month()+"01T18:37:32Z"),
+            points = 5,
+            level = 1,
+        )
+        for i in range(3)
+    ]
+    assert redemptions[:2] == pointsdb.insert_journaled_redemptions(redemptions[:2], journal_name="redemptions", journal_offset=100)
+    assert pointsdb.get_journal_offset("redemptions") == 100
+    # Replaying after a crash inserts only the new redemption.
+    assert redemptions[2:] == pointsdb.insert_journaled_redemptions(redemptions, journal_name="redemptions", journal_offset=150)
+    assert pointsdb.get_journal_offset("redemptions") == 150
+    assert [("user_1", 15)] == pointsdb.get_lifetime_channel_points("streamer_1")
@@ -1,3 +1,4 @@
+import json
 import pytest
 import responses
 from first.twitch import Twitch, AuthenticatedTwitch
@@ -61,3 +62,29 @@ def test_authenticated_request_refreshes_token_on_auth_failure():
     display_name = twitch.get_user_display_name_by_user_id("12345")
     assert token_provider.get_access_token() == "updated_access_token", "token should have refreshed"
     assert display_name == "TwitchDev", "API should have been called with refreshed token"
+
+@responses.activate
+def test_get_users_by_user_ids_requests_100_users_at_a_time():
+    requested_id_counts = []
+    def get_users(request):
+        user_ids = urllib.parse.parse_qs(urllib.parse.urlparse(request.url).query)["id"]
+        requested_id_counts.append(len(user_ids))
+        # User 7 was deleted.
+        return (200, {}, json.dumps({"data": [{"id": user_id, "login": f"user{user_id}", "display_name": f"User{user_id}"} for user_id in user_ids if user_id != "7"]}))
+    responses.add_callback(responses.GET, "https://api.twitch.tv/helix/users", callback=get_users)
+
+    class TestTokenProvider:
+        def get_access_token(self) -> Token:
+            return "access_token"
+
+        def refresh_access_token(self) -> Token:
+            raise AssertionError("token should not be refreshed")
+
+    twitch = AuthenticatedTwitch(TestTokenProvider())
+    user_ids = [str(i) for i in range(250)]
+    users = twitch.get_users_by_user_ids(user_ids)
+    assert requested_id_counts == [100, 100, 50]
+    assert users["0"] == ("user0", "User0")
+    assert "7" not in users
+    assert len(users) == 249
+    assert twitch.get_user_display_names_by_user_ids(["0", "7"]) == {"0": "User0"}
@@ -3,12 +3,15 @@ from first.pointsdb import PointsDb
 from first.twitch import AuthenticatedTwitch
 from first.twitch_eventsub import TwitchEventSubWebSocketThread, TwitchEventSubDelegate
 from first.web_server import PointsDbTwitchEventSubDelegate
+from first.journal import Journal
 from first.accountdb import FirstAccountDb
 from first.authdb import TwitchAuthDb
+from first.users_cache import TwitchUserNameCache
 import contextlib
 import copy
 import json
 import pytest
+import responses
 import threading
 import typing
 import websockets.sync.server
@@ -156,6 +159,138 @@ def test_eventsub_delegate_stores_data_in_pointsdb():
     leaderboard = points_db.get_lifetime_channel_points(broadcaster_id="123")
     assert leaderboard == [("456", 5)]
 
+def test_eventsub_delegate_records_stream_sessions():
+    points_db = PointsDb(":memory:")
+    account_db = FirstAccountDb(":memory:")
+    authdb = TwitchAuthDb(":memory:")
+    delegate = PointsDbTwitchEventSubDelegate(points_db, account_db, authdb)
+    delegate.on_eventsub_notification(
+        subscription_type="stream.online",
+        subscription_version="1",
+        event_data={
+            "id": "9001",
+            "broadcaster_user_id": "123",
+            "broadcaster_user_login": "strimmer",
+            "broadcaster_user_name": "strimmer",
+            "type": "live",
+            "started_at": "2023-07-13T11:49:36.525368238Z",
+        },
+    )
+    session = points_db.get_latest_stream_session("123")
+    assert session.stream_id == "9001"
+    assert session.ended_at is None
+
+    delegate.on_eventsub_notification(
+        subscription_type="stream.offline",
+        subscription_version="1",
+        event_data={
+            "broadcaster_user_id": "123",
+            "broadcaster_user_login": "strimmer",
+            "broadcaster_user_name": "strimmer",
+        },
+    )
+    session = points_db.get_latest_stream_session("123")
+    assert session.ended_at is not None
+
+def test_eventsub_delegate_journals_redemptions(tmp_path, monkeypatch):
+    updated_rewards = []
+    monkeypatch.setattr(AuthenticatedTwitch, "update_channel_reward", lambda self, broadcaster_id, reward_id, new_title, max_redemptions: updated_rewards.append((broadcaster_id, new_title)))
+    points_db = PointsDb(":memory:")
+    account_db = FirstAccountDb(":memory:")
+    authdb = TwitchAuthDb(":memory:")
+    account_db.create_or_get_account(twitch_user_id="123")
+    account_db.set_account_reward_id("1", "b34cd9ba-40de-4953-80f8-57362376f8e0")
+    journal_path = str(tmp_path / "redemptions.journal")
+    delegate = PointsDbTwitchEventSubDelegate(points_db, account_db, authdb, journal=Journal(journal_path))
+    event_data = {
+        "broadcaster_user_id": "123",
+        "id": "addae886-719e-4427-8f19-8152a260a806",
+        "user_id": "456",
+        "redeemed_at": "2023-07-13T11:49:36.525368238Z",
+        "reward": {
+            "id": "b34cd9ba-40de-4953-80f8-57362376f8e0",
+            "title": "first",
+        },
+    }
+    delegate.on_eventsub_notification(
+        subscription_type="channel.channel_points_custom_reward_redemption.add",
+        subscription_version="1",
+        event_data=event_data,
+    )
+    assert points_db.get_lifetime_channel_points(broadcaster_id="123") == [], "redemption should only be journaled"
+
+    projector = delegate.create_journal_projector()
+    assert projector.project_pending() == 1
+    assert points_db.get_lifetime_channel_points(broadcaster_id="123") == [("456", 5)]
+    assert updated_rewards == [("123", "second")]
+
+    # Simulate a crash before the journal offset was recorded.
+    points_db.set_journal_offset("redemptions", 0)
+    delegate = PointsDbTwitchEventSubDelegate(points_db, account_db, authdb, journal=Journal(journal_path))
+    assert delegate.create_journal_projector().project_pending() == 1
+    assert points_db.get_lifetime_channel_points(broadcaster_id="123") == [("456", 5)]
+    assert updated_rewards == [("123", "second")], "replayed redemption should not update the reward again"
+
+@responses.activate
+def test_eventsub_delegate_writes_redeeming_users_to_users_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(AuthenticatedTwitch, "update_channel_reward", lambda self, broadcaster_id, reward_id, new_title, max_redemptions: None)
+    points_db = PointsDb(":memory:")
+    account_db = FirstAccountDb(":memory:")
+    authdb = TwitchAuthDb(":memory:")
+    users_cache = TwitchUserNameCache(":memory:")
+    account_db.create_or_get_account(twitch_user_id="123")
+    account_db.set_account_reward_id("1", "b34cd9ba-40de-4953-80f8-57362376f8e0")
+    delegate = PointsDbTwitchEventSubDelegate(points_db, account_db, authdb, journal=Journal(str(tmp_path / "redemptions.journal")), users_cache=users_cache)
+    for (redemption_id, user_id, user_name) in [("r1", "456", "Chatter"), ("r2", "789", "Lurker")]:
+        delegate.on_eventsub_notification(
+            subscription_type="channel.channel_points_custom_reward_redemption.add",
+            subscription_version="1",
+            event_data={
+                "broadcaster_user_id": "123",
+                "broadcaster_user_login": "strimmer",
+                "broadcaster_user_name": "Strimmer",
+                "id": redemption_id,
+                "user_id": user_id,
+                "user_login": user_name.lower(),
+                "user_name": user_name,
+                "reward": {
+                    "id": "b34cd9ba-40de-4953-80f8-57362376f8e0",
+                    "title": "first",
+                },
+            },
+        )
+    assert delegate.create_journal_projector().project_pending() == 2
+    # No /helix/users request is made. (responses would reject it.)
+    assert users_cache.get_display_name_from_id_batch(["123", "456", "789"]) == {"123": "Strimmer", "456": "Chatter", "789": "Lurker"}
+    assert users_cache.get_user_login_from_id("456") == "chatter"
+
+def test_eventsub_delegate_skips_unprojectable_journaled_redemptions(tmp_path, monkeypatch):
+    monkeypatch.setattr(AuthenticatedTwitch, "update_channel_reward", lambda self, broadcaster_id, reward_id, new_title, max_redemptions: None)
+    points_db = PointsDb(":memory:")
+    account_db = FirstAccountDb(":memory:")
+    authdb = TwitchAuthDb(":memory:")
+    account_db.create_or_get_account(twitch_user_id="123")
+    account_db.set_account_reward_id("1", "b34cd9ba-40de-4953-80f8-57362376f8e0")
+    delegate = PointsDbTwitchEventSubDelegate(points_db, account_db, authdb, journal=Journal(str(tmp_path / "redemptions.journal")))
+    for (redemption_id, broadcaster_id, title) in [("unknown-broadcaster", "999", "first"), ("renamed-reward", "123", "zeroth"), ("valid", "123", "first")]:
+        delegate.on_eventsub_notification(
+            subscription_type="channel.channel_points_custom_reward_redemption.add",
+            subscription_version="1",
+            event_data={
+                "broadcaster_user_id": broadcaster_id,
+                "id": redemption_id,
+                "user_id": "456",
+                "reward": {
+                    "id": "b34cd9ba-40de-4953-80f8-57362376f8e0",
+                    "title": title,
+                },
+            },
+        )
+    projector = delegate.create_journal_projector()
+    projector.project_pending()
+    assert points_db.get_lifetime_channel_points(broadcaster_id="123") == [("456", 5)]
+    assert projector.project_pending() == 0, "skipped entries should not be retried"
+
 class FailingTokenProvider(TokenProvider):
     def get_access_token(self) -> Token:
         raise AssertionError("should not be called")
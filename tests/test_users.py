@@ -1,4 +1,5 @@
 import pytest
+import sqlite3
 import threading
 from first.usersdb import TwitchUsersDb
 from first.config import cfg
@@ -47,3 +48,38 @@ def test_update_exisitng_user_name():
     )
     assert "potato" == usersdb.get_user_login_from_id(user_id="5")
     assert "Tomato" == usersdb.get_user_name_from_id(user_id="5")
+
+def test_upsert_users_keeps_unknown_fields():
+    usersdb = TwitchUsersDb(":memory:")
+    usersdb.insert_or_update_user(user_id="5", user_login="potato", user_name="Potato")
+    usersdb.upsert_users([
+        TwitchUsersDb.UserInfo(user_id="5", user_login="tomato"),
+        TwitchUsersDb.UserInfo(user_id="6", user_name="Carrot"),
+        TwitchUsersDb.UserInfo(user_id="7", user_login="leek", user_name="Leek"),
+    ])
+    assert usersdb.get_user_login_from_id(user_id="5") == "tomato"
+    assert usersdb.get_user_name_from_id(user_id="5") == "Potato"
+    assert usersdb.get_user_login_from_id(user_id="6") == ""
+    assert usersdb.get_user_name_from_id(user_id="6") == "Carrot"
+    assert usersdb.get_user_names_from_ids(["5", "6", "7"]) == {"5": "Potato", "6": "Carrot", "7": "Leek"}
+
+def test_users_without_fetched_time_are_stale(tmp_path):
+    db_path = str(tmp_path / "users.db")
+    old_db = sqlite3.connect(db_path)
+    old_db.execute("CREATE TABLE users(user_id UNIQUE, user_login, user_name)")
+    old_db.execute("INSERT INTO users VALUES ('1', 'one', 'One')")
+    old_db.commit()
+    old_db.close()
+    usersdb = TwitchUsersDb(db_path)
+    usersdb.run_online_migrations()
+    usersdb.insert_or_update_user(user_id="2", user_login="two", user_name="Two")
+    assert usersdb.get_user_ids_fetched_before(fetched_before_epoch=0, limit=10) == ["1"]
+    usersdb.mark_users_fetched(["1"])
+    assert usersdb.get_user_ids_fetched_before(fetched_before_epoch=0, limit=10) == []
+
+def test_user_ids_from_logins_prefer_most_recently_fetched_user():
+    usersdb = TwitchUsersDb(":memory:")
+    usersdb.upsert_users([TwitchUsersDb.UserInfo(user_id="1", user_login="potato")])
+    usersdb.upsert_users([TwitchUsersDb.UserInfo(user_id="2", user_login="potato", user_name="Potato")])
+    usersdb.upsert_users([TwitchUsersDb.UserInfo(user_id="3", user_login="tomato", user_name="Tomato")])
+    assert usersdb.get_user_ids_from_logins(["potato", "tomato", "carrot"]) == {"potato": "2", "tomato": "3"}
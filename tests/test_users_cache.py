@@ -0,0 +1,180 @@
+import json
+import pytest
+import threading
+import time
+import responses
+import urllib.parse
+from first.errors import UserNotFoundError
+from first.users_cache import TwitchUserNameCache
+
+def mock_twitch_users(display_names, logins={}):
+    """Make /helix/users return the given users. Returns the list of requested
+    ID lists.
+
+    A user's login defaults to their lowercased display name.
+    """
+    requests = []
+    def get_users(request):
+        user_ids = urllib.parse.parse_qs(urllib.parse.urlparse(request.url).query)["id"]
+        requests.append(user_ids)
+        return (200, {}, json.dumps({"data": [
+            {"id": user_id, "login": logins.get(user_id, display_names[user_id].lower()), "display_name": display_names[user_id]}
+            for user_id in user_ids
+            if user_id in display_names
+        ]}))
+    responses.post("https://id.twitch.tv/oauth2/token", json={"access_token": "app_access_token"})
+    responses.add_callback(responses.GET, "https://api.twitch.tv/helix/users", callback=get_users)
+    return requests
+
+@responses.activate
+def test_display_names_are_cached_in_memory():
+    requests = mock_twitch_users({"1": "One"})
+    users_cache = TwitchUserNameCache(":memory:")
+    assert users_cache.get_display_name_from_id("1") == "One"
+    assert users_cache.get_display_name_from_id("1") == "One"
+    assert requests == [["1"]]
+    stats = users_cache.get_memory_cache_stats()
+    assert (stats.hits, stats.misses) == (1, 1)
+
+@responses.activate
+def test_deleted_users_are_cached_in_memory():
+    requests = mock_twitch_users({})
+    users_cache = TwitchUserNameCache(":memory:")
+    assert users_cache.get_display_name_from_id("1") == "DELETED USER ID 1"
+    assert users_cache.get_display_name_from_id_batch(["1"]) == {"1": "DELETED USER ID 1"}
+    assert requests == [["1"]]
+
+def test_concurrent_misses_share_one_twitch_request(monkeypatch):
+    users_cache = TwitchUserNameCache(":memory:")
+    requests = []
+    release_request = threading.Event()
+    def get_users_by_user_ids(user_ids):
+        requests.append(list(user_ids))
+        release_request.wait()
+        return {"1": ("one", "One")}
+    monkeypatch.setattr(users_cache.twitch, "get_users_by_user_ids", get_users_by_user_ids)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(users_cache.get_display_name_from_id_batch(["1", "2"]))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 10
+    while users_cache.get_fetch_stats().coalesced_users < 8:
+        assert time.monotonic() < deadline, "timed out waiting for threads to miss"
+        time.sleep(0.001)
+    release_request.set()
+    for thread in threads:
+        thread.join()
+    assert requests == [["1", "2"]]
+    assert results == [{"1": "One", "2": "DELETED USER ID 2"}] * 5
+    assert users_cache.get_fetch_stats() == TwitchUserNameCache.FetchStats(fetched_users=2, coalesced_users=8)
+
+def test_failed_fetch_fails_coalesced_lookups(monkeypatch):
+    users_cache = TwitchUserNameCache(":memory:")
+    release_request = threading.Event()
+    def get_users_by_user_ids(user_ids):
+        release_request.wait()
+        raise ConnectionError("Twitch is down")
+    monkeypatch.setattr(users_cache.twitch, "get_users_by_user_ids", get_users_by_user_ids)
+
+    errors = []
+    def look_up() -> None:
+        try:
+            users_cache.get_display_name_from_id("1")
+        except ConnectionError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=look_up) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 10
+    while users_cache.get_fetch_stats().coalesced_users < 1:
+        assert time.monotonic() < deadline, "timed out waiting for threads to miss"
+        time.sleep(0.001)
+    release_request.set()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 2
+
+    # The failure is not cached.
+    monkeypatch.setattr(users_cache.twitch, "get_users_by_user_ids", lambda user_ids: {"1": ("one", "One")})
+    assert users_cache.get_display_name_from_id("1") == "One"
+
+@responses.activate
+def test_user_ids_are_looked_up_by_login():
+    requested_logins = []
+    def get_users(request):
+        user_logins = urllib.parse.parse_qs(urllib.parse.urlparse(request.url).query)["login"]
+        requested_logins.append(user_logins)
+        return (200, {}, json.dumps({"data": [{"id": "2", "login": "two", "display_name": "Two"}]}))
+    responses.post("https://id.twitch.tv/oauth2/token", json={"access_token": "app_access_token"})
+    responses.add_callback(responses.GET, "https://api.twitch.tv/helix/users", callback=get_users)
+    users_cache = TwitchUserNameCache(":memory:")
+    users_cache.set_user_info(user_id="1", user_login="one", display_name="One")
+
+    assert users_cache.get_user_ids_from_user_names_batch(["One", "two", "three"]) == {"one": "1", "two": "2"}
+    assert requested_logins == [["two", "three"]]
+    assert users_cache.get_display_name_from_id("2") == "Two"
+    assert users_cache.get_user_id_from_user_name("two") == "2"
+    with pytest.raises(UserNotFoundError):
+        users_cache.get_user_id_from_user_name("three")
+    assert requested_logins == [["two", "three"]]
+
+def test_set_user_info_updates_memory_cache():
+    users_cache = TwitchUserNameCache(":memory:")
+    users_cache.set_user_info(user_id="1", display_name="One")
+    assert users_cache.get_display_name_from_id("1") == "One"
+    users_cache.set_user_info(user_id="1", display_name="Uno")
+    assert users_cache.get_display_name_from_id("1") == "Uno"
+
+def test_set_users_info_skips_users_already_in_memory_cache(monkeypatch):
+    users_cache = TwitchUserNameCache(":memory:")
+    users_cache.set_users_info([
+        TwitchUserNameCache.UserInfo(user_id="1", user_login="one", user_name="One"),
+        TwitchUserNameCache.UserInfo(user_id="2", user_login="two", user_name="Two"),
+        TwitchUserNameCache.UserInfo(user_id="1", user_login="uno", user_name="Uno"),
+    ])
+    assert users_cache.get_user_login_from_id("1") == "uno"
+    assert users_cache.get_display_name_from_id_batch(["1", "2"]) == {"1": "Uno", "2": "Two"}
+
+    written_user_ids = []
+    monkeypatch.setattr(users_cache, "upsert_users", lambda users: written_user_ids.extend(user.user_id for user in users))
+    users_cache.set_users_info([
+        TwitchUserNameCache.UserInfo(user_id="1", user_login="uno", user_name="Uno"),
+        TwitchUserNameCache.UserInfo(user_id="2", user_login="deux", user_name="Deux"),
+    ])
+    assert written_user_ids == ["2"]
+
+@responses.activate
+def test_stale_display_names_are_refreshed_in_batches(monkeypatch):
+    requests = mock_twitch_users({f"{i}": f"Renamed{i}" for i in range(150)})
+    users_cache = TwitchUserNameCache(":memory:")
+    monkeypatch.setattr(time, "time", lambda: 1_000_000)
+    for i in range(151):
+        users_cache.set_user_info(user_id=f"{i}", display_name=f"User{i}")
+    assert users_cache.refresh_stale_display_names(max_age_seconds=100) == 0
+    assert requests == []
+
+    monkeypatch.setattr(time, "time", lambda: 1_000_081)
+    assert users_cache.refresh_stale_display_names(max_age_seconds=100) == 151
+    assert [len(user_ids) for user_ids in requests] == [100, 51]
+    assert users_cache.get_display_name_from_id("0") == "Renamed0"
+    assert users_cache.get_user_name_from_id("149") == "Renamed149"
+    # User 150 was deleted. Its old name is kept, but it is not fetched again
+    # until it is stale again.
+    assert users_cache.get_user_name_from_id("150") == "User150"
+    assert users_cache.refresh_stale_display_names(max_age_seconds=100) == 0
+
+@responses.activate
+def test_refreshing_display_names_updates_renamed_logins(monkeypatch):
+    mock_twitch_users({"1": "Alice2", "2": "Alice"})
+    users_cache = TwitchUserNameCache(":memory:")
+    monkeypatch.setattr(time, "time", lambda: 1_000_000)
+    users_cache.set_user_info(user_id="1", user_login="alice", display_name="Alice")
+    # User 1 renamed, then user 2 took user 1's old login.
+    monkeypatch.setattr(time, "time", lambda: 1_000_050)
+    users_cache.set_user_info(user_id="2", user_login="alice", display_name="Alice")
+
+    monkeypatch.setattr(time, "time", lambda: 1_000_081)
+    assert users_cache.refresh_stale_display_names(max_age_seconds=100) == 1
+    assert users_cache.get_user_login_from_id("1") == "alice2"
+    assert users_cache.get_user_ids_from_user_names_batch(["alice", "alice2"]) == {"alice": "2", "alice2": "1"}
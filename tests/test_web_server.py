@@ -1,10 +1,16 @@
+import json
 import base64
 import urllib.parse
 import responses
 import time
 import pytest
 import first.web_server
+from datetime import datetime, timedelta, timezone
 from first.accountdb import FirstAccountDb
+from first.pointsdb import PointsDb
+from first.users_cache import TwitchUserNameCache
+from first.backup import BackupScheduler
+from first.usersdb import TwitchUsersDb
 from first.authdb import TwitchAuthDb, UserNotFoundError
 from first.twitch_eventsub import TwitchEventSubWebSocketManager, FakeTwitchEventSubWebSocketThread, stub_twitch_eventsub_delegate
 import first.config
@@ -55,7 +61,7 @@ def test_new_eventsub_connection_for_logged_in_users_with_reward_id_on_start(aut
     assert len(threads) == 2, "should have a thread for accounts 1 and 2 but not account 3"
     assert all(thread.running for thread in threads)
 
-admin_endpoints = ["/admin", "/admin/eventsub"]
+admin_endpoints = ["/admin", "/admin/eventsub", "/admin/metrics", "/admin/backups"]
 
 def test_admin_pages_require_authentication(web_app):
     for endpoint in admin_endpoints:
@@ -202,3 +208,190 @@ def test_unsetting_reward_id_stops_eventsub_connection(web_app, account_db, auth
 
     websocket_threads = websocket_manager.get_all_threads_for_testing()
     assert len(websocket_threads) == 0, "should have stopped the thread"
+
+def test_stream_leaderboard_is_paginated(authdb, websocket_manager, account_db, monkeypatch):
+    monkeypatch.setattr(first.web_server, "LEADERBOARD_PAGE_SIZE", 2)
+    points_db = PointsDb(":memory:")
+    users_cache = TwitchUserNameCache(":memory:")
+    users_cache.set_user_info(user_id="100", display_name="Streamer")
+    for i in range(3):
+        users_cache.set_user_info(user_id=f"{i}", display_name=f"Viewer{i}")
+        points_db.insert_new_redemption(
+            broadcaster_id="100",
+            redemption_id=f"redemption-{i}",
+            user_id=f"{i}",
+            redeemed_at=datetime.now(timezone.utc),
+            points=5 - i,
+            level=1,
+        )
+    app = first.web_server.create_app_for_testing(account_db=account_db, authdb=authdb, points_db=points_db, eventsub_websocket_manager=websocket_manager, twitch_users_cache=users_cache)
+    web_app = app.test_client()
+
+    response = web_app.get("/stream/100")
+    assert response.status_code == 200
+    assert "Viewer0" in response.text
+    assert "Viewer1" in response.text
+    assert "Viewer2" not in response.text
+    assert "page=2" in response.text, "should link to the next page"
+
+    response = web_app.get("/stream/100?page=2")
+    assert response.status_code == 200
+    assert "Viewer0" not in response.text
+    assert "Viewer2" in response.text
+    assert "page=3" not in response.text, "should not link past the last page"
+
+    # Date ranges are paginated too.
+    today = datetime.now(timezone.utc).date().isoformat()
+    response = web_app.get(f"/stream/100?page=2&from={today}&to={today}")
+    assert response.status_code == 200
+    assert "Viewer0" not in response.text
+    assert "Viewer2" in response.text
+
+def test_stream_leaderboard_with_date_range(authdb, websocket_manager, account_db):
+    points_db = PointsDb(":memory:")
+    users_cache = TwitchUserNameCache(":memory:")
+    users_cache.set_user_info(user_id="100", display_name="Streamer")
+    for (i, redeemed_at) in enumerate([datetime(2023, 7, 1, 12, tzinfo=timezone.utc), datetime(2023, 7, 5, 12, tzinfo=timezone.utc)]):
+        users_cache.set_user_info(user_id=f"{i}", display_name=f"Viewer{i}")
+        points_db.insert_new_redemption(
+            broadcaster_id="100",
+            redemption_id=f"redemption-{i}",
+            user_id=f"{i}",
+            redeemed_at=redeemed_at,
+            points=5,
+            level=1,
+        )
+    app = first.web_server.create_app_for_testing(account_db=account_db, authdb=authdb, points_db=points_db, eventsub_websocket_manager=websocket_manager, twitch_users_cache=users_cache)
+    web_app = app.test_client()
+
+    response = web_app.get("/stream/100?from=2023-07-01&to=2023-07-01")
+    assert response.status_code == 200
+    assert "Top from 2023-07-01 to 2023-07-01" in response.text
+    range_section = response.text.split("Top from")[1].split("</section>")[0]
+    assert "Viewer0" in range_section
+    assert "Viewer1" not in range_section
+
+    response = web_app.get("/stream/100?from=2023-07-02&to=2023-07-05")
+    assert response.status_code == 200
+    range_section = response.text.split("Top from")[1].split("</section>")[0]
+    assert "Viewer0" not in range_section
+    assert "Viewer1" in range_section
+
+    response = web_app.get("/stream/100")
+    assert "Top from" not in response.text
+
+    response = web_app.get("/stream/100?from=yesterday")
+    assert response.status_code == 400
+
+@responses.activate
+def test_stream_leaderboard_accepts_login_names(authdb, websocket_manager, account_db):
+    responses.post("https://id.twitch.tv/oauth2/token", json={"access_token": "app_access_token"})
+    helix_users = responses.get("https://api.twitch.tv/helix/users", json={"data": []})
+    points_db = PointsDb(":memory:")
+    users_cache = TwitchUserNameCache(":memory:")
+    users_cache.set_user_info(user_id="100", user_login="streamer", display_name="Streamer")
+    users_cache.set_user_info(user_id="1", display_name="Viewer1")
+    points_db.insert_new_redemption(broadcaster_id="100", redemption_id="redemption-1", user_id="1", redeemed_at=datetime.now(timezone.utc), points=5, level=1)
+    app = first.web_server.create_app_for_testing(account_db=account_db, authdb=authdb, points_db=points_db, eventsub_websocket_manager=websocket_manager, twitch_users_cache=users_cache)
+    web_app = app.test_client()
+
+    for path in ["/stream/streamer", "/stream/Streamer"]:
+        response = web_app.get(path)
+        assert response.status_code == 200
+        assert "Viewer1" in response.text
+    assert helix_users.call_count == 0, "known logins should not be looked up on Twitch"
+
+    assert web_app.get("/stream/nobody").status_code == 404
+    assert web_app.get("/stream/nobody").status_code == 404
+    assert helix_users.call_count == 1, "unknown logins should be remembered"
+    assert web_app.get("/stream/not.a.login").status_code == 404
+    assert helix_users.call_count == 1
+
+def test_stream_leaderboard_shows_current_stream(authdb, websocket_manager, account_db):
+    points_db = PointsDb(":memory:")
+    users_cache = TwitchUserNameCache(":memory:")
+    users_cache.set_user_info(user_id="100", display_name="Streamer")
+    users_cache.set_user_info(user_id="1", display_name="Viewer1")
+    app = first.web_server.create_app_for_testing(account_db=account_db, authdb=authdb, points_db=points_db, eventsub_websocket_manager=websocket_manager, twitch_users_cache=users_cache)
+    web_app = app.test_client()
+
+    response = web_app.get("/stream/100")
+    assert "current stream" not in response.text
+
+    now = datetime.now(timezone.utc)
+    points_db.start_stream_session(broadcaster_id="100", stream_id="9001", started_at=now - timedelta(minutes=5))
+    points_db.insert_new_redemption(broadcaster_id="100", redemption_id="redemption-1", user_id="1", redeemed_at=now, points=5, level=1)
+    response = web_app.get("/stream/100")
+    assert response.status_code == 200
+    stream_section = response.text.split("current stream")[1].split("</section>")[0]
+    assert "Viewer1" in stream_section
+
+def test_stream_leaderboard_reads_display_names_from_attached_users_db(authdb, websocket_manager, account_db, tmp_path):
+    users_db_path = str(tmp_path / "users.db")
+    TwitchUsersDb(users_db_path).insert_or_update_user(user_id="1", user_name="Viewer1")
+    points_db = PointsDb(str(tmp_path / "points.db"), users_db=users_db_path)
+    points_db.insert_new_redemption(broadcaster_id="100", redemption_id="redemption-1", user_id="1", redeemed_at=datetime.now(timezone.utc), points=5, level=1)
+    # This cache does not know Viewer1, and would ask Twitch for their name.
+    users_cache = TwitchUserNameCache(":memory:")
+    users_cache.set_user_info(user_id="100", display_name="Streamer")
+    app = first.web_server.create_app_for_testing(account_db=account_db, authdb=authdb, points_db=points_db, eventsub_websocket_manager=websocket_manager, twitch_users_cache=users_cache)
+    web_app = app.test_client()
+
+    response = web_app.get("/stream/100")
+    assert response.status_code == 200
+    assert "Viewer1" in response.text
+
+def test_admin_can_start_backup(tmp_path, authdb, account_db, set_admin_password):
+    points_db = PointsDb(str(tmp_path / "points.db"))
+    backup_scheduler = BackupScheduler({"points": points_db}, directory=str(tmp_path / "backups"), pause_seconds=0)
+    app = first.web_server.create_app_for_testing(account_db=account_db, authdb=authdb, points_db=points_db, backup_scheduler=backup_scheduler)
+    app.debug = True
+    web_app = app.test_client()
+    set_admin_password("hunter12")
+    response = web_app.post("/admin/backups", headers=http_basic_auth_headers("admin", "hunter12"))
+    assert response.status_code == 302
+    deadline = time.monotonic() + 10
+    while not backup_scheduler.get_statuses()[0].backups:
+        assert time.monotonic() < deadline, "backup should finish"
+        time.sleep(0.01)
+    response = web_app.get("/admin/backups", headers=http_basic_auth_headers("admin", "hunter12"))
+    assert response.status_code == 200
+    assert backup_scheduler.get_statuses()[0].backups[0] in response.text
+
+@responses.activate
+def test_stream_leaderboard_fetches_missing_display_names_in_batches(authdb, websocket_manager, account_db, monkeypatch):
+    monkeypatch.setattr(first.web_server, "LEADERBOARD_PAGE_SIZE", 150)
+    responses.post("https://id.twitch.tv/oauth2/token", json={"access_token": "app_access_token"})
+    requested_id_counts = []
+    def get_users(request):
+        user_ids = urllib.parse.parse_qs(urllib.parse.urlparse(request.url).query)["id"]
+        requested_id_counts.append(len(user_ids))
+        return (200, {}, json.dumps({"data": [{"id": user_id, "login": f"viewer{user_id}", "display_name": f"Viewer{user_id}"} for user_id in user_ids]}))
+    responses.add_callback(responses.GET, "https://api.twitch.tv/helix/users", callback=get_users)
+
+    points_db = PointsDb(":memory:")
+    users_cache = TwitchUserNameCache(":memory:")
+    users_cache.set_user_info(user_id="100", display_name="Streamer")
+    for i in range(150):
+        points_db.insert_new_redemption(
+            broadcaster_id="100",
+            redemption_id=f"redemption-{i}",
+            user_id=f"viewer-{i}",
+            redeemed_at=datetime.now(timezone.utc),
+            points=5,
+            level=1,
+        )
+    app = first.web_server.create_app_for_testing(account_db=account_db, authdb=authdb, points_db=points_db, eventsub_websocket_manager=websocket_manager, twitch_users_cache=users_cache)
+    web_app = app.test_client()
+
+    response = web_app.get("/stream/100")
+    assert response.status_code == 200
+    assert "Viewerviewer-149" in response.text
+    # The lifetime and monthly leaderboards share viewers, so each viewer is
+    # only fetched once.
+    assert sorted(requested_id_counts) == [50, 100]
+
+    requested_id_counts.clear()
+    response = web_app.get("/stream/100")
+    assert response.status_code == 200
+    assert requested_id_counts == [], "display names should have been stored"